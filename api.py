@@ -61,10 +61,10 @@ async def handle_query(request: Request):
         )
 
     # 定义一个生成器函数，用于流式返回答案（逐 token 输出）
-    def generate_response():
+    async def generate_response():
         try:
-            # 调用问答系统的核心 query 方法，返回生成器（每次产出一个 token）
-            for token, is_complete in qa_system.query(
+            # 调用问答系统的异步 aquery 方法，返回异步生成器（每次产出一个 token），Redis 调用不阻塞事件循环
+            async for token, is_complete in qa_system.aquery(
                 query=query,
                 source_filter=source_filter,
                 session_id=session_id
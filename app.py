@@ -84,7 +84,8 @@ async def create_session():
 @app.get("/api/history/{session_id}")
 async def get_history(session_id: str):
     try:
-        history = qa_system.get_session_history(session_id)
+        # 异步读取: 先查 Redis, 未命中时用异步 MySQL 连接池查询, 不阻塞事件循环
+        history = await qa_system.aget_session_history(session_id)
         return {"session_id": session_id, "history": history}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取历史记录失败: {str(e)}")
@@ -92,7 +93,7 @@ async def get_history(session_id: str):
 # 清除历史消息
 @app.delete("/api/history/{session_id}")
 async def clear_history(session_id: str):
-    success = qa_system.clear_session_history(session_id)
+    success = await qa_system.aclear_session_history(session_id)
     if success:
         return {"status": "success", "message": "历史记录已清除"}
     else:
@@ -124,8 +125,9 @@ async def query(request: QueryRequest):
             "session_id": session_id,
             "processing_time": time.time() - start_time
         }
-    # 执行 BM25 搜索
-    answer, need_rag = qa_system.bm25_search.search(request.query, threshold=0.85)
+    # 执行 BM25 搜索: 缓存走异步 Redis 客户端, 不阻塞其他连接
+    answer, need_rag = await qa_system.bm25_search.asearch(request.query, threshold=0.85,
+                                                           source_filter=request.source_filter)
     if need_rag:
         # 需要 RAG，提示使用 WebSocket
         return {
@@ -182,7 +184,7 @@ async def websocket_endpoint(websocket: WebSocket):
                 break
             # 调用问答系统，流式处理查询
             collected_answer = ""
-            for token, is_complete in qa_system.query(query, source_filter=source_filter, session_id=session_id):
+            async for token, is_complete in qa_system.aquery(query, source_filter=source_filter, session_id=session_id):
                 collected_answer += token  # 累积答案
                 if is_complete and not collected_answer:
                     if websocket.client_state == websocket.client_state.CONNECTED:
@@ -234,6 +236,12 @@ async def websocket_endpoint(websocket: WebSocket):
             print(f"Error closing WebSocket: {str(e)}")
 
 
+# 关闭异步 Redis 和 MySQL 连接池
+@app.on_event("shutdown")
+async def close_async_clients():
+    await qa_system.async_redis_client.close()
+    await qa_system.async_mysql_client.close()
+
 # 健康检查端点
 @app.get("/health")
 async def health_check():
@@ -1,6 +1,8 @@
 # base/config.py
 # 导入配置解析库
 import configparser
+# 导入字面量解析, 解析配置中的列表和字典, 不执行任意代码
+import ast
 # 导入路径操作库
 import os
 
@@ -27,6 +29,12 @@ class Config:
         self.MYSQL_PASSWORD = self.config.get('mysql', 'password', fallback='mysql')
         # MySQL 数据库名
         self.MYSQL_DATABASE = self.config.get('mysql', 'database', fallback='subjects_kg')
+        # 连接池: 每个进程的最大连接数, 连接全部借出时的最长等待时间(秒), 空闲多久(秒)的连接借出前先做健康检查
+        self.MYSQL_POOL_SIZE = self.config.getint('mysql', 'pool_size', fallback=20)
+        self.MYSQL_POOL_TIMEOUT = self.config.getfloat('mysql', 'pool_timeout', fallback=10.0)
+        self.MYSQL_POOL_PING_INTERVAL = self.config.getint('mysql', 'pool_ping_interval', fallback=30)
+        # 是否允许客户端 LOAD DATA LOCAL INFILE(知识库批量导入的快速路径, 需服务端同时开启)
+        self.MYSQL_LOCAL_INFILE = self.config.getboolean('mysql', 'local_infile', fallback=False)
 
         # Redis 配置
         # Redis 主机地址
@@ -37,6 +45,50 @@ class Config:
         self.REDIS_PASSWORD = self.config.get('redis', 'password', fallback='1234')
         # Redis 数据库编号
         self.REDIS_DB = self.config.getint('redis', 'db', fallback=0)
+        # Redis 部署模式: standalone 单机, sentinel 哨兵, cluster 集群
+        self.REDIS_MODE = self.config.get('redis', 'mode', fallback='standalone')
+        # 哨兵或集群节点列表, 如 [("127.0.0.1", 7000), ("127.0.0.1", 7001)]; 哨兵模式下还需主节点名称和哨兵密码
+        self.REDIS_NODES = ast.literal_eval(self.config.get('redis', 'nodes', fallback='[]'))
+        self.REDIS_SENTINEL_MASTER = self.config.get('redis', 'sentinel_master', fallback='mymaster')
+        self.REDIS_SENTINEL_PASSWORD = self.config.get('redis', 'sentinel_password', fallback='')
+        # 每个进程 Redis 连接池的最大连接数
+        self.REDIS_MAX_CONNECTIONS = self.config.getint('redis', 'max_connections', fallback=50)
+        # 阻塞读(single-flight 等待生成结果的 XREAD BLOCK)单独使用的连接池的最大连接数;
+        # 以及阻塞读连接池和单机异步连接池在连接用完时等待空闲连接的最长时间(秒)
+        self.REDIS_BLOCKING_MAX_CONNECTIONS = self.config.getint('redis', 'blocking_max_connections', fallback=200)
+        self.REDIS_BLOCKING_POOL_TIMEOUT = self.config.getfloat('redis', 'blocking_pool_timeout', fallback=10.0)
+        # Redis 值的序列化方式(msgpack/json)、压缩方式(zstd/lz4/zlib/none), 以及超过多少字节才压缩
+        self.REDIS_SERIALIZER = self.config.get('redis', 'serializer', fallback='msgpack')
+        self.REDIS_COMPRESSION = self.config.get('redis', 'compression', fallback='zstd')
+        self.REDIS_COMPRESS_THRESHOLD = self.config.getint('redis', 'compress_threshold', fallback=1024)
+        # 缓存配置
+        # 各命名空间缓存的过期时间(秒), 未列出的命名空间使用 CACHE_DEFAULT_TTL;
+        # rag 命名空间缓存大模型生成的答案, 向量库更新不会递增知识库版本号, 过期时间设得短一些
+        self.CACHE_TTLS = ast.literal_eval(self.config.get('cache', 'ttls', fallback='{"answer": 86400, "rag": 3600}'))
+        self.CACHE_DEFAULT_TTL = self.config.getint('cache', 'default_ttl', fallback=3600)
+        # Redis 内存上限(如 512mb), 为空时不修改 Redis 配置; 超出后按 LRU 淘汰带过期时间的缓存键
+        self.CACHE_MAX_MEMORY = self.config.get('cache', 'max_memory', fallback='')
+        # 单条缓存值的最大字节数, 超过时不写缓存
+        self.CACHE_MAX_VALUE_BYTES = self.config.getint('cache', 'max_value_bytes', fallback=65536)
+        # 本地缓存知识库版本号的时长(秒), 版本号递增后最多经过这么久各进程才会切换到新命名空间
+        self.CACHE_VERSION_REFRESH = self.config.getfloat('cache', 'version_refresh', fallback=1.0)
+        # 进程内一级缓存(LRU)的条数上限, 0 表示关闭; 以及一级缓存条目的最长存活时间(秒), 兜底错过的失效通知
+        self.CACHE_L1_SIZE = self.config.getint('cache', 'l1_size', fallback=1024)
+        self.CACHE_L1_TTL = self.config.getint('cache', 'l1_ttl', fallback=60)
+        # 相同问题并发去重: 计算者持有标记的最长时间(秒), 跟随者等待下一个 token 的最长时间(秒), 生成结果流的保留时间(秒)
+        self.SINGLEFLIGHT_LOCK_TTL = self.config.getint('singleflight', 'lock_ttl', fallback=120)
+        self.SINGLEFLIGHT_WAIT = self.config.getint('singleflight', 'wait', fallback=30)
+        self.SINGLEFLIGHT_STREAM_TTL = self.config.getint('singleflight', 'stream_ttl', fallback=60)
+        # 异步请求在本请求中直接生成(Redis 不可用等)时, 迭代阻塞生成器的专用线程数上限
+        self.SINGLEFLIGHT_LOCAL_THREADS = self.config.getint('singleflight', 'local_threads', fallback=16)
+        # 会话历史: Redis 中保留的最近轮数和过期时间(秒); 写入 MySQL 的后台批量间隔(秒)和单批最大条数
+        self.SESSION_HISTORY_TURNS = self.config.getint('session', 'history_turns', fallback=5)
+        self.SESSION_HISTORY_TTL = self.config.getint('session', 'history_ttl', fallback=86400)
+        self.SESSION_FLUSH_INTERVAL = self.config.getfloat('session', 'flush_interval', fallback=1.0)
+        self.SESSION_FLUSH_BATCH = self.config.getint('session', 'flush_batch', fallback=500)
+        # conversations 按月分区: 预先创建未来几个月的分区; 保留最近几个月的记录, 0 表示永久保留
+        self.CONVERSATION_PARTITIONS_AHEAD = self.config.getint('session', 'partitions_ahead', fallback=3)
+        self.CONVERSATION_RETENTION_MONTHS = self.config.getint('session', 'retention_months', fallback=0)
         # 日志文件路径
         self.LOG_FILE = self.config.get('logger', 'log_file', fallback='logs/app.log')
 
@@ -70,6 +122,38 @@ class Config:
         self.RETRIEVAL_K = self.config.getint('retrieval', 'retrieval_k', fallback=5)
         # 最终候选数量
         self.CANDIDATE_M = self.config.getint('retrieval', 'candidate_m', fallback=2)
+        # 语义缓存: 最多缓存的问题数, 以及判定为同一问题的最低余弦相似度
+        self.SEMANTIC_CACHE_SIZE = self.config.getint('retrieval', 'semantic_cache_size', fallback=2048)
+        self.SEMANTIC_CACHE_THRESHOLD = self.config.getfloat('retrieval', 'semantic_cache_threshold', fallback=0.92)
+
+        # BM25 配置
+        # BM25 索引快照目录, 同一台机器上的 worker 共享
+        self.BM25_SNAPSHOT_DIR = self.config.get('bm25', 'snapshot_dir',
+                                                 fallback=os.path.join(qa_dir, 'mysql_qa', 'data', 'bm25'))
+        # jpkb.subject_name -> 学科类别(VALID_SOURCES), 用于按学科划分 BM25 分区
+        self.SUBJECT_SOURCES = ast.literal_eval(self.config.get('bm25', 'subject_sources', fallback='''{
+            "Python学科": "ai", "AI学科": "ai", "人工智能学科": "ai", "JAVA学科": "java", "Java学科": "java",
+            "测试学科": "test", "软件测试学科": "test", "运维学科": "ops", "大数据学科": "bigdata"}'''))
+        # BM25 分片数: 大于 1 时问题按 id 哈希切分到多个 worker 进程, 由协调者分发查询并合并结果
+        self.BM25_NUM_SHARDS = self.config.getint('bm25', 'num_shards', fallback=1)
+        # 后台核对 Redis 中快照版本号的间隔(秒), 兜底错过的版本通知
+        self.BM25_RELOAD_INTERVAL = self.config.getint('bm25', 'reload_interval', fallback=30)
+        # 重建/发布快照的 Redis 锁超时(秒), 需大于一次全量重建的耗时
+        self.BM25_REBUILD_LOCK_TIMEOUT = self.config.getint('bm25', 'rebuild_lock_timeout', fallback=600)
+        # 增量修改后延迟多久(秒)发布快照, 期间的修改合并成一次发布
+        self.BM25_PUBLISH_DELAY = self.config.getfloat('bm25', 'publish_delay', fallback=2.0)
+
+        # 分词配置
+        # 领域词典(jieba 用户词典格式), 文件不存在时只使用 jieba 主词典
+        self.TOKENIZER_USER_DICT = self.config.get('tokenizer', 'user_dict',
+                                                   fallback=os.path.join(qa_dir, 'mysql_qa', 'data', 'user_dict.txt'))
+        # jieba 前缀词典缓存目录
+        self.TOKENIZER_CACHE_DIR = self.config.get('tokenizer', 'cache_dir',
+                                                   fallback=os.path.join(qa_dir, 'mysql_qa', 'data', 'jieba'))
+        # 查询分词结果的 LRU 缓存条数
+        self.TOKENIZER_CACHE_SIZE = self.config.getint('tokenizer', 'cache_size', fallback=10000)
+        # 批量分词的进程数, 0 表示使用全部 CPU
+        self.TOKENIZER_PROCESSES = self.config.getint('tokenizer', 'processes', fallback=0)
 
         # 应用配置
         self.CUSTOMER_SERVICE_PHONE = self.config.get('app', 'customer_service_phone')
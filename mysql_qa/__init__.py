@@ -4,5 +4,11 @@ mysql_qa_path = os.path.dirname(current_dir)
 # print(f'mysql_qa_path--》{mysql_qa_path}')
 sys.path.insert(0, mysql_qa_path)
 from db.MySQLClient import MySQLClient
+from db.Migrations import migrate
+from db.AsyncMySQLClient import AsyncMySQLClient
 from cache.RedisClient import RedisClient
+from cache.AsyncRedisClient import AsyncRedisClient
+from cache.AnswerCache import AnswerCache
+from cache.SingleFlight import SingleFlight
+from cache.SessionHistory import SessionHistory
 from retrieval.bm25_search import BM25Search
\ No newline at end of file
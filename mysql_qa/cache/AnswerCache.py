@@ -0,0 +1,237 @@
+# cache/AnswerCache.py
+# 答案缓存: 按命名空间设置过期时间, 缓存键带知识库版本号, 递增版本号即可让整个命名空间失效
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# 将路径添加到环境变量里面
+dir_cache = os.path.dirname(__file__) #当前文件所在的文件夹
+qa_dir = os.path.dirname(dir_cache) # 上一级路径
+sys_dir = os.path.dirname(qa_dir)
+# 路径添加到系统环境里面
+sys.path.insert(0,qa_dir)
+sys.path.insert(0,sys_dir)
+
+from base import Config, logger
+
+
+class AnswerCache:
+    """Redis 答案缓存, 前面加一层进程内 LRU
+
+    键的格式为 {命名空间}:v{知识库版本}:{键}, 每个命名空间有自己的过期时间.
+    知识库内容变化时递增版本号, 旧版本的键不再被读到, 由过期时间和 LRU 淘汰自然回收, 不需要扫描删除.
+    热点键命中进程内一级缓存时不访问 Redis; 版本递增和删除通过 Redis 频道通知所有 worker 清理一级缓存.
+    """
+
+    def __init__(self, redis_client, config=None, async_redis_client=None):
+        config = config or Config()
+        self.redis_client = redis_client
+        # 异步请求路径使用的 AsyncRedisClient(可选), 键和序列化方式与同步客户端一致
+        self.async_redis_client = async_redis_client
+        # 各命名空间的过期时间
+        self.ttls = config.CACHE_TTLS
+        self.default_ttl = config.CACHE_DEFAULT_TTL
+        # 单条缓存值的字节上限, 避免个别超长答案挤占内存
+        self.max_value_bytes = config.CACHE_MAX_VALUE_BYTES
+        # 知识库版本号的键, 以及本地缓存版本号的时长
+        self.version_key = 'qa_kb_version'
+        self.version_refresh = config.CACHE_VERSION_REFRESH
+        self._version = None
+        self._version_checked = 0.0
+        self._lock = threading.Lock()
+        # 进程内一级缓存: 完整缓存键 -> (值, 本地过期时间), 按访问顺序淘汰
+        self.l1_size = config.CACHE_L1_SIZE
+        self.l1_ttl = config.CACHE_L1_TTL
+        self._l1 = OrderedDict()
+        # 失效通知频道, 消息为 version:{版本号} 或 key:{完整缓存键}
+        self.invalidate_channel = 'qa_cache_invalidate'
+        if self.l1_size:
+            threading.Thread(target=self._watch_invalidations, daemon=True).start()
+        # 配置了内存上限时, 只淘汰带过期时间的键(缓存), 版本号、快照版本、锁等不受影响
+        if config.CACHE_MAX_MEMORY:
+            redis_client.configure_memory(config.CACHE_MAX_MEMORY, 'volatile-lru')
+
+    def version(self):
+        """当前知识库版本号, 本地缓存 version_refresh 秒, 避免每次读缓存多一次往返"""
+        now = time.monotonic()
+        with self._lock:
+            if self._version is not None and now - self._version_checked < self.version_refresh:
+                return self._version
+        version = self.redis_client.get_data(self.version_key) or 0
+        self._set_version(version, now)
+        return version
+
+    def _set_version(self, version, now):
+        # 切换本地版本号, 版本变化时旧版本的一级缓存条目已不可达, 直接清空
+        with self._lock:
+            if version != self._version:
+                self._l1.clear()
+            self._version, self._version_checked = version, now
+
+    def bump_version(self):
+        """递增知识库版本号, 所有命名空间的旧缓存立即失效"""
+        version = self.redis_client.incr(self.version_key)
+        if version is not None:
+            self._set_version(version, time.monotonic())
+            self.redis_client.publish(self.invalidate_channel, f'version:{version}')
+            logger.info(f'知识库版本号递增为: {version}')
+        return version
+
+    def _key(self, namespace, key):
+        # 带版本号的缓存键
+        return f'{namespace}:v{self.version()}:{key}'
+
+    def _l1_get(self, full_key):
+        # 读取一级缓存, 过期条目顺带删除
+        with self._lock:
+            item = self._l1.get(full_key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._l1[full_key]
+                return None
+            self._l1.move_to_end(full_key)
+            return value
+
+    def _l1_put(self, full_key, value, ttl):
+        # 写入一级缓存, 超出条数上限时淘汰最久未访问的条目
+        if not self.l1_size:
+            return
+        with self._lock:
+            self._l1[full_key] = (value, time.monotonic() + min(ttl, self.l1_ttl))
+            self._l1.move_to_end(full_key)
+            while len(self._l1) > self.l1_size:
+                self._l1.popitem(last=False)
+
+    def _ttl(self, namespace):
+        # 命名空间的过期时间
+        return self.ttls.get(namespace, self.default_ttl)
+
+    def get(self, namespace, key):
+        """读取缓存, 先查进程内一级缓存, 再查 Redis; 不存在或已失效时返回 None"""
+        full_key = self._key(namespace, key)
+        value = self._l1_get(full_key)
+        if value is not None:
+            return value
+        value = self.redis_client.get_data(full_key)
+        if value is not None:
+            self._l1_put(full_key, value, self._ttl(namespace))
+        return value
+
+    def get_many(self, items):
+        """批量读取缓存: items 为 [(命名空间, 键), ...], 按顺序返回值, 不存在或已失效的为 None;
+        一级缓存未命中的键用一条 MGET 一起读取, 一次往返"""
+        full_keys, values, missing = self._l1_get_many(items, self.version())
+        if missing:
+            self._fill(items, full_keys, values, missing, self.redis_client.get_many([full_keys[i] for i in missing]))
+        return values
+
+    def _l1_get_many(self, items, version):
+        # 批量读取一级缓存, 返回 (完整缓存键, 值, 未命中的下标)
+        full_keys = [f'{namespace}:v{version}:{key}' for namespace, key in items]
+        values = [self._l1_get(full_key) for full_key in full_keys]
+        return full_keys, values, [i for i, value in enumerate(values) if value is None]
+
+    def _fill(self, items, full_keys, values, missing, fetched):
+        # 把从 Redis 读到的值填入结果并写入一级缓存
+        for i, value in zip(missing, fetched):
+            if value is not None:
+                values[i] = value
+                self._l1_put(full_keys[i], value, self._ttl(items[i][0]))
+
+    def _too_large(self, namespace, key, value):
+        # 按实际写入 Redis 的字节数(序列化、压缩之后)判断是否超过上限
+        if len(self.redis_client.codec.encode(value)) > self.max_value_bytes:
+            logger.info(f'缓存值超过 {self.max_value_bytes} 字节, 不写缓存: {namespace}:{key}')
+            return True
+        return False
+
+    def set(self, namespace, key, value):
+        """写入缓存, 过期时间取命名空间的配置; 超过大小上限的值不缓存"""
+        if self._too_large(namespace, key, value):
+            return
+        full_key = self._key(namespace, key)
+        self.redis_client.set_data(full_key, value, ex=self._ttl(namespace))
+        self._l1_put(full_key, value, self._ttl(namespace))
+
+    def delete(self, namespace, key):
+        """删除缓存, 并通知其他 worker 清理一级缓存中的该键"""
+        full_key = self._key(namespace, key)
+        self.redis_client.delete_data(full_key)
+        with self._lock:
+            self._l1.pop(full_key, None)
+        self.redis_client.publish(self.invalidate_channel, f'key:{full_key}')
+
+    async def aversion(self):
+        """version() 的异步版本"""
+        now = time.monotonic()
+        with self._lock:
+            if self._version is not None and now - self._version_checked < self.version_refresh:
+                return self._version
+        version = await self.async_redis_client.get_data(self.version_key) or 0
+        self._set_version(version, now)
+        return version
+
+    async def aget(self, namespace, key):
+        """get() 的异步版本, 没有配置异步客户端时在线程池中执行同步读取"""
+        if self.async_redis_client is None:
+            return await asyncio.to_thread(self.get, namespace, key)
+        full_key = f'{namespace}:v{await self.aversion()}:{key}'
+        value = self._l1_get(full_key)
+        if value is not None:
+            return value
+        value = await self.async_redis_client.get_data(full_key)
+        if value is not None:
+            self._l1_put(full_key, value, self._ttl(namespace))
+        return value
+
+    async def aget_many(self, items):
+        """get_many() 的异步版本"""
+        if self.async_redis_client is None:
+            return await asyncio.to_thread(self.get_many, items)
+        full_keys, values, missing = self._l1_get_many(items, await self.aversion())
+        if missing:
+            self._fill(items, full_keys, values, missing,
+                       await self.async_redis_client.get_many([full_keys[i] for i in missing]))
+        return values
+
+    async def aset(self, namespace, key, value):
+        """set() 的异步版本"""
+        if self.async_redis_client is None:
+            return await asyncio.to_thread(self.set, namespace, key, value)
+        if self._too_large(namespace, key, value):
+            return
+        full_key = f'{namespace}:v{await self.aversion()}:{key}'
+        await self.async_redis_client.set_data(full_key, value, ex=self._ttl(namespace))
+        self._l1_put(full_key, value, self._ttl(namespace))
+
+    def _watch_invalidations(self):
+        # 后台线程: 订阅失效频道, 按通知切换版本号或删除一级缓存条目
+        pubsub = None
+        while True:
+            try:
+                if pubsub is None:
+                    pubsub = self.redis_client.subscribe(self.invalidate_channel)
+                    if pubsub is None:
+                        time.sleep(self.l1_ttl)
+                        continue
+                message = pubsub.get_message(timeout=self.l1_ttl)
+                if not message:
+                    continue
+                kind, _, value = message['data'].decode('utf-8').partition(':')
+                if kind == 'version':
+                    # 通知可能乱序到达, 只接受更新的版本号
+                    if self._version is None or int(value) > self._version:
+                        self._set_version(int(value), time.monotonic())
+                elif kind == 'key':
+                    with self._lock:
+                        self._l1.pop(value, None)
+            except Exception as e:
+                # 连接断开等异常: 记录后重新订阅, 后台线程不能退出
+                logger.error(f'缓存失效监听异常: {e}')
+                pubsub = None
+                time.sleep(1)
@@ -0,0 +1,196 @@
+# cache/AsyncRedisClient.py
+# 异步 Redis 客户端: 与 RedisClient 的键和编解码方式一致, 供 FastAPI 的异步请求路径使用, 不阻塞事件循环
+import os
+import sys
+
+# 导入 Redis 异步客户端
+import redis
+import redis.asyncio as aioredis
+from redis.asyncio.cluster import ClusterNode, RedisCluster
+from redis.asyncio.sentinel import Sentinel
+
+# 将路径添加到环境变量里面
+dir_cache = os.path.dirname(__file__) #当前文件所在的文件夹
+qa_dir = os.path.dirname(dir_cache) # 上一级路径
+sys_dir = os.path.dirname(qa_dir)
+# 路径添加到系统环境里面
+sys.path.insert(0,qa_dir)
+sys.path.insert(0,sys_dir)
+
+from base import Config,logger
+from cache.RedisClient import slot_groups
+from cache.RedisCodec import RedisCodec
+
+
+class AsyncRedisClient:
+    def __init__(self, config=None):
+        # 初始化日志
+        self.logger = logger
+        # 只解析一次配置文件
+        config = config or Config()
+        # 值的编解码器, 与 RedisClient 一致
+        self.codec = RedisCodec(config.REDIS_SERIALIZER, config.REDIS_COMPRESSION, config.REDIS_COMPRESS_THRESHOLD)
+        # 连接 Redis: 部署模式与 RedisClient 一致; 连接在第一次使用时建立, 连接池绑定到使用它的事件循环
+        self.client = self._connect(config)
+        # 阻塞读(XREAD BLOCK)专用的客户端, 连接池与 self.client 分开
+        self.blocking_client = self._connect(config, blocking=True)
+
+    @staticmethod
+    def _connect(config, blocking=False):
+        # 按部署模式创建客户端; blocking=True 时为阻塞读专用的单独连接池
+        max_connections = config.REDIS_BLOCKING_MAX_CONNECTIONS if blocking else config.REDIS_MAX_CONNECTIONS
+        if config.REDIS_MODE == 'cluster':
+            return RedisCluster(
+                startup_nodes=[ClusterNode(host, port) for host, port in config.REDIS_NODES],
+                password=config.REDIS_PASSWORD,
+                max_connections=max_connections,
+                decode_responses=False
+            )
+        if config.REDIS_MODE == 'sentinel':
+            sentinel = Sentinel(config.REDIS_NODES, password=config.REDIS_PASSWORD, db=config.REDIS_DB,
+                                sentinel_kwargs={'password': config.REDIS_SENTINEL_PASSWORD or None})
+            return sentinel.master_for(config.REDIS_SENTINEL_MASTER,
+                                       max_connections=max_connections,
+                                       decode_responses=False)
+        # 单机: 协程并发时每条进行中的命令各占一个连接, 连接用完时等待空闲连接(最多 REDIS_BLOCKING_POOL_TIMEOUT 秒)而不是报错
+        return aioredis.Redis(connection_pool=aioredis.BlockingConnectionPool(
+            host=config.REDIS_HOST,
+            port=config.REDIS_PORT,
+            password=config.REDIS_PASSWORD,
+            db=config.REDIS_DB,
+            max_connections=max_connections,
+            timeout=config.REDIS_BLOCKING_POOL_TIMEOUT,
+            decode_responses=False
+        ))
+
+    async def set_data(self, key, value, ex=None):
+        # 存储数据到 Redis, ex 为过期时间(秒)
+        try:
+            # 按编解码器序列化(必要时压缩)后存储
+            await self.client.set(key, self.codec.encode(value), ex=ex)
+            # 记录存储成功
+            self.logger.info(f"存储数据到 Redis: {key}")
+        except redis.RedisError as e:
+            # 记录存储失败
+            self.logger.error(f"Redis 存储失败: {e}")
+
+    async def get_data(self, key):
+        # 从 Redis 获取数据
+        try:
+            # 获取数据
+            data = await self.client.get(key)
+            # 返回解码后的数据或 None
+            return self.codec.decode(data)
+        except redis.RedisError as e:
+            # 记录获取失败
+            self.logger.error(f"Redis 获取失败: {e}")
+            # 返回 None
+            return None
+
+    async def get_many(self, keys):
+        # 批量获取数据: 键按槽位分组, 每组一条 MGET, 所有分组放在一个 pipeline 里发送
+        keys = list(keys)
+        values = [None] * len(keys)
+        if not keys:
+            return values
+        try:
+            groups = slot_groups(self.client, keys)
+            pipe = self.client.pipeline(transaction=False)
+            for group in groups:
+                pipe.mget([keys[i] for i in group])
+            for group, results in zip(groups, await pipe.execute()):
+                for i, data in zip(group, results):
+                    values[i] = self.codec.decode(data)
+            return values
+        except redis.RedisError as e:
+            # 记录获取失败
+            self.logger.error(f"Redis 批量获取失败: {e}")
+            return values
+
+    async def set_many(self, mapping):
+        # 批量存储数据: 键按槽位分组, 每组一条 MSET, 所有分组放在一个非事务 pipeline 里发送
+        if not mapping:
+            return
+        try:
+            keys = list(mapping)
+            pipe = self.client.pipeline(transaction=False)
+            for group in slot_groups(self.client, keys):
+                pipe.mset({keys[i]: self.codec.encode(mapping[keys[i]]) for i in group})
+            await pipe.execute()
+            # 记录存储成功
+            self.logger.info(f"批量存储数据到 Redis: {len(mapping)} 个键")
+        except redis.RedisError as e:
+            # 记录存储失败
+            self.logger.error(f"Redis 批量存储失败: {e}")
+
+    async def push_capped(self, key, values, max_len, ex=None):
+        # 写入定长列表: values 按顺序 LPUSH 到表头(最后一条在表头)后 LTRIM 只保留最新的 max_len 条, 并刷新过期时间, 一次往返完成
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.lpush(key, *[self.codec.encode(value) for value in values])
+            pipe.ltrim(key, 0, max_len - 1)
+            if ex:
+                pipe.expire(key, ex)
+            await pipe.execute()
+            return True
+        except redis.RedisError as e:
+            # 记录写入失败
+            self.logger.error(f"Redis 列表写入失败: {e}")
+            return False
+
+    async def get_list(self, key, count=-1):
+        # 读取列表表头的 count 条(默认全部), 返回解码后的数据; 失败时返回 None
+        try:
+            return [self.codec.decode(data) for data in await self.client.lrange(key, 0, count - 1 if count > 0 else -1)]
+        except redis.RedisError as e:
+            # 记录读取失败
+            self.logger.error(f"Redis 列表读取失败: {e}")
+            return None
+
+    async def set_if_absent(self, key, value, ex=None):
+        # 键不存在时才写入(SET NX), 返回是否写入成功; Redis 不可用时返回 None
+        try:
+            return bool(await self.client.set(key, self.codec.encode(value), ex=ex, nx=True))
+        except redis.RedisError as e:
+            # 记录存储失败
+            self.logger.error(f"Redis 存储失败: {e}")
+            return None
+
+    async def xread(self, stream, last_id='0', block=None, count=None):
+        # 读取流中 last_id 之后的消息, 返回值与 RedisClient.xread 一致; 阻塞读取使用单独的连接池
+        client = self.client if block is None else self.blocking_client
+        try:
+            result = await client.xread({stream: last_id}, count=count, block=block)
+        except redis.RedisError as e:
+            # 记录读取失败
+            self.logger.error(f"Redis 流读取失败: {e}")
+            return None
+        if not result:
+            return []
+        return [(message_id.decode('utf-8'), {k.decode('utf-8'): v.decode('utf-8') for k, v in fields.items()})
+                for message_id, fields in result[0][1]]
+
+    async def delete_data(self, *keys):
+        # 删除 Redis 中的数据
+        try:
+            await self.client.delete(*keys)
+            # 记录删除成功
+            self.logger.info(f"删除 Redis 数据: {keys}")
+        except redis.RedisError as e:
+            # 记录删除失败
+            self.logger.error(f"Redis 删除失败: {e}")
+
+    async def publish(self, channel, message):
+        # 向频道发布消息
+        try:
+            await self.client.publish(channel, message)
+            # 记录发布成功
+            self.logger.info(f"发布 Redis 消息: {channel} -> {message}")
+        except redis.RedisError as e:
+            # 记录发布失败
+            self.logger.error(f"Redis 发布失败: {e}")
+
+    async def close(self):
+        # 关闭连接池
+        await self.client.close()
+        await self.blocking_client.close()
@@ -2,10 +2,13 @@
 # 导入 Redis 客户端
 import os
 import sys
+import threading
+from contextlib import contextmanager
 
 import redis
-# 导入 JSON 处理
-import json
+from redis.asyncio.cluster import RedisCluster as AsyncRedisCluster
+from redis.cluster import ClusterNode, RedisCluster
+from redis.sentinel import Sentinel
 
 # 将路径添加到环境变量里面
 dir_cache = os.path.dirname(__file__) #当前文件所在的文件夹
@@ -16,25 +19,92 @@ sys.path.insert(0,qa_dir)
 sys.path.insert(0,sys_dir)
 
 from base import Config,logger
+from cache.RedisCodec import RedisCodec
 
 #在windows环境可以,但是在linux环境失败
 # from dev07_rag.integrated_qa_system.base.config import Config
 # from dev07_rag.integrated_qa_system.base.logger import logger
 
+# 每个进程共享的 Redis 客户端(及其连接池), 按部署模式和连接参数区分; fork 出的子进程使用时 redis-py 会自动重建连接
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _redis_client(config, blocking=False):
+    # 获取(必要时创建)与配置对应的客户端: standalone 单机, sentinel 哨兵(自动跟随主从切换), cluster 集群;
+    # blocking=True 时返回阻塞读专用的客户端, 使用单独的连接池, 长时间阻塞的读取不会占满普通命令的连接池
+    max_connections = config.REDIS_BLOCKING_MAX_CONNECTIONS if blocking else config.REDIS_MAX_CONNECTIONS
+    key = (config.REDIS_MODE, config.REDIS_HOST, config.REDIS_PORT, config.REDIS_PASSWORD, config.REDIS_DB,
+           tuple(config.REDIS_NODES), config.REDIS_SENTINEL_MASTER, blocking)
+    with _clients_lock:
+        if key not in _clients:
+            if config.REDIS_MODE == 'cluster':
+                # 集群: 从任一启动节点发现全部节点和槽位分布, 命令按键的槽位路由
+                _clients[key] = RedisCluster(
+                    startup_nodes=[ClusterNode(host, port) for host, port in config.REDIS_NODES],
+                    password=config.REDIS_PASSWORD,
+                    max_connections=max_connections,
+                    decode_responses=False
+                )
+            elif config.REDIS_MODE == 'sentinel':
+                # 哨兵: 每次建立连接时向哨兵查询当前主节点, 故障切换后自动连到新主节点
+                sentinel = Sentinel(config.REDIS_NODES, password=config.REDIS_PASSWORD, db=config.REDIS_DB,
+                                    sentinel_kwargs={'password': config.REDIS_SENTINEL_PASSWORD or None})
+                _clients[key] = sentinel.master_for(config.REDIS_SENTINEL_MASTER,
+                                                    max_connections=max_connections,
+                                                    decode_responses=False)
+            elif blocking:
+                # 单机阻塞读: 连接用完时等待空闲连接(最多 REDIS_BLOCKING_POOL_TIMEOUT 秒), 而不是直接报 Too many connections
+                _clients[key] = redis.StrictRedis(connection_pool=redis.BlockingConnectionPool(
+                    host=config.REDIS_HOST,
+                    port=config.REDIS_PORT,
+                    password=config.REDIS_PASSWORD,
+                    db=config.REDIS_DB,
+                    max_connections=max_connections,
+                    timeout=config.REDIS_BLOCKING_POOL_TIMEOUT,
+                    decode_responses=False
+                ))
+            else:
+                _clients[key] = redis.StrictRedis(connection_pool=redis.ConnectionPool(
+                    host=config.REDIS_HOST,
+                    port=config.REDIS_PORT,
+                    password=config.REDIS_PASSWORD,
+                    db=config.REDIS_DB,
+                    max_connections=max_connections,
+                    decode_responses=False
+                ))
+        return _clients[key]
+
+
+def tagged_key(tag, *parts):
+    """带哈希标签的键: {tag}:part1:part2; 集群只按花括号内的部分计算槽位, 同一 tag 的键落在同一节点, 可以一起批量操作"""
+    return ':'.join([f'{{{tag}}}', *map(str, parts)])
+
+
+def slot_groups(client, keys):
+    """把键按集群槽位分组, 返回 [[键在 keys 中的下标, ...], ...]; 非集群客户端时所有键为一组"""
+    if not isinstance(client, (RedisCluster, AsyncRedisCluster)):
+        return [list(range(len(keys)))] if keys else []
+    groups = {}
+    for i, key in enumerate(keys):
+        groups.setdefault(client.keyslot(key), []).append(i)
+    return list(groups.values())
+
+
 class RedisClient:
-    def __init__(self):
+    def __init__(self, config=None):
         # 初始化日志
 
         self.logger = logger
+        # 只解析一次配置文件
+        config = config or Config()
+        # 值的编解码器: msgpack + 超过阈值时压缩, 兼容旧的 JSON 值
+        self.codec = RedisCodec(config.REDIS_SERIALIZER, config.REDIS_COMPRESSION, config.REDIS_COMPRESS_THRESHOLD)
         try:
-            # 连接 Redis
-            self.client = redis.StrictRedis(
-                host=Config().REDIS_HOST,
-                port=Config().REDIS_PORT,
-                password=Config().REDIS_PASSWORD,
-                db=Config().REDIS_DB,
-                decode_responses=True
-            )
+            # 连接 Redis: 同一进程内的客户端共用一个连接池
+            self.client = _redis_client(config)
+            # 阻塞读(XREAD BLOCK)专用的客户端, 连接池与 self.client 分开
+            self.blocking_client = _redis_client(config, blocking=True)
             # 记录连接成功
             self.logger.info("Redis 连接成功")
         except redis.RedisError as e:
@@ -42,11 +112,11 @@ class RedisClient:
             self.logger.error(f"Redis 连接失败: {e}")
             raise
 
-    def set_data(self, key, value):
-        # 存储数据到 Redis
+    def set_data(self, key, value, ex=None):
+        # 存储数据到 Redis, ex 为过期时间(秒)
         try:
-            # 存储 JSON 数据
-            self.client.set(key, json.dumps(value)) # f"answer:{query}
+            # 按编解码器序列化(必要时压缩)后存储
+            self.client.set(key, self.codec.encode(value), ex=ex) # f"answer:{query}
             # 记录存储成功
             self.logger.info(f"存储数据到 Redis: {key}")
         except redis.RedisError as e:
@@ -58,19 +128,199 @@ class RedisClient:
         try:
             # 获取数据
             data = self.client.get(key)
-            # 返回解析后的 JSON 数据或 None
-            return json.loads(data) if data else None
+            # 返回解码后的数据或 None
+            return self.codec.decode(data)
         except redis.RedisError as e:
             # 记录获取失败
             self.logger.error(f"Redis 获取失败: {e}")
             # 返回 None
             return None
 
+    def get_many(self, keys):
+        # 批量获取数据: 按 keys 顺序返回解码后的数据, 不存在的键为 None;
+        # 键按槽位分组, 每组一条 MGET, 所有分组放在一个 pipeline 里发送(单机时就是一次 MGET 往返)
+        keys = list(keys)
+        values = [None] * len(keys)
+        if not keys:
+            return values
+        try:
+            groups = slot_groups(self.client, keys)
+            pipe = self.client.pipeline(transaction=False)
+            for group in groups:
+                pipe.mget([keys[i] for i in group])
+            for group, results in zip(groups, pipe.execute()):
+                for i, data in zip(group, results):
+                    values[i] = self.codec.decode(data)
+            return values
+        except redis.RedisError as e:
+            # 记录获取失败
+            self.logger.error(f"Redis 批量获取失败: {e}")
+            return values
+
+    def set_many(self, mapping):
+        # 批量存储数据: 键按槽位分组, 每组一条 MSET, 所有分组放在一个非事务 pipeline 里发送
+        if not mapping:
+            return
+        try:
+            keys = list(mapping)
+            pipe = self.client.pipeline(transaction=False)
+            for group in slot_groups(self.client, keys):
+                pipe.mset({keys[i]: self.codec.encode(mapping[keys[i]]) for i in group})
+            pipe.execute()
+            # 记录存储成功
+            self.logger.info(f"批量存储数据到 Redis: {len(mapping)} 个键")
+        except redis.RedisError as e:
+            # 记录存储失败
+            self.logger.error(f"Redis 批量存储失败: {e}")
+
+    def push_capped(self, key, values, max_len, ex=None):
+        # 写入定长列表: values 按顺序 LPUSH 到表头(最后一条在表头)后 LTRIM 只保留最新的 max_len 条, 并刷新过期时间, 一次往返完成
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.lpush(key, *[self.codec.encode(value) for value in values])
+            pipe.ltrim(key, 0, max_len - 1)
+            if ex:
+                pipe.expire(key, ex)
+            pipe.execute()
+            return True
+        except redis.RedisError as e:
+            # 记录写入失败
+            self.logger.error(f"Redis 列表写入失败: {e}")
+            return False
+
+    def get_list(self, key, count=-1):
+        # 读取列表表头的 count 条(默认全部), 返回解码后的数据; 失败时返回 None
+        try:
+            return [self.codec.decode(data) for data in self.client.lrange(key, 0, count - 1 if count > 0 else -1)]
+        except redis.RedisError as e:
+            # 记录读取失败
+            self.logger.error(f"Redis 列表读取失败: {e}")
+            return None
+
+    def incr(self, key):
+        # 原子递增计数器, 返回递增后的值, 失败时返回 None
+        try:
+            return self.client.incr(key)
+        except redis.RedisError as e:
+            # 记录递增失败
+            self.logger.error(f"Redis 递增失败: {e}")
+            return None
+
+    def set_if_absent(self, key, value, ex=None):
+        # 键不存在时才写入(SET NX), 返回是否写入成功; Redis 不可用时返回 None
+        try:
+            return bool(self.client.set(key, self.codec.encode(value), ex=ex, nx=True))
+        except redis.RedisError as e:
+            # 记录存储失败
+            self.logger.error(f"Redis 存储失败: {e}")
+            return None
+
+    def delete_if_equal(self, key, value):
+        # 键的当前值等于 value 时才删除, 比较和删除在 Lua 脚本中原子执行, 不会误删他人重新写入的值
+        try:
+            return bool(self.client.eval(
+                "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0",
+                1, key, self.codec.encode(value)))
+        except redis.RedisError as e:
+            # 记录删除失败
+            self.logger.error(f"Redis 删除失败: {e}")
+            return False
+
+    def xadd(self, stream, fields, ex=None):
+        # 向流追加一条消息(字段值为字符串), 并刷新流的过期时间
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.xadd(stream, fields)
+            if ex:
+                pipe.expire(stream, ex)
+            pipe.execute()
+            return True
+        except redis.RedisError as e:
+            # 记录写入失败
+            self.logger.error(f"Redis 流写入失败: {e}")
+            return False
+
+    def xread(self, stream, last_id='0', block=None, count=None):
+        # 读取流中 last_id 之后的消息, block 为最长阻塞毫秒数; 返回 [(消息 id, {字段: 值}), ...], 失败时返回 None;
+        # 阻塞读取使用单独的连接池, 大量等待中的请求不会占满普通命令的连接
+        client = self.client if block is None else self.blocking_client
+        try:
+            result = client.xread({stream: last_id}, count=count, block=block)
+        except redis.RedisError as e:
+            # 记录读取失败
+            self.logger.error(f"Redis 流读取失败: {e}")
+            return None
+        if not result:
+            return []
+        return [(message_id.decode('utf-8'), {k.decode('utf-8'): v.decode('utf-8') for k, v in fields.items()})
+                for message_id, fields in result[0][1]]
+
+    def configure_memory(self, max_memory, policy='volatile-lru'):
+        # 设置 Redis 内存上限和淘汰策略; 托管 Redis 可能禁止 CONFIG 命令, 失败只记录
+        try:
+            self.client.config_set('maxmemory', max_memory)
+            self.client.config_set('maxmemory-policy', policy)
+            self.logger.info(f"Redis 内存上限: {max_memory}, 淘汰策略: {policy}")
+        except redis.RedisError as e:
+            # 记录设置失败
+            self.logger.error(f"Redis 内存配置失败: {e}")
+
+    def delete_data(self, *keys):
+        # 删除 Redis 中的数据
+        try:
+            self.client.delete(*keys)
+            # 记录删除成功
+            self.logger.info(f"删除 Redis 数据: {keys}")
+        except redis.RedisError as e:
+            # 记录删除失败
+            self.logger.error(f"Redis 删除失败: {e}")
+
+    def publish(self, channel, message):
+        # 向频道发布消息
+        try:
+            self.client.publish(channel, message)
+            # 记录发布成功
+            self.logger.info(f"发布 Redis 消息: {channel} -> {message}")
+        except redis.RedisError as e:
+            # 记录发布失败
+            self.logger.error(f"Redis 发布失败: {e}")
+
+    def subscribe(self, channel):
+        # 订阅频道, 返回 PubSub 对象(用 get_message 轮询, 消息内容为 bytes), 失败时返回 None
+        try:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(channel)
+            return pubsub
+        except redis.RedisError as e:
+            # 记录订阅失败
+            self.logger.error(f"Redis 订阅失败: {e}")
+            return None
+
+    @contextmanager
+    def lock(self, name, timeout=60, blocking_timeout=None):
+        # 分布式锁: with 语句得到是否拿到锁, 等锁超时或 Redis 不可用时为 False, 由调用方决定如何降级
+        lock = self.client.lock(name, timeout=timeout, blocking_timeout=blocking_timeout)
+        try:
+            acquired = lock.acquire()
+        except redis.RedisError as e:
+            # 记录加锁失败
+            self.logger.error(f"Redis 加锁失败: {e}")
+            acquired = False
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                try:
+                    lock.release()
+                except redis.RedisError as e:
+                    # 锁已超时被他人持有等情况, 只记录
+                    self.logger.error(f"Redis 释放锁失败: {e}")
+
     def get_answer(self, query):
         # 获取查询的缓存答案
         try:
             # 从 Redis 获取答案
-            answer = self.client.get(f"answer:{query}")
+            answer = self.codec.decode(self.client.get(f"answer:{query}"))
             if answer:
                 # 记录获取成功
                 self.logger.info(f"从 Redis 获取答案: {query}")
@@ -84,5 +334,11 @@ class RedisClient:
             # 返回 None
             return None
 if __name__ == '__main__':
+    # 按 config.ini 中的部署模式连接并做一次读写自检, 可用来验证本地多节点集群或哨兵
     redcli = RedisClient()
-    print(redcli)
+    print(redcli.client)
+    sample = {tagged_key('selfcheck', i): {'n': i} for i in range(8)}
+    sample.update({f'selfcheck:{i}': [i] for i in range(8)})
+    redcli.set_many(sample)
+    print(redcli.get_many(sample) == list(sample.values()))
+    redcli.delete_data(*sample)
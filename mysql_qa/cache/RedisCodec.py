@@ -0,0 +1,109 @@
+# cache/RedisCodec.py
+# Redis 值的序列化编解码: msgpack 序列化, 超过阈值时压缩, 值前加类型标记; 没有标记的旧 JSON 值照常读取
+import json
+import os
+import sys
+import zlib
+
+# 可选依赖: 未安装时退回 JSON / zlib
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# 将路径添加到环境变量里面
+dir_cache = os.path.dirname(__file__) #当前文件所在的文件夹
+qa_dir = os.path.dirname(dir_cache) # 上一级路径
+sys_dir = os.path.dirname(qa_dir)
+# 路径添加到系统环境里面
+sys.path.insert(0,qa_dir)
+sys.path.insert(0,sys_dir)
+
+from base import logger
+
+# 类型标记: 魔数字节 + 序列化方式 + 压缩方式; JSON 文本不会以 \x00 开头, 据此区分旧值
+MAGIC = b'\x00'
+SERIALIZERS = {'json': b'j', 'msgpack': b'm'}
+COMPRESSIONS = {'none': b'n', 'zlib': b'z', 'zstd': b's', 'lz4': b'l'}
+
+
+class RedisCodec:
+    """Redis 值编解码器
+
+    编码结果为 3 字节标记 + 载荷: 标记依次是魔数 \\x00、序列化方式、压缩方式.
+    载荷超过 compress_threshold 字节才压缩, 短答案不付出压缩开销.
+    配置的 msgpack / zstd / lz4 未安装时分别退回 JSON / zlib, 解码按值自带的标记进行, 与当前配置无关.
+    """
+
+    def __init__(self, serializer='msgpack', compression='zstd', compress_threshold=1024, level=3):
+        if serializer == 'msgpack' and msgpack is None:
+            logger.warning('未安装 msgpack, Redis 值改用 JSON 序列化')
+            serializer = 'json'
+        if compression == 'zstd' and zstandard is None or compression == 'lz4' and lz4_frame is None:
+            logger.warning(f'未安装 {compression} 压缩库, Redis 值改用 zlib 压缩')
+            compression = 'zlib'
+        if serializer not in SERIALIZERS or compression not in COMPRESSIONS:
+            raise ValueError(f'不支持的 Redis 编码方式: {serializer}/{compression}')
+        self.serializer = serializer
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        self.level = level
+
+    def _serialize(self, value):
+        if self.serializer == 'msgpack':
+            return msgpack.packb(value, use_bin_type=True)
+        # ensure_ascii=False: 中文按 UTF-8 存储, 比 \\uXXXX 转义短一半
+        return json.dumps(value, ensure_ascii=False).encode('utf-8')
+
+    def _compress(self, payload):
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor(level=self.level).compress(payload)
+        if self.compression == 'lz4':
+            return lz4_frame.compress(payload)
+        return zlib.compress(payload, self.level)
+
+    def encode(self, value):
+        """值 -> 带类型标记的字节串"""
+        payload = self._serialize(value)
+        compression = self.compression
+        if compression == 'none' or len(payload) < self.compress_threshold:
+            compression = 'none'
+        else:
+            payload = self._compress(payload)
+        return MAGIC + SERIALIZERS[self.serializer] + COMPRESSIONS[compression] + payload
+
+    def decode(self, data):
+        """字节串 -> 值; 不带标记的按旧的 JSON 文本解析, 无法解码时记录日志并返回 None"""
+        if not data:
+            return None
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        try:
+            if not data.startswith(MAGIC):
+                return json.loads(data)
+            serializer, compression, payload = data[1:2], data[2:3], data[3:]
+            if compression == COMPRESSIONS['zstd']:
+                payload = zstandard.ZstdDecompressor().decompress(payload)
+            elif compression == COMPRESSIONS['lz4']:
+                payload = lz4_frame.decompress(payload)
+            elif compression == COMPRESSIONS['zlib']:
+                payload = zlib.decompress(payload)
+            elif compression != COMPRESSIONS['none']:
+                raise ValueError(f'未知的压缩标记: {compression!r}')
+            if serializer == SERIALIZERS['msgpack']:
+                return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+            if serializer == SERIALIZERS['json']:
+                return json.loads(payload)
+            raise ValueError(f'未知的序列化标记: {serializer!r}')
+        except Exception as e:
+            # 数据损坏, 或值由本机未安装的 msgpack / zstd / lz4 编码
+            logger.error(f'Redis 值解码失败: {e}')
+            return None
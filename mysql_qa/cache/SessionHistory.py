@@ -0,0 +1,224 @@
+# cache/SessionHistory.py
+# 会话历史: 最近几轮对话放在 Redis 定长列表里读写, 完整记录由后台线程批量写入 MySQL
+import asyncio
+import atexit
+import os
+import sys
+import threading
+from datetime import datetime
+
+import pymysql
+
+# 将路径添加到环境变量里面
+dir_cache = os.path.dirname(__file__) #当前文件所在的文件夹
+qa_dir = os.path.dirname(dir_cache) # 上一级路径
+sys_dir = os.path.dirname(qa_dir)
+# 路径添加到系统环境里面
+sys.path.insert(0,qa_dir)
+sys.path.insert(0,sys_dir)
+
+from base import Config, logger
+from cache.RedisClient import tagged_key
+
+# 同步和异步路径共用的 SQL
+_FETCH_SQL = '''
+    SELECT question, answer
+    FROM conversations
+    WHERE session_id = %s
+    ORDER BY timestamp DESC, id DESC
+    LIMIT %s
+'''
+_INSERT_SQL = '''
+    INSERT INTO conversations (session_id, question, answer, timestamp)
+    VALUES (%s, %s, %s, %s)
+'''
+_DELETE_SQL = 'DELETE FROM conversations WHERE session_id = %s'
+
+class SessionHistory:
+    """会话历史
+
+    每个会话在 Redis 中有一个列表 {session:会话ID}:history, 新的一轮 LPUSH 到表头, LTRIM 只保留最近 turns 轮,
+    读取历史只需一次 LRANGE. 每轮对话同时进入内存中的待写队列, 后台线程每隔 flush_interval 秒
+    (或积累到 flush_batch 条时)用一条 executemany 批量写入 MySQL 的 conversations 表, 作为持久记录.
+    Redis 中没有该会话(过期或 Redis 不可用)时回退到 MySQL 查询, 并把结果写回 Redis.
+    aget / aappend / aclear 为异步版本, 使用 AsyncRedisClient 和 AsyncMySQLClient, 没有配置时在线程池中执行同步版本.
+    """
+
+    def __init__(self, redis_client, mysql_client, config=None, async_redis_client=None, async_mysql_client=None):
+        config = config or Config()
+        self.redis_client = redis_client
+        self.mysql_client = mysql_client
+        # 异步请求路径使用的客户端(可选)
+        self.async_redis_client = async_redis_client
+        self.async_mysql_client = async_mysql_client
+        self.turns = config.SESSION_HISTORY_TURNS
+        self.ttl = config.SESSION_HISTORY_TTL
+        self.flush_interval = config.SESSION_FLUSH_INTERVAL
+        self.flush_batch = config.SESSION_FLUSH_BATCH
+        # 待写入 MySQL 的记录: [(session_id, question, answer, timestamp), ...]
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        # 批量写入和清除会话互斥, 保证清除之后不会再写入该会话的旧记录
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        threading.Thread(target=self._write_behind, daemon=True).start()
+        # 进程退出前写完剩余记录
+        atexit.register(self.flush_all)
+
+    @staticmethod
+    def _key(session_id):
+        # 同一会话的键使用同一个哈希标签, 集群模式下落在同一节点
+        return tagged_key(f'session:{session_id}', 'history')
+
+    def get(self, session_id):
+        """最近 turns 轮对话, 按时间正序: [{"question": ..., "answer": ...}, ...]"""
+        entries = self.redis_client.get_list(self._key(session_id), self.turns)
+        if entries:
+            return entries[::-1]
+        history = self._fetch_from_mysql(session_id)
+        if history and entries is not None:
+            # 回填 Redis: 按时间正序一次 LPUSH, 最新一轮在表头
+            self.redis_client.push_capped(self._key(session_id), history, self.turns, ex=self.ttl)
+        return history
+
+    def _fetch_from_mysql(self, session_id):
+        # 从 MySQL 读取最近 turns 轮对话
+        try:
+            with self.mysql_client.cursor() as cursor:
+                cursor.execute(_FETCH_SQL, (session_id, self.turns))
+                rows = cursor.fetchall()
+        except pymysql.MySQLError as e:
+            logger.error(f"获取对话历史失败: {e}")
+            return []
+        return [{"question": question, "answer": answer} for question, answer in rows][::-1]
+
+    def append(self, session_id, question, answer):
+        """记录一轮对话并返回更新后的最近历史; 写 Redis 是同步的, 写 MySQL 由后台线程批量完成"""
+        entry = {"question": question, "answer": answer}
+        history = self.get(session_id)
+        self.redis_client.push_capped(self._key(session_id), [entry], self.turns, ex=self.ttl)
+        self._enqueue(session_id, question, answer)
+        return (history + [entry])[-self.turns:]
+
+    def _enqueue(self, session_id, question, answer):
+        # 加入待写队列, 积累到一批时唤醒后台线程
+        with self._pending_lock:
+            self._pending.append((session_id, question, answer, datetime.now()))
+            if len(self._pending) >= self.flush_batch:
+                self._wakeup.set()
+
+    def clear(self, session_id):
+        """清除会话历史: 丢弃未写入的记录、删除 MySQL 中的记录, 最后删除 Redis 列表
+
+        全程持有批量写入锁, Redis 列表最后删除: 删除之后读取会话的请求从 MySQL 回填时, 读到的已经是清除后的数据
+        """
+        with self._write_lock:
+            self._drop_pending(session_id)
+            try:
+                with self.mysql_client.cursor() as cursor:
+                    cursor.execute(_DELETE_SQL, (session_id,))
+            except pymysql.MySQLError as e:
+                logger.error(f"清除会话历史失败: {e}")
+                return False
+            self.redis_client.delete_data(self._key(session_id))
+        logger.info(f"会话 {session_id} 历史已清除")
+        return True
+
+    def _drop_pending(self, session_id):
+        # 丢弃该会话尚未写入的记录
+        with self._pending_lock:
+            self._pending = [row for row in self._pending if row[0] != session_id]
+
+    async def aget(self, session_id):
+        """get() 的异步版本"""
+        if self.async_redis_client is None:
+            return await asyncio.to_thread(self.get, session_id)
+        entries = await self.async_redis_client.get_list(self._key(session_id), self.turns)
+        if entries:
+            return entries[::-1]
+        history = await self._afetch_from_mysql(session_id)
+        if history and entries is not None:
+            await self.async_redis_client.push_capped(self._key(session_id), history, self.turns, ex=self.ttl)
+        return history
+
+    async def _afetch_from_mysql(self, session_id):
+        # _fetch_from_mysql() 的异步版本
+        if self.async_mysql_client is None:
+            return await asyncio.to_thread(self._fetch_from_mysql, session_id)
+        try:
+            async with self.async_mysql_client.cursor() as cursor:
+                await cursor.execute(_FETCH_SQL, (session_id, self.turns))
+                rows = await cursor.fetchall()
+        except pymysql.MySQLError as e:
+            logger.error(f"获取对话历史失败: {e}")
+            return []
+        return [{"question": question, "answer": answer} for question, answer in rows][::-1]
+
+    async def aappend(self, session_id, question, answer):
+        """append() 的异步版本"""
+        if self.async_redis_client is None:
+            return await asyncio.to_thread(self.append, session_id, question, answer)
+        entry = {"question": question, "answer": answer}
+        history = await self.aget(session_id)
+        await self.async_redis_client.push_capped(self._key(session_id), [entry], self.turns, ex=self.ttl)
+        self._enqueue(session_id, question, answer)
+        return (history + [entry])[-self.turns:]
+
+    async def aclear(self, session_id):
+        """clear() 的异步版本"""
+        if self.async_redis_client is None or self.async_mysql_client is None:
+            return await asyncio.to_thread(self.clear, session_id)
+        # 与后台批量写入互斥: 轮询获取线程锁, 不阻塞事件循环; 顺序与 clear() 一致, Redis 列表最后删除
+        while not self._write_lock.acquire(blocking=False):
+            await asyncio.sleep(0.01)
+        try:
+            self._drop_pending(session_id)
+            async with self.async_mysql_client.cursor() as cursor:
+                await cursor.execute(_DELETE_SQL, (session_id,))
+            await self.async_redis_client.delete_data(self._key(session_id))
+        except pymysql.MySQLError as e:
+            logger.error(f"清除会话历史失败: {e}")
+            return False
+        finally:
+            self._write_lock.release()
+        logger.info(f"会话 {session_id} 历史已清除")
+        return True
+
+    def flush(self):
+        """把最多 flush_batch 条待写记录批量写入 MySQL, 返回写入条数; 失败时记录放回队列, 下次重试"""
+        with self._write_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending[:self.flush_batch], self._pending[self.flush_batch:]
+            if not batch:
+                return 0
+            try:
+                with self.mysql_client.cursor() as cursor:
+                    cursor.executemany(_INSERT_SQL, batch)
+            except pymysql.MySQLError as e:
+                logger.error(f"批量写入会话历史失败, 稍后重试: {e}")
+                with self._pending_lock:
+                    self._pending[:0] = batch
+                    # MySQL 长时间不可用时只保留最新的记录, 防止内存无限增长
+                    overflow = len(self._pending) - self.flush_batch * 100
+                    if overflow > 0:
+                        logger.warning(f"会话历史待写队列已满, 丢弃最早的 {overflow} 条记录")
+                        del self._pending[:overflow]
+                return 0
+        logger.debug(f"批量写入会话历史: {len(batch)} 条")
+        return len(batch)
+
+    def flush_all(self):
+        """写完所有待写记录(写入失败时停止)"""
+        while self.flush():
+            pass
+
+    def _write_behind(self):
+        # 后台线程: 定时或积累到一批时写入 MySQL
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush_all()
+            except Exception as e:
+                # 后台线程不能退出
+                logger.error(f"会话历史写入线程异常: {e}")
@@ -0,0 +1,172 @@
+# cache/SingleFlight.py
+# 相同问题的并发去重: 跨 worker 只让一个请求生成答案, 其余请求从 Redis 流中回放生成的 token
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# 将路径添加到环境变量里面
+dir_cache = os.path.dirname(__file__) #当前文件所在的文件夹
+qa_dir = os.path.dirname(dir_cache) # 上一级路径
+sys_dir = os.path.dirname(qa_dir)
+# 路径添加到系统环境里面
+sys.path.insert(0,qa_dir)
+sys.path.insert(0,sys_dir)
+
+from base import Config, logger
+from cache.RedisClient import tagged_key
+from utils.preprocess import normalize_text
+
+
+class SingleFlight:
+    """基于 Redis 的 single-flight
+
+    相同的请求(归一化问题 + 学科过滤 + 对话历史)同时到达时, 第一个用 SET NX 抢到标记的请求在后台线程中生成答案,
+    把每个 token 追加到以本次生成 id 命名的 Redis 流; 所有请求(包括发起者)都从流中读取 token,
+    因此发起请求的客户端断开不会中断其他请求. 生成结束后流和标记再保留 stream_ttl 秒, 期间到达的相同请求直接回放.
+    arun 为异步版本: 用 AsyncRedisClient 读取流, 等待中的请求不占用线程.
+    """
+
+    def __init__(self, redis_client, config=None, async_redis_client=None):
+        config = config or Config()
+        self.redis_client = redis_client
+        # 异步请求路径使用的 AsyncRedisClient(可选)
+        self.async_redis_client = async_redis_client
+        # 异步请求需要在本请求中直接生成时, 在这个有界线程池中迭代阻塞的生成器, 不占用默认线程池
+        self._executor = ThreadPoolExecutor(max_workers=config.SINGLEFLIGHT_LOCAL_THREADS,
+                                            thread_name_prefix='singleflight')
+        self.lock_ttl = config.SINGLEFLIGHT_LOCK_TTL
+        self.wait = config.SINGLEFLIGHT_WAIT
+        self.stream_ttl = config.SINGLEFLIGHT_STREAM_TTL
+
+    @staticmethod
+    def key(query, source_filter=None, history=None):
+        """请求的去重键: 只差标点、全半角、空白或大小写的问题视为相同, 对话历史不同则不合并"""
+        payload = json.dumps([normalize_text(query) or query, source_filter, history or []], ensure_ascii=False)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _produce(self, tag, flight_id, produce):
+        # 后台线程: 生成 token 并写入流, 结束时写入 end 标记; 出错时写入 error 标记并删除去重标记, 让后续请求重新生成
+        lock_key, stream = tagged_key(tag, 'lock'), tagged_key(tag, 'stream', flight_id)
+        try:
+            tokens = produce()
+            while True:
+                try:
+                    token = next(tokens)
+                except StopIteration as stop:
+                    completed = stop.value is not False
+                    break
+                if token:
+                    self.redis_client.xadd(stream, {'token': token}, ex=self.stream_ttl)
+            if not completed:
+                # 生成器返回 False 表示没有完整生成(如 LLM 调用中途失败), 不作为完整结果发布
+                raise RuntimeError('生成未完整结束')
+            self.redis_client.xadd(stream, {'end': '1'}, ex=self.stream_ttl)
+            # 标记保留到流过期, 期间的相同请求直接回放已完成的流
+            self.redis_client.set_data(lock_key, flight_id, ex=self.stream_ttl)
+        except Exception as e:
+            logger.error(f'single-flight 生成失败: {e}')
+            self.redis_client.xadd(stream, {'error': str(e)}, ex=self.stream_ttl)
+            self.redis_client.delete_if_equal(lock_key, flight_id)
+
+    def run(self, key, produce):
+        """返回 token 生成器: produce 为无参函数, 返回真正生成答案的 token 生成器, 只在抢到标记的请求中调用;
+        该生成器返回 False 时表示没有完整生成, 按生成失败处理.
+        回放其他请求的生成结果时, 已经输出部分 token 后超时或出错会抛出 RuntimeError, 而不是当作正常结束"""
+        # 标记和流使用同一个哈希标签, 集群模式下落在同一节点
+        tag = f'qa_singleflight:{key}'
+        lock_key = tagged_key(tag, 'lock')
+        flight_id = uuid.uuid4().hex
+        acquired = self.redis_client.set_if_absent(lock_key, flight_id, ex=self.lock_ttl)
+        if acquired is None:
+            # Redis 不可用, 直接生成
+            yield from produce()
+            return
+        if acquired:
+            logger.info(f'single-flight 开始生成: {key}')
+            threading.Thread(target=self._produce, args=(tag, flight_id, produce), daemon=True).start()
+        else:
+            flight_id = self.redis_client.get_data(lock_key)
+            if flight_id is None:
+                # 标记恰好过期或被删除, 直接生成
+                yield from produce()
+                return
+            logger.info(f'single-flight 回放其他请求的生成结果: {key}')
+        stream = tagged_key(tag, 'stream', flight_id)
+        last_id, replayed, error = '0', False, None
+        while error is None:
+            messages = self.redis_client.xread(stream, last_id, block=self.wait * 1000)
+            if not messages:
+                # 超时(生成者可能已崩溃)返回空列表, Redis 出错(如连接用完)返回 None
+                error = '等待超时' if messages == [] else '读取生成结果失败'
+                break
+            for last_id, fields in messages:
+                if 'token' in fields:
+                    replayed = True
+                    yield fields['token']
+                elif 'end' in fields:
+                    return
+                else:
+                    error = f'生成出错: {fields.get("error")}'
+                    break
+        logger.warning(f'single-flight {error}: {key}')
+        if replayed:
+            # 已经输出了部分 token, 不能当作完整答案正常结束: 抛给调用方, 不写入会话历史
+            raise RuntimeError(f'single-flight {error}, 答案不完整')
+        # 还没有输出任何 token 的请求自己生成
+        yield from produce()
+
+    async def arun(self, key, produce):
+        """run() 的异步版本, 返回异步 token 生成器: 标记和流的读写走异步 Redis 客户端, 等待生成结果不占用线程;
+        只有 Redis 不可用等需要在本请求中直接生成时, 才在有界线程池中迭代阻塞的生成器"""
+        if self.async_redis_client is None:
+            async for token in self._aiterate(self.run(key, produce)):
+                yield token
+            return
+        tag = f'qa_singleflight:{key}'
+        lock_key = tagged_key(tag, 'lock')
+        flight_id = uuid.uuid4().hex
+        acquired = await self.async_redis_client.set_if_absent(lock_key, flight_id, ex=self.lock_ttl)
+        if acquired:
+            logger.info(f'single-flight 开始生成: {key}')
+            threading.Thread(target=self._produce, args=(tag, flight_id, produce), daemon=True).start()
+        else:
+            flight_id = None if acquired is None else await self.async_redis_client.get_data(lock_key)
+            if flight_id is None:
+                # Redis 不可用, 或标记恰好过期、被删除: 直接生成
+                async for token in self._aiterate(produce()):
+                    yield token
+                return
+            logger.info(f'single-flight 回放其他请求的生成结果: {key}')
+        stream = tagged_key(tag, 'stream', flight_id)
+        last_id, replayed, error = '0', False, None
+        while error is None:
+            messages = await self.async_redis_client.xread(stream, last_id, block=self.wait * 1000)
+            if not messages:
+                error = '等待超时' if messages == [] else '读取生成结果失败'
+                break
+            for last_id, fields in messages:
+                if 'token' in fields:
+                    replayed = True
+                    yield fields['token']
+                elif 'end' in fields:
+                    return
+                else:
+                    error = f'生成出错: {fields.get("error")}'
+                    break
+        logger.warning(f'single-flight {error}: {key}')
+        if replayed:
+            raise RuntimeError(f'single-flight {error}, 答案不完整')
+        async for token in self._aiterate(produce()):
+            yield token
+
+    async def _aiterate(self, tokens):
+        # 在有界线程池中逐个取出阻塞生成器的 token
+        loop = asyncio.get_running_loop()
+        done = object()
+        while (token := await loop.run_in_executor(self._executor, next, tokens, done)) is not done:
+            yield token
@@ -0,0 +1,87 @@
+# db/AsyncMySQLClient.py
+# 异步 MySQL 客户端: 基于 aiomysql 连接池, 供 FastAPI 的异步请求路径使用, 不阻塞事件循环
+import asyncio
+import os
+import sys
+from contextlib import asynccontextmanager
+
+import aiomysql
+import pymysql
+
+# 将路径添加到环境变量里面
+dir_cache = os.path.dirname(__file__)  # 当前文件所在的文件夹
+qa_dir = os.path.dirname(dir_cache)  # 上一级路径
+sys_dir = os.path.dirname(qa_dir)
+# 路径添加到系统环境里面
+sys.path.insert(0, qa_dir)
+sys.path.insert(0, sys_dir)
+
+# 导入配置和日志
+from base import Config, logger
+
+
+class AsyncMySQLClient:
+    """异步 MySQL 客户端
+
+    连接池在第一次使用时于当前事件循环中创建, 大小与同步连接池相同(MYSQL_POOL_SIZE);
+    连接全部借出时等待 MYSQL_POOL_TIMEOUT 秒, 仍借不到则抛出 pymysql.err.OperationalError.
+    aiomysql 的异常即 pymysql 的异常类型, 调用方用 except pymysql.MySQLError 处理, 与同步路径一致.
+    """
+
+    def __init__(self, config=None):
+        config = config or Config()
+        self._pool_kwargs = dict(
+            user=config.MYSQL_USER,
+            password=config.MYSQL_PASSWORD,
+            host=config.MYSQL_HOST,
+            db=config.MYSQL_DATABASE,
+            charset='utf8mb4',  # 支持emoji和特殊字符
+            minsize=0,
+            maxsize=config.MYSQL_POOL_SIZE
+        )
+        self.timeout = config.MYSQL_POOL_TIMEOUT
+        self.pool = None
+        self._pool_lock = asyncio.Lock()
+
+    async def _get_pool(self):
+        # 获取(必要时创建)连接池
+        if self.pool is None:
+            async with self._pool_lock:
+                if self.pool is None:
+                    self.pool = await aiomysql.create_pool(**self._pool_kwargs)
+                    logger.info('异步数据库连接池创建成功....')
+        return self.pool
+
+    @asynccontextmanager
+    async def connection(self):
+        """借用一个连接, async with 结束时归还; 未提交的事务(包括出现异常时)在归还前回滚"""
+        pool = await self._get_pool()
+        try:
+            conn = await asyncio.wait_for(pool.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise pymysql.err.OperationalError(f'MySQL 异步连接池等待超时: {self.timeout} 秒内没有空闲连接')
+        try:
+            yield conn
+        finally:
+            try:
+                await conn.rollback()
+            except pymysql.MySQLError:
+                # 连接已失效, 关闭后归还, 连接池不再复用
+                conn.close()
+            await pool.release(conn)
+
+    @asynccontextmanager
+    async def cursor(self):
+        """借用连接并打开游标, 正常结束时提交, 出现异常时回滚"""
+        async with self.connection() as conn:
+            async with conn.cursor() as cursor:
+                yield cursor
+            await conn.commit()
+
+    async def close(self):
+        # 关闭连接池
+        if self.pool is not None:
+            self.pool.close()
+            await self.pool.wait_closed()
+            self.pool = None
+            logger.info("MySQL 异步连接池已关闭")
@@ -0,0 +1,240 @@
+# db/Migrations.py
+# 数据库结构的版本化迁移: 按版本号依次执行未执行过的迁移, 已执行的版本记录在 schema_migrations 表中
+import os
+import sys
+from datetime import date
+
+import pymysql
+
+# 将路径添加到环境变量里面
+dir_cache = os.path.dirname(__file__)  # 当前文件所在的文件夹
+qa_dir = os.path.dirname(dir_cache)  # 上一级路径
+sys_dir = os.path.dirname(qa_dir)
+# 路径添加到系统环境里面
+sys.path.insert(0, qa_dir)
+sys.path.insert(0, sys_dir)
+
+# 导入配置和日志
+from base import Config, logger
+# 导入唯一哈希和文本归一化, 回填旧数据时使用
+from db.MySQLClient import question_hash
+from utils.preprocess import normalize_text
+
+# 已注册的迁移: [(版本号, 说明, 函数(cursor, config), 是否需要离线执行), ...]
+MIGRATIONS = []
+# 离线执行迁移(命令行)时等待迁移锁的时长(秒); 服务启动时不等待, 拿不到锁直接跳过
+LOCK_TIMEOUT = 300
+# 回填数据时每批的行数
+BACKFILL_BATCH = 5000
+
+
+def migration(version, description, offline=False):
+    """注册一个迁移; 迁移函数本身也要可重复执行(DDL 会隐式提交, 中途失败后重跑时跳过已完成的部分).
+    offline=True 表示迁移会重建大表或逐批回填数据, 耗时与数据量成正比, 不在服务启动时执行"""
+    def register(func):
+        MIGRATIONS.append((version, description, func, offline))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return register
+
+
+def _columns(cursor, table):
+    # 表中已有的列名
+    cursor.execute('select column_name from information_schema.columns '
+                   'where table_schema = database() and table_name = %s', (table,))
+    return {row[0].lower() for row in cursor.fetchall()}
+
+
+def _indexes(cursor, table):
+    # 表中已有的索引名
+    cursor.execute('select distinct index_name from information_schema.statistics '
+                   'where table_schema = database() and table_name = %s', (table,))
+    return {row[0].lower() for row in cursor.fetchall()}
+
+
+def _partitions(cursor, table):
+    # 表的分区名, 按顺序排列; 未分区的表返回空列表
+    cursor.execute('select partition_name from information_schema.partitions '
+                   'where table_schema = database() and table_name = %s and partition_name is not null '
+                   'order by partition_ordinal_position', (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _add_months(day, months):
+    # day 所在月份之后第 months 个月的 1 号
+    year, month = divmod(day.year * 12 + day.month - 1 + months, 12)
+    return date(year, month + 1, 1)
+
+
+def _month_partitions(first, last):
+    # first ~ last 每月一个分区 p年月, 存放该月的记录
+    definitions, month = [], _add_months(first, 0)
+    while month <= last:
+        definitions.append(f"partition p{month:%Y%m} values less than ('{_add_months(month, 1):%Y-%m-%d}')")
+        month = _add_months(month, 1)
+    return definitions
+
+
+@migration(1, '创建 jpkb 和 conversations 表')
+def _create_tables(cursor, config):
+    cursor.execute('''
+        create table if not exists jpkb(
+                id           int auto_increment primary key,
+                subject_name varchar(20)   ,
+                question     varchar(1000) ,
+                answer       varchar(1000)
+        )
+    ''')
+    # 使用 utf8mb4 字符集支持emoji和特殊字符
+    cursor.execute('''
+        create table if not exists conversations(
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            session_id VARCHAR(36) NOT NULL,
+            question TEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL,
+            answer TEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL,
+            timestamp DATETIME NOT NULL,
+            INDEX idx_session_id (session_id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    ''')
+
+
+@migration(2, 'jpkb 增加归一化问题、唯一哈希和分词结果列')
+def _add_question_columns(cursor, config):
+    existing = _columns(cursor, 'jpkb')
+    for column, ddl in (('question_hash', 'add column question_hash char(32) null'),
+                        ('question_norm', 'add column question_norm varchar(1000) null'),
+                        ('question_tokens', 'add column question_tokens text null')):
+        if column not in existing:
+            cursor.execute(f'alter table jpkb {ddl}')
+    if 'uk_question_hash' not in _indexes(cursor, 'jpkb'):
+        cursor.execute('alter table jpkb add unique key uk_question_hash (question_hash)')
+
+
+@migration(3, '回填旧数据的归一化问题和唯一哈希', offline=True)
+def _backfill_question_hash(cursor, config):
+    last_id = 0
+    while True:
+        cursor.execute('select id, subject_name, question from jpkb where id > %s and question_norm is null '
+                       'order by id limit %s', (last_id, BACKFILL_BATCH))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        normalized = [(question_id, subject_name, normalize_text(question or ''))
+                      for question_id, subject_name, question in rows]
+        cursor.executemany('update jpkb set question_norm = %s where id = %s',
+                           [(norm, question_id) for question_id, _, norm in normalized])
+        # 学科和归一化问题都相同的重复行, 只有第一行得到哈希, 其余保持为空
+        cursor.executemany('update ignore jpkb set question_hash = %s where id = %s',
+                           [(question_hash(subject_name, norm), question_id)
+                            for question_id, subject_name, norm in normalized])
+        # 每批单独提交, 事务大小有上限
+        cursor.connection.commit()
+        logger.info(f'jpkb 回填到 id {last_id}')
+
+
+@migration(4, 'jpkb 按归一化问题建索引, 按问题查答案不再全表扫描')
+def _index_question_norm(cursor, config):
+    if 'idx_question_norm' not in _indexes(cursor, 'jpkb'):
+        # 前缀索引: utf8mb4 下完整的 varchar(1000) 超过 InnoDB 索引长度上限
+        cursor.execute('alter table jpkb add index idx_question_norm (question_norm(191))')
+
+
+@migration(5, 'conversations 改用 (session_id, timestamp) 联合索引')
+def _index_session_time(cursor, config):
+    indexes = _indexes(cursor, 'conversations')
+    changes = []
+    if 'idx_session_time' not in indexes:
+        # 按会话取最近几轮、按会话删除都直接走索引顺序, 不再对会话的全部记录排序
+        changes.append('add index idx_session_time (session_id, timestamp)')
+    if 'idx_session_id' in indexes:
+        # 已被联合索引的前缀覆盖
+        changes.append('drop index idx_session_id')
+    if changes:
+        cursor.execute(f'alter table conversations {", ".join(changes)}')
+
+
+@migration(6, 'conversations 按月分区', offline=True)
+def _partition_conversations(cursor, config):
+    if _partitions(cursor, 'conversations'):
+        return
+    cursor.execute('select min(timestamp) from conversations')
+    first = cursor.fetchone()[0] or date.today()
+    last = _add_months(date.today(), config.CONVERSATION_PARTITIONS_AHEAD)
+    definitions = _month_partitions(first, last) + ['partition pmax values less than (maxvalue)']
+    # 分区键必须包含在每个唯一键中: 主键改为 (id, timestamp); 一条语句完成, 只重建一次表
+    cursor.execute('alter table conversations drop primary key, add primary key (id, timestamp) '
+                   f'partition by range columns(timestamp) ({", ".join(definitions)})')
+
+
+def maintain_partitions(cursor, config):
+    """conversations 的分区维护: 预先建好未来几个月的分区; 配置了保留月数时删除更早的分区(整个分区删除, 不逐行 DELETE)"""
+    names = [name for name in _partitions(cursor, 'conversations') if name != 'pmax']
+    if not names:
+        return
+    this_month = date.today().replace(day=1)
+    last = date(int(names[-1][1:5]), int(names[-1][5:7]), 1)
+    definitions = _month_partitions(_add_months(last, 1), _add_months(this_month, config.CONVERSATION_PARTITIONS_AHEAD))
+    if definitions:
+        cursor.execute(f'alter table conversations reorganize partition pmax into '
+                       f'({", ".join(definitions)}, partition pmax values less than (maxvalue))')
+        logger.info(f'conversations 新增分区: {len(definitions)} 个')
+    if config.CONVERSATION_RETENTION_MONTHS > 0:
+        cutoff = f'p{_add_months(this_month, -config.CONVERSATION_RETENTION_MONTHS):%Y%m}'
+        expired = [name for name in names if name < cutoff]
+        if expired:
+            cursor.execute(f'alter table conversations drop partition {", ".join(expired)}')
+            logger.info(f'conversations 删除过期分区: {expired}')
+
+
+def migrate(mysql_client, config=None, offline=False):
+    """执行未执行的迁移并维护分区; 已是最新结构时只做几次元数据查询. 失败时抛出 pymysql.MySQLError
+
+    服务启动时 offline=False: 不等待迁移锁, 其他进程正在迁移时直接跳过, 照常提供服务;
+    遇到需要离线执行的迁移时停下(之后的迁移可能依赖它), 只记录警告.
+    offline=True 用于命令行 python mysql_qa/db/Migrations.py: 等待迁移锁, 执行包括离线迁移在内的全部迁移
+    """
+    config = config or Config()
+    with mysql_client.pool.connection() as conn, conn.cursor() as cursor:
+        # 迁移锁: 与连接绑定, 同一时刻只有一个进程执行迁移
+        cursor.execute("select get_lock(concat(database(), '.schema_migrations'), %s)",
+                       (LOCK_TIMEOUT if offline else 0,))
+        if not cursor.fetchone()[0]:
+            if offline:
+                raise pymysql.err.OperationalError(f'等待数据库迁移锁超时: {LOCK_TIMEOUT} 秒')
+            logger.warning('其他进程正在执行数据库迁移, 本进程跳过迁移')
+            return
+        try:
+            cursor.execute('''
+                create table if not exists schema_migrations(
+                    version     int primary key,
+                    description varchar(200) not null,
+                    applied_at  datetime     not null
+                )
+            ''')
+            cursor.execute('select version from schema_migrations')
+            applied = {row[0] for row in cursor.fetchall()}
+            for version, description, func, offline_only in MIGRATIONS:
+                if version in applied:
+                    continue
+                if offline_only and not offline:
+                    pending = [item[0] for item in MIGRATIONS if item[0] >= version and item[0] not in applied]
+                    logger.warning(f'数据库迁移 {version}({description}) 需要离线执行, 未执行的迁移 {pending} 本次跳过; '
+                                   f'请运行 python mysql_qa/db/Migrations.py')
+                    break
+                logger.info(f'执行数据库迁移 {version}: {description}')
+                func(cursor, config)
+                cursor.execute('insert into schema_migrations (version, description, applied_at) values (%s, %s, now())',
+                               (version, description))
+                conn.commit()
+            maintain_partitions(cursor, config)
+        finally:
+            cursor.execute("select release_lock(concat(database(), '.schema_migrations'))")
+    logger.info('数据库迁移检查完成')
+
+
+if __name__ == '__main__':
+    # 离线执行全部迁移(包括重建大表、回填数据的迁移): python mysql_qa/db/Migrations.py
+    from db.MySQLClient import MySQLClient
+    config = Config()
+    migrate(MySQLClient(config), config, offline=True)
@@ -1,11 +1,15 @@
 # db/mysql_client.py
 # 导入 MySQL 连接库
+import csv
+import hashlib
+import json
 import os.path
 import sys
+import tempfile
+import threading
+from itertools import islice
 
 import pymysql
-# 导入pandas
-import pandas as pd
 
 # 将路径添加到环境变量里面
 dir_cache = os.path.dirname(__file__)  # 当前文件所在的文件夹
@@ -17,83 +21,211 @@ sys.path.insert(0, sys_dir)
 
 # 导入配置和日志
 from base import Config, logger
+# 导入连接池
+from db.MySQLPool import MySQLPool
+# 导入文本归一化和批量分词
+from utils.preprocess import normalize_text, preprocess_pool
+
+# 每个进程共享的连接池, 按连接参数区分
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _connection_pool(config):
+    # 获取(必要时创建)与配置对应的连接池
+    key = (config.MYSQL_HOST, config.MYSQL_USER, config.MYSQL_PASSWORD, config.MYSQL_DATABASE)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = MySQLPool(config)
+        return _pools[key]
+
+
+def question_hash(subject_name, normalized):
+    """学科 + 归一化问题 -> 32 位十六进制哈希, 作为 jpkb 的唯一键, 重复导入时按它更新而不是重复插入"""
+    return hashlib.blake2b(f'{subject_name}\0{normalized}'.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _infile_field(value):
+    # LOAD DATA 默认格式的字段转义: 反斜杠、制表符、换行转义, None 写成 \N
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+# 导入时写入的列, 以及重复问题的更新方式(id 不变, BM25 快照和缓存中的问题 id 仍然有效)
+_LOAD_COLUMNS = 'subject_name, question, answer, question_hash, question_norm, question_tokens'
+_UPSERT = ('on duplicate key update question = values(question), answer = values(answer), '
+           'question_norm = values(question_norm), question_tokens = values(question_tokens)')
 
 
 class MySQLClient:
-    def __init__(self):
-        logger.info('创建数据库初始化连接......')
-        # 创建初始化连接
-        try:
-            self.connect = pymysql.connect(
-                user=Config().MYSQL_USER,
-                password=Config().MYSQL_PASSWORD,
-                host=Config().MYSQL_HOST,
-                database=Config().MYSQL_DATABASE,
-                charset='utf8mb4'  # 支持emoji和特殊字符
-            )
-            # 获取cursor(游标)对象 ,通过该对象,可以实现对表的增删改查
-            self.cursor = self.connect.cursor()
-            logger.info('数据库客户端连接对象初始化成功....')
-        except pymysql.MySQLError as e:
-            logger.info(f'数据库初始化异常:{e}')
+    def __init__(self, config=None):
+        logger.info('创建数据库连接池......')
+        # 同一进程内的客户端共用一个连接池, 每次操作借用独立的连接和游标, 并发请求互不干扰
+        self.config = config or Config()
+        self.pool = _connection_pool(self.config)
+        logger.info('数据库客户端初始化成功....')
+
+    def cursor(self):
+        """借用连接并打开游标: with client.cursor() as cursor: ..., 正常结束时提交, 出现异常时回滚"""
+        return self.pool.cursor()
 
     def create_table(self):
+        """创建或升级表结构: 执行 db/Migrations.py 中尚未执行的全部迁移(包括需要离线执行的迁移), 用于部署步骤"""
         logger.info('创建表结构.....')
-        sql = '''
-            create table if not exists jpkb(
-                    id           int auto_increment primary key,
-                    subject_name varchar(20)   ,
-                    question     varchar(1000) ,
-                    answer       varchar(1000) 
-            );
-        '''
+        # 迁移模块依赖本模块的 question_hash, 在这里导入避免循环导入
+        from db.Migrations import migrate
         try:
-            self.cursor.execute(sql)
+            migrate(self, self.config, offline=True)
             logger.info('表创建成功....')
         except pymysql.MySQLError as e:
             logger.info(f'表创建失败:{e}')
 
-    def insert_data(self, csv_path):
+    def insert_data(self, csv_path, chunk_size=5000, local_infile=False):
+        """流式导入知识库 CSV(学科名称, 问题, 答案), 内存占用只与 chunk_size 有关
+
+        每块在同一遍中算出归一化问题、唯一哈希和分词结果一起写入, BM25 建库时直接读取分词结果, 不再重新分词;
+        按哈希 upsert, 重复导入同一份文件只更新答案. 默认用 executemany(pymysql 会改写成多行 insert),
+        local_infile=True 时每块先 LOAD DATA LOCAL INFILE 到临时表再合并, 需要服务端开启 local_infile
+        并在配置中设置 [mysql] local_infile = true.
+        这里只写 MySQL: 服务运行时请用 IntegratedQASystem.import_knowledge() 导入, 导入后会重建 BM25 索引并让答案缓存失效.
+        """
         logger.info('插入数据.......')
-        sql = 'insert into jpkb(subject_name, question, answer)  values (%s,%s,%s);'
-        # 读取本地知识文件
+        total = 0
         try:
-            df = pd.read_csv(csv_path)
-            for id, row in df.iterrows():
-                # 数据插入
-                self.cursor.execute(sql, (row['学科名称'], row['问题'], row['答案']))
-            self.connect.commit()  # 提交
+            # 各块共用一组分词 worker 进程(独立启动, 不 fork 当前进程)
+            with open(csv_path, encoding='utf-8', newline='') as f, preprocess_pool() as preprocess_batch, \
+                    self.pool.connection() as conn:
+                reader = csv.DictReader(f)
+                with conn.cursor() as cursor:
+                    if local_infile:
+                        cursor.execute('create temporary table if not exists jpkb_stage like jpkb')
+                    while True:
+                        chunk = list(islice(reader, chunk_size))
+                        if not chunk:
+                            break
+                        rows = self._prepare_rows(chunk, preprocess_batch)
+                        if local_infile:
+                            self._load_infile(cursor, rows)
+                        else:
+                            cursor.executemany(f'insert into jpkb({_LOAD_COLUMNS}) values (%s,%s,%s,%s,%s,%s) {_UPSERT}',
+                                               rows)
+                        # 每块单独提交, 事务大小有上限
+                        conn.commit()
+                        total += len(rows)
+                        logger.info(f'已导入 {total} 条问答...')
             logger.info('数据插入成功....')
-        except pymysql.MySQLError as e:
+        except (pymysql.MySQLError, OSError) as e:
             logger.info(f'数据插入失败:{e}')
+        return total
+
+    @staticmethod
+    def _prepare_rows(chunk, preprocess_batch):
+        # CSV 行 -> 待写入的列值; 分词按块交给 preprocess_pool() 的批量分词函数
+        questions = [row['问题'] for row in chunk]
+        tokenized = preprocess_batch(questions)
+        rows = []
+        for row, tokens in zip(chunk, tokenized):
+            normalized = normalize_text(row['问题'])
+            rows.append((row['学科名称'], row['问题'], row['答案'], question_hash(row['学科名称'], normalized),
+                         normalized, json.dumps(tokens, ensure_ascii=False)))
+        return rows
+
+    @staticmethod
+    def _load_infile(cursor, rows):
+        # 一块数据写成临时文件, LOAD DATA 到临时表后合并进 jpkb
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.tsv', delete=False) as f:
+            for row in rows:
+                f.write('\t'.join(map(_infile_field, row)) + '\n')
+        try:
+            cursor.execute('delete from jpkb_stage')
+            cursor.execute(f"load data local infile %s into table jpkb_stage character set utf8mb4 ({_LOAD_COLUMNS})",
+                           (f.name,))
+            cursor.execute(f'insert into jpkb({_LOAD_COLUMNS}) select {_LOAD_COLUMNS} from jpkb_stage {_UPSERT}')
+        finally:
+            os.remove(f.name)
+
+    def _iter_rows(self, sql, batch_size):
+        # 服务端游标(SSCursor)流式读取: 结果集不在客户端整体缓存, 每次 fetchmany 一批; 读完或生成器关闭前占用一个连接
+        with self.pool.connection() as conn:
+            with conn.cursor(pymysql.cursors.SSCursor) as cursor:
+                cursor.execute(sql)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from rows
+
+    def iter_questions(self, batch_size=5000):
+        """流式读取所有问题, 逐行产出 (id, question); 出错时记录日志并抛出 pymysql.MySQLError"""
+        logger.info('流式读取所有的问题...')
+        try:
+            yield from self._iter_rows('select id, question from jpkb', batch_size)
+        except pymysql.MySQLError as e:
+            logger.info(f'所有的问题查询失败:{e}')
+            raise
 
     def fetch_questions(self):
-        # 获取所有问题
+        # 获取所有问题, 连同 id 一起返回: ((id, question), ...)
         logger.info('查询所有的问题...')
         try:
-            self.cursor.execute('select question from jpkb')
-            tuple_questions = self.cursor.fetchall()
+            tuple_questions = tuple(self.iter_questions())
             logger.info('所有的问题查询完毕...')
             return tuple_questions
+        except pymysql.MySQLError:
+            return None
+
+    def iter_qa_pairs(self, batch_size=5000):
+        """流式读取所有问答对, 按 id 顺序逐行产出 (id, question, answer, subject_name, tokens), 供 BM25 层边读边建索引
+
+        tokens 为导入时预先算好的分词结果, 旧数据或旧表没有时为 None; 出错时记录日志并抛出 pymysql.MySQLError
+        """
+        logger.info('流式读取所有的问答对...')
+        try:
+            with self.cursor() as cursor:
+                cursor.execute("select count(*) from information_schema.columns where table_schema = database() "
+                               "and table_name = 'jpkb' and column_name = 'question_tokens'")
+                # 旧表没有 question_tokens 列
+                tokens_column = 'question_tokens' if cursor.fetchone()[0] else 'null'
+            for question_id, question, answer, subject_name, tokens in self._iter_rows(
+                    f'select id, question, answer, subject_name, {tokens_column} from jpkb order by id', batch_size):
+                yield question_id, question, answer, subject_name, json.loads(tokens) if tokens else None
         except pymysql.MySQLError as e:
-            logger.info(f'所有的问题查询失败:{e}')
+            logger.info(f'所有的问答对查询失败:{e}')
+            raise
+
+    def fetch_qa_pairs(self):
+        # 一次性获取所有问答对: ((id, question, answer, subject_name, tokens), ...); 题库较大时用 iter_qa_pairs 流式读取
+        logger.info('查询所有的问答对...')
+        try:
+            tuple_pairs = tuple(self.iter_qa_pairs())
+            logger.info('所有的问答对查询完毕...')
+            return tuple_pairs
+        except pymysql.MySQLError:
+            return None
 
-    def fetch_answer(self, question):
-        # 获取指定问题的答案
+    def fetch_answer(self, question, subject_name=None):
+        # 获取指定问题的答案: 给出学科时按唯一哈希查找, 否则走归一化问题的索引再精确比较原问题
         logger.info('查询所有的问题...')
+        normalized = normalize_text(question)
         try:
-            self.cursor.execute('select answer from jpkb where question = %s',question)
-            tuple_answer = self.cursor.fetchone()
+            with self.cursor() as cursor:
+                if subject_name is not None:
+                    cursor.execute('select answer from jpkb where question_hash = %s',
+                                   question_hash(subject_name, normalized))
+                else:
+                    cursor.execute('select answer from jpkb where question_norm = %s and question = %s',
+                                   (normalized, question))
+                tuple_answer = cursor.fetchone()
             logger.info('答案查询完毕...')
             return tuple_answer
         except pymysql.MySQLError as e:
             logger.info(f'答案查询失败:{e}')
 
     def close(self):
-        # 关闭数据库连接
+        # 关闭连接池中的空闲连接
         try:
-            # 关闭连接
-            self.connect.close()
+            self.pool.close()
             # 记录关闭成功
             logger.info("MySQL 连接已关闭")
         except pymysql.MySQLError as e:
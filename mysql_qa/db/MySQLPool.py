@@ -0,0 +1,127 @@
+# db/MySQLPool.py
+# MySQL 连接池: 每次操作借用独立的连接和游标, 用完归还; 限制最大连接数, 借用超时报错, 空闲过久的连接先做健康检查
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import pymysql
+
+# 将路径添加到环境变量里面
+dir_cache = os.path.dirname(__file__)  # 当前文件所在的文件夹
+qa_dir = os.path.dirname(dir_cache)  # 上一级路径
+sys_dir = os.path.dirname(qa_dir)
+# 路径添加到系统环境里面
+sys.path.insert(0, qa_dir)
+sys.path.insert(0, sys_dir)
+
+# 导入配置和日志
+from base import Config, logger
+
+
+class MySQLPool:
+    """线程安全的 pymysql 连接池
+
+    最多同时借出 max_size 个连接, 全部借出时等待 timeout 秒, 仍借不到则抛出 pymysql.err.OperationalError,
+    调用方原有的 except pymysql.MySQLError 即可处理. 连接按后进先出复用, 空闲超过 ping_interval 秒的连接
+    借出前先 ping 一次, 失效则丢弃重建. fork 出的子进程不复用父进程的连接.
+    """
+
+    def __init__(self, config=None):
+        config = config or Config()
+        self._connect_kwargs = dict(
+            user=config.MYSQL_USER,
+            password=config.MYSQL_PASSWORD,
+            host=config.MYSQL_HOST,
+            database=config.MYSQL_DATABASE,
+            charset='utf8mb4',  # 支持emoji和特殊字符
+            local_infile=config.MYSQL_LOCAL_INFILE  # 允许 LOAD DATA LOCAL INFILE 批量导入
+        )
+        self.max_size = config.MYSQL_POOL_SIZE
+        self.timeout = config.MYSQL_POOL_TIMEOUT
+        self.ping_interval = config.MYSQL_POOL_PING_INTERVAL
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        # 空闲连接: (连接, 归还时间)
+        self._idle = queue.LifoQueue()
+        self._pid = os.getpid()
+
+    def _new_connection(self):
+        return pymysql.connect(**self._connect_kwargs)
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise pymysql.err.OperationalError(f'MySQL 连接池等待超时: {self.timeout} 秒内没有空闲连接')
+        try:
+            if os.getpid() != self._pid:
+                # fork 后的子进程: 父进程的连接不能共用, 直接丢弃
+                self._idle = queue.LifoQueue()
+                self._pid = os.getpid()
+            while True:
+                try:
+                    conn, released_at = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._new_connection()
+                if time.monotonic() - released_at < self.ping_interval:
+                    return conn
+                try:
+                    conn.ping(reconnect=False)
+                    return conn
+                except pymysql.MySQLError as e:
+                    logger.info(f'丢弃失效的 MySQL 连接: {e}')
+                    self._close(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, conn, broken=False):
+        if broken or not conn.open:
+            self._close(conn)
+        else:
+            self._idle.put((conn, time.monotonic()))
+        self._slots.release()
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except pymysql.MySQLError:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """借用一个连接, with 语句结束时归还; 未提交的事务(包括出现异常时)在归还前回滚, 需要写入时由调用方提交"""
+        conn = self._acquire()
+        broken = False
+        try:
+            yield conn
+        except pymysql.err.OperationalError:
+            # 连接层面的错误(断线等), 连接不再复用
+            broken = True
+            raise
+        finally:
+            if not broken:
+                try:
+                    # 结束未提交的事务, 也结束只读事务的一致性快照, 下一个借用者看到最新数据
+                    conn.rollback()
+                except pymysql.MySQLError:
+                    broken = True
+            self._release(conn, broken)
+
+    @contextmanager
+    def cursor(self):
+        """借用连接并打开游标, 正常结束时提交, 出现异常时回滚"""
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                yield cursor
+            conn.commit()
+
+    def close(self):
+        """关闭所有空闲连接; 借出中的连接归还后仍会回到池中"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close(conn)
@@ -0,0 +1,406 @@
+# retrieval/bm25_index.py
+# 基于稀疏矩阵的 BM25 打分引擎, 用来替代 rank_bm25.BM25Okapi
+from collections import Counter
+
+# 导入数值计算库
+import numpy as np
+# 导入稀疏矩阵
+from scipy import sparse
+
+
+def _grow(array, size, fill=0):
+    # 数组容量不足时按倍数扩容, 避免每次增量写入都整体拷贝
+    if size <= len(array):
+        return array
+    extra = np.full(max(size, 2 * len(array), 16) - len(array), fill, dtype=array.dtype)
+    return np.concatenate([array, extra])
+
+
+class BM25Index:
+    """BM25Okapi 的向量化实现, 支持增量增删改
+
+    词项x文档 的词频存放在 CSR 矩阵里(每一行就是一个词的倒排列表), 查询时只读取查询词所在的行,
+    用当前的 idf 和 avgdl 现算 BM25 权重, 因此增删文档后分数与在新语料上重建的 BM25Okapi 一致.
+    增量写入先进入内存中的 delta 倒排, 删除只打墓碑标记, 积累到一定规模后合并回 CSR.
+    """
+
+    def __init__(self, tokenized_corpus=(), doc_keys=None, k1=1.5, b=0.75, epsilon=0.25, compact_ratio=0.1):
+        # BM25 参数, 默认值与 BM25Okapi 保持一致
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        # delta 倒排超过 CSR 非零元素的该比例时触发合并
+        self.compact_ratio = compact_ratio
+        # 词表: 词 -> 整数 id
+        self.vocab = {}
+        # 每个词的文档频率, 以及该词倒排中出现过的最大词频 / 最短文档长度(用于估计分数上界)
+        self.df = np.zeros(0, dtype=np.int64)
+        self.max_tf = np.zeros(0, dtype=np.float64)
+        self.min_dl = np.zeros(0, dtype=np.float64)
+        # 文档位置 -> 外部 id(如 jpkb.id), 位置只追加不复用; 反向映射在第一次增删改时才构建
+        self.doc_keys = []
+        self._key_to_pos = None
+        # 每个位置的文档长度和存活标记(删除只打墓碑)
+        self.doc_len = np.zeros(0, dtype=np.float64)
+        self.alive = np.zeros(0, dtype=bool)
+        # 存活文档数量和总长度, avgdl = total_len / corpus_size
+        self.corpus_size = 0
+        self.total_len = 0.0
+        # 词项x文档 的词频矩阵(基础段), 列按位置排列, 行内文档位置有序
+        self.tf = sparse.csr_matrix((0, 0), dtype=np.int32)
+        # 基础段的列视图, 删除基础段文档时按需构建
+        self._tf_csc = None
+        # 增量段: 词 id -> {位置: 词频}, 以及 位置 -> {词 id: 词频}
+        self.delta = {}
+        self.delta_docs = {}
+        self.delta_size = 0
+        # 基础段中已删除的文档数
+        self.deleted = 0
+        # idf 缓存, 文档集合变化后置空, 下次查询时重新计算
+        self._idf = None
+        # 构建索引
+        self._build(tokenized_corpus, doc_keys)
+
+    @property
+    def key_to_pos(self):
+        # 外部 id -> 文档位置, 只包含存活文档
+        if self._key_to_pos is None:
+            self._key_to_pos = {key: pos for pos, key in enumerate(self.doc_keys) if self.alive[pos]}
+        return self._key_to_pos
+
+    @property
+    def avgdl(self):
+        # 平均文档长度
+        return self.total_len / self.corpus_size if self.corpus_size else 0.0
+
+    def _build(self, tokenized_corpus, doc_keys):
+        # 稀疏矩阵的三元组: 行(词 id)、列(文档位置)、词频
+        term_ids, doc_ids, term_freqs = [], [], []
+        doc_len = []
+        for doc_id, tokens in enumerate(tokenized_corpus):
+            doc_len.append(len(tokens))
+            # 统计当前文档的词频
+            for token, freq in Counter(tokens).items():
+                term_ids.append(self.vocab.setdefault(token, len(self.vocab)))
+                doc_ids.append(doc_id)
+                term_freqs.append(freq)
+
+        self.doc_keys = list(doc_keys) if doc_keys is not None else list(range(len(doc_len)))
+        self.doc_len = np.asarray(doc_len, dtype=np.float64)
+        self.alive = np.ones(len(doc_len), dtype=bool)
+        self.corpus_size = len(doc_len)
+        self.total_len = float(self.doc_len.sum())
+        self.tf = sparse.csr_matrix((np.asarray(term_freqs, dtype=np.int32),
+                                     (np.asarray(term_ids, dtype=np.int32), np.asarray(doc_ids, dtype=np.int32))),
+                                    shape=(len(self.vocab), self.corpus_size))
+        self.tf.sort_indices()
+        self._refresh_term_stats()
+
+    def load_arrays(self, vocab, tf, doc_len, doc_keys, df, max_tf, min_dl):
+        """直接用现成的数组装配索引(如从 mmap 快照加载), 不做任何分词和统计
+
+        tf / doc_len 可以是只读数组, 增量写入时会自动拷贝扩容; df / max_tf / min_dl 会被原地更新, 需要可写
+        """
+        self.vocab = vocab
+        self.tf = tf
+        self.doc_len = doc_len
+        self.doc_keys = doc_keys
+        self._key_to_pos = None
+        self.alive = np.ones(len(doc_len), dtype=bool)
+        self.corpus_size = len(doc_len)
+        self.total_len = float(doc_len.sum())
+        self.df, self.max_tf, self.min_dl = df, max_tf, min_dl
+        self._tf_csc = None
+        self.delta, self.delta_docs, self.delta_size = {}, {}, 0
+        self.deleted = 0
+        self._idf = None
+        return self
+
+    def _refresh_term_stats(self):
+        # 从基础段重新统计文档频率和分数上界所需的 max_tf / min_dl
+        vocab_size = len(self.vocab)
+        coo = self.tf.tocoo()
+        self.df = np.bincount(coo.row, minlength=vocab_size).astype(np.int64)
+        self.max_tf = np.zeros(vocab_size)
+        np.maximum.at(self.max_tf, coo.row, coo.data)
+        self.min_dl = np.full(vocab_size, np.inf)
+        np.minimum.at(self.min_dl, coo.row, self.doc_len[coo.col])
+        self._idf = None
+
+    def _idf_array(self):
+        # idf 与 BM25Okapi 一致: 只统计语料中存在的词, 负值替换为 epsilon * 平均 idf
+        if self._idf is None:
+            df = self.df[:len(self.vocab)]
+            present = df > 0
+            idf = np.zeros(len(df))
+            idf[present] = np.log(self.corpus_size - df[present] + 0.5) - np.log(df[present] + 0.5)
+            if present.any():
+                average_idf = idf[present].mean()
+                idf[present & (idf < 0)] = self.epsilon * average_idf
+            self._idf = idf
+        return self._idf
+
+    def _bm25_weights(self, idf, tf, doc_len, avgdl):
+        # 按给定的 idf 和 avgdl 计算一段倒排的 BM25 权重
+        norm = self.k1 * (1 - self.b + self.b * doc_len / avgdl)
+        return idf * (tf * (self.k1 + 1) / (tf + norm))
+
+    def _upper_bound(self, term_id, idf, avgdl):
+        # 词在任意文档上的权重上界: 词频取最大、文档长度取最短(权重对两者单调)
+        if not self.df[term_id]:
+            return 0.0
+        return float(self._bm25_weights(idf, self.max_tf[term_id], self.min_dl[term_id], avgdl))
+
+    def _query_terms(self, query):
+        # 查询分词 -> {词 id: 出现次数}, 重复出现的词按次数累加(与 BM25Okapi 一致)
+        term_ids = (self.vocab.get(token) for token in query)
+        return Counter(term_id for term_id in term_ids if term_id is not None)
+
+    def _query_idf(self, query, counts, idf=None):
+        # 查询词 id -> idf; 传入 idf(词 -> 全局 idf)时使用外部统计, 如分片检索时由协调者统一计算
+        if idf is None:
+            local_idf = self._idf_array()
+            return {term_id: local_idf[term_id] for term_id in counts}
+        return {self.vocab.get(token): idf.get(token, 0.0) for token in set(query) if self.vocab.get(token) in counts}
+
+    def _postings(self, term_id, idf, avgdl):
+        # 读取一个词的倒排列表: (有序文档位置, BM25 权重), 合并基础段与增量段并跳过墓碑
+        doc_ids = np.zeros(0, dtype=np.int32)
+        tf = np.zeros(0, dtype=np.int32)
+        if term_id < self.tf.shape[0]:
+            start, end = self.tf.indptr[term_id], self.tf.indptr[term_id + 1]
+            doc_ids, tf = self.tf.indices[start:end], self.tf.data[start:end]
+            if self.deleted:
+                keep = self.alive[doc_ids]
+                doc_ids, tf = doc_ids[keep], tf[keep]
+        delta = self.delta.get(term_id)
+        if delta:
+            # 增量段的位置都在基础段之后, 拼接后仍然有序
+            delta_ids = np.fromiter(sorted(delta), dtype=np.int32, count=len(delta))
+            delta_tf = np.fromiter((delta[pos] for pos in delta_ids), dtype=np.int32, count=len(delta))
+            doc_ids, tf = np.concatenate([doc_ids, delta_ids]), np.concatenate([tf, delta_tf])
+        return doc_ids, self._bm25_weights(idf, tf, self.doc_len[doc_ids], avgdl)
+
+    def get_scores(self, query):
+        """计算查询与所有文档的 BM25 分数, 返回按文档位置排列的数组(已删除的位置为 0)"""
+        scores = np.zeros(len(self.doc_keys))
+        counts = self._query_terms(query)
+        idf = self._query_idf(query, counts)
+        # 只触及查询词对应的倒排行
+        for term_id, count in counts.items():
+            doc_ids, weights = self._postings(term_id, idf[term_id], self.avgdl)
+            scores[doc_ids] += count * weights
+        return scores
+
+    def top_k(self, query, k=5):
+        """倒排 + MaxScore 提前终止, 只读取查询词的倒排列表, 返回 (top-k 文档位置, 分数, softmax 置信度)"""
+        positions, scores, _, denominator = self.top_k_stats(query, k=k)
+        if not len(positions):
+            return positions, scores, 0.0
+        return positions, scores, float(1.0 / denominator)
+
+    def top_k_stats(self, query, k=5, idf=None, avgdl=None):
+        """top-k 检索, 返回 (文档位置, 分数, 最高分, softmax 分母)
+
+        softmax 分母以最高分为基准(sum(exp(s - 最高分))), 多个分片的结果可以据此合并出全局置信度;
+        idf(词 -> idf)和 avgdl 为 None 时使用本索引自己的统计
+        """
+        counts = self._query_terms(query)
+        if not counts or k <= 0 or not self.corpus_size:
+            # 没有命中文档时所有存活文档分数都为 0
+            return np.zeros(0, dtype=np.int32), np.zeros(0), 0.0, float(self.corpus_size)
+        idf = self._query_idf(query, counts, idf)
+        avgdl = self.avgdl if avgdl is None else avgdl
+        if min(idf.values()) < 0:
+            # 平均 idf 为负(极小语料)时权重可能为负, 部分分数不再是下界, 退回全量打分
+            return self._exact_top_k(counts, k, idf, avgdl)
+        # 按分数上界从大到小处理查询词, 上界大的词最能决定 top-k
+        terms = [(term_id, count, count * self._upper_bound(term_id, idf[term_id], avgdl))
+                 for term_id, count in counts.items()]
+        terms.sort(key=lambda item: item[2], reverse=True)
+        upper_bounds = np.array([bound for _, _, bound in terms])
+        # rest_bounds[i]: 第 i 个词及其之后所有词的上界之和
+        rest_bounds = np.append(np.cumsum(upper_bounds[::-1])[::-1], 0.0)
+
+        cand_ids = np.zeros(0, dtype=np.int32)
+        cand_scores = np.zeros(0)
+        # 尾部估计用到的统计: 必要词阶段见过的文档数、被剪枝候选的分数上界、
+        # 非必要词(只补分不引入新文档)里可能命中但未统计的文档数及其分数上界
+        seen = 0
+        pruned_bounds = []
+        unseen_matched, unseen_bound = 0, 0.0
+        threshold = -np.inf
+        for i, (term_id, count, _) in enumerate(terms):
+            doc_ids, weights = self._postings(term_id, idf[term_id], avgdl)
+            if not len(doc_ids):
+                continue
+            if threshold > rest_bounds[i]:
+                # 剩余词的上界之和已低于第 k 名, 新文档不可能进入 top-k:
+                # 只在倒排列表里二分查找现有候选补分, 跳过其余文档
+                if not unseen_matched:
+                    unseen_bound = rest_bounds[i]
+                unseen_matched += len(doc_ids)
+                pos = np.searchsorted(doc_ids, cand_ids)
+                pos[pos == len(doc_ids)] = 0
+                hit = doc_ids[pos] == cand_ids
+                cand_scores[hit] += count * weights[pos[hit]]
+                # 剪掉补满剩余上界也追不上第 k 名的候选
+                bounds = cand_scores + rest_bounds[i + 1]
+                keep = bounds >= threshold
+                pruned_bounds.append(bounds[~keep])
+                cand_ids, cand_scores = cand_ids[keep], cand_scores[keep]
+            else:
+                # 必要词: 合并倒排列表到候选集
+                merged_ids, inverse = np.unique(np.concatenate([cand_ids, doc_ids]), return_inverse=True)
+                cand_scores = np.bincount(inverse, weights=np.concatenate([cand_scores, count * weights]),
+                                          minlength=len(merged_ids))
+                cand_ids = merged_ids.astype(np.int32)
+                seen = len(cand_ids)
+            if len(cand_scores) >= k:
+                # 候选的部分分数是最终分数的下界, 第 k 大即为当前门槛
+                threshold = np.partition(cand_scores, len(cand_scores) - k)[len(cand_scores) - k]
+
+        if not len(cand_ids):
+            return cand_ids, cand_scores, 0.0, float(self.corpus_size)
+        # 分数降序, 同分按文档位置升序(与 argmax 取第一个最大值一致)
+        order = np.lexsort((cand_ids, -cand_scores))[:k]
+        max_score, denominator = self._softmax_stats(cand_scores, pruned_bounds, seen, unseen_matched, unseen_bound)
+        return cand_ids[order], cand_scores[order], max_score, denominator
+
+    def _exact_top_k(self, counts, k, idf, avgdl):
+        # 全量打分的 top-k 和精确 softmax 分母, 已删除的位置不参与
+        scores = np.zeros(len(self.doc_keys))
+        for term_id, count in counts.items():
+            doc_ids, weights = self._postings(term_id, idf[term_id], avgdl)
+            scores[doc_ids] += count * weights
+        positions = np.flatnonzero(self.alive[:len(self.doc_keys)]).astype(np.int32)
+        scores = scores[positions]
+        order = np.lexsort((positions, -scores))[:k]
+        max_score = scores[order[0]]
+        return positions[order], scores[order], float(max_score), float(np.exp(scores - max_score).sum())
+
+    def _softmax_stats(self, cand_scores, pruned_bounds, seen, unseen_matched, unseen_bound):
+        # 估计全库 softmax 的分母(以最高分为基准), 不需要对全库打分:
+        # 存活候选的分数是精确值, 被剪枝和未统计的命中文档用分数上界, 未命中文档分数为 0.
+        # 分母只会被放大, 由它得到的置信度是全库 softmax 最大值的保守下界, 没有发生剪枝时即为精确值
+        max_score = cand_scores.max()
+        denominator = np.exp(cand_scores - max_score).sum()
+        if pruned_bounds:
+            denominator += np.exp(np.concatenate(pruned_bounds) - max_score).sum()
+        denominator += unseen_matched * np.exp(unseen_bound - max_score)
+        matched = min(self.corpus_size, seen + unseen_matched)
+        denominator += (self.corpus_size - matched) * np.exp(-max_score)
+        return float(max_score), float(denominator)
+
+    def add(self, key, tokens):
+        """增量添加一个文档, 返回它的位置; key 已存在时按更新处理"""
+        if key in self.key_to_pos:
+            self.delete(key)
+        pos = len(self.doc_keys)
+        self.doc_keys.append(key)
+        self.key_to_pos[key] = pos
+        self.doc_len = _grow(self.doc_len, pos + 1)
+        self.alive = _grow(self.alive, pos + 1, fill=False)
+        self.doc_len[pos] = len(tokens)
+        self.alive[pos] = True
+        self.corpus_size += 1
+        self.total_len += len(tokens)
+
+        # 新词追加到词表末尾, 只存在于增量段
+        counts = Counter(self.vocab.setdefault(token, len(self.vocab)) for token in tokens)
+        vocab_size = len(self.vocab)
+        self.df = _grow(self.df, vocab_size)
+        self.max_tf = _grow(self.max_tf, vocab_size)
+        self.min_dl = _grow(self.min_dl, vocab_size, fill=np.inf)
+        for term_id, freq in counts.items():
+            self.delta.setdefault(term_id, {})[pos] = freq
+            self.df[term_id] += 1
+            self.max_tf[term_id] = max(self.max_tf[term_id], freq)
+            self.min_dl[term_id] = min(self.min_dl[term_id], len(tokens))
+        self.delta_docs[pos] = counts
+        self.delta_size += len(counts)
+        self._idf = None
+        self._maybe_compact()
+        return pos
+
+    def update(self, key, tokens):
+        """更新文档内容: 旧位置打墓碑, 新内容追加到增量段, 返回新位置"""
+        if key not in self.key_to_pos:
+            raise KeyError(key)
+        return self.add(key, tokens)
+
+    def delete(self, key):
+        """删除文档, 返回是否删除成功; 维护文档频率和 avgdl, 倒排中的旧记录在合并时清理"""
+        pos = self.key_to_pos.pop(key, None)
+        if pos is None:
+            return False
+        self.alive[pos] = False
+        self.corpus_size -= 1
+        self.total_len -= self.doc_len[pos]
+        counts = self.delta_docs.pop(pos, None)
+        if counts is not None:
+            # 增量段文档: 直接从 delta 倒排中移除
+            for term_id in counts:
+                del self.delta[term_id][pos]
+            self.delta_size -= len(counts)
+            term_ids = np.fromiter(counts, dtype=np.int64, count=len(counts))
+        else:
+            # 基础段文档: 通过列视图找到它包含的词, 倒排中的记录由墓碑过滤
+            if self._tf_csc is None:
+                self._tf_csc = self.tf.tocsc()
+            start, end = self._tf_csc.indptr[pos], self._tf_csc.indptr[pos + 1]
+            term_ids = self._tf_csc.indices[start:end]
+            self.deleted += 1
+        # max_tf / min_dl 保持不变, 作为上界依然成立, 合并时再收紧
+        self.df[term_ids] -= 1
+        self._idf = None
+        self._maybe_compact()
+        return True
+
+    def _maybe_compact(self):
+        # 增量段或墓碑积累过多时合并回基础段
+        base_size = max(self.tf.nnz, 1024)
+        if self.delta_size > self.compact_ratio * base_size or self.deleted > self.compact_ratio * len(self.doc_keys):
+            self.compact()
+
+    def compacted_tf(self):
+        """增量段合并进基础段、清理已删除文档后的 CSR 词频矩阵; 只读取索引, 不修改索引本身"""
+        coo = self.tf.tocoo()
+        keep = self.alive[coo.col]
+        rows, cols, data = [coo.row[keep]], [coo.col[keep]], [coo.data[keep]]
+        for term_id, postings in self.delta.items():
+            if postings:
+                rows.append(np.full(len(postings), term_id, dtype=np.int32))
+                cols.append(np.fromiter(postings.keys(), dtype=np.int32, count=len(postings)))
+                data.append(np.fromiter(postings.values(), dtype=np.int32, count=len(postings)))
+        tf = sparse.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                               shape=(len(self.vocab), len(self.doc_keys)))
+        tf.sort_indices()
+        return tf
+
+    def compact(self, tf=None):
+        """把增量段合并进 CSR 基础段, 并清理已删除文档的倒排记录
+
+        tf 为事先(如在检索锁外)算好的 compacted_tf(), 从算好到替换期间索引不能被修改
+        """
+        self.tf = self.compacted_tf() if tf is None else tf
+        self._tf_csc = None
+        self.delta, self.delta_docs, self.delta_size = {}, {}, 0
+        self.deleted = 0
+        self.doc_len = self.doc_len[:len(self.doc_keys)]
+        self.alive = self.alive[:len(self.doc_keys)]
+        self._refresh_term_stats()
+
+
+if __name__ == '__main__':
+    from rank_bm25 import BM25Okapi
+
+    corpus = [['什么', '是', 'python'], ['python', '列表', '推导式'], ['java', '是', '什么']]
+    index = BM25Index(corpus)
+    print(index.get_scores(['python', '是']))
+    print(BM25Okapi(corpus).get_scores(['python', '是']))
+    print(index.top_k(['python', '是'], k=2))
+    index.add(3, ['python', '装饰器'])
+    index.delete(1)
+    print(index.get_scores(['python', '是']))
+    print(BM25Okapi([corpus[0], corpus[2], ['python', '装饰器']]).get_scores(['python', '是']))
@@ -0,0 +1,128 @@
+# retrieval/bm25_partition.py
+# BM25 分区: 全库一个分区, 每个学科一个分区, 按 source_filter 只检索对应分区
+import hashlib
+from contextlib import nullcontext
+
+# 导入数值计算库
+import numpy as np
+
+from retrieval.bm25_index import BM25Index
+from retrieval.bm25_snapshot import BM25Snapshot, snapshot_path, write_snapshot
+from utils.preprocess import normalize_text
+
+# 全库分区的名字
+GLOBAL_PARTITION = 'all'
+
+
+def exact_hash(normalized):
+    """归一化问题 -> 64 位哈希, 跨进程稳定, 可以写进快照"""
+    return int.from_bytes(hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _exact_table(questions):
+    # 按位置排列的问题 -> (有序哈希数组, 对应的文档位置)
+    hashes = np.fromiter((exact_hash(normalize_text(question)) for question in questions),
+                         dtype=np.uint64, count=len(questions))
+    order = np.argsort(hashes, kind='stable')
+    return hashes[order], order.astype(np.int64)
+
+
+class BM25Partition:
+    """一个可独立检索的 BM25 分区: 索引 + 与文档位置对齐的原始问题和答案"""
+
+    def __init__(self, index, questions, answers, snapshot=None, exact=None):
+        # BM25 索引, 文档以问题 id 为键
+        self.index = index
+        # 原始问题和答案, 按索引中的文档位置排列
+        self.questions = questions
+        self.answers = answers
+        # 从快照打开时持有快照对象, 保证 mmap 在分区存活期间有效
+        self.snapshot = snapshot
+        # 精确匹配表: 归一化问题的有序哈希 + 文档位置(可直接来自快照), 增量添加的问题放在内存字典里
+        self.exact_hashes, self.exact_positions = exact if exact is not None else _exact_table(questions)
+        self.exact_extra = {}
+
+    @classmethod
+    def build(cls, rows):
+        """用 (id, question, answer, tokens) 行构建分区"""
+        index = BM25Index([row[3] for row in rows], doc_keys=[row[0] for row in rows])
+        return cls(index, [row[1] for row in rows], [row[2] for row in rows])
+
+    @classmethod
+    def open(cls, path):
+        """以 mmap 方式打开分区快照"""
+        snapshot = BM25Snapshot(path)
+        answers = snapshot.strings('answer')
+        if answers is None:
+            raise ValueError(f'快照中没有答案段: {path}')
+        exact = None
+        if 'exact_hash' in snapshot:
+            exact = snapshot.array('exact_hash', np.uint64), snapshot.array('exact_pos', np.int64)
+        return cls(snapshot.index(), snapshot.strings('question'), answers, snapshot, exact)
+
+    def write(self, snapshot_dir, version, name, lock=None):
+        """把分区写成 (版本号, 分区名) 对应的快照文件
+
+        合并增量段和写文件只读取分区, 不需要持有检索锁; 写完后在 lock 内把合并好的词频矩阵换进索引.
+        调用方保证写快照期间分区不被修改
+        """
+        positions = np.flatnonzero(self.index.alive[:len(self.index.doc_keys)])
+        # 精确匹配表按快照中重新编号后的位置生成
+        hashes, order = _exact_table([self.questions[pos] for pos in positions])
+        tf = self.index.compacted_tf()
+        write_snapshot(snapshot_path(snapshot_dir, version, name), self.index, self.questions, self.answers,
+                       extra_sections=[('exact_hash', hashes), ('exact_pos', order)], tf=tf)
+        with lock or nullcontext():
+            self.index.compact(tf)
+
+    def __contains__(self, question_id):
+        return question_id in self.index.key_to_pos
+
+    def __len__(self):
+        return self.index.corpus_size
+
+    def add(self, question_id, tokens, question, answer):
+        # 索引按位置追加, 原始问题和答案列表与之对齐
+        pos = self.index.add(question_id, tokens)
+        self.questions.append(question)
+        self.answers.append(answer)
+        self.exact_extra.setdefault(exact_hash(normalize_text(question)), []).append(pos)
+
+    def delete(self, question_id):
+        # 删除问题, 返回是否删除成功
+        return self.index.delete(question_id)
+
+    def find_exact(self, normalized):
+        """按归一化问题精确匹配, 返回 (问题 id, 问题, 答案), 没有时返回 None"""
+        if not normalized:
+            return None
+        key = exact_hash(normalized)
+        lo = np.searchsorted(self.exact_hashes, np.uint64(key), side='left')
+        hi = np.searchsorted(self.exact_hashes, np.uint64(key), side='right')
+        candidates = self.exact_positions[lo:hi].tolist() + self.exact_extra.get(key, [])
+        # 同一归一化问题有多条时取位置最小的存活文档; 逐条核对原文, 排除哈希碰撞和已删除的文档
+        for pos in sorted(candidates):
+            if self.index.alive[pos] and normalize_text(self.questions[pos]) == normalized:
+                return self.index.doc_keys[pos], self.questions[pos], self.answers[pos]
+        return None
+
+    def _hits(self, positions, scores):
+        # 文档位置 -> (问题 id, 问题, 答案, 分数)
+        return [(self.index.doc_keys[pos], self.questions[pos], self.answers[pos], float(score))
+                for pos, score in zip(positions, scores)]
+
+    def top_k(self, tokens, k):
+        # 倒排检索 top-k, 返回 ([(问题 id, 问题, 答案, 分数), ...], softmax 置信度)
+        positions, scores, confidence = self.index.top_k(tokens, k=k)
+        return self._hits(positions, scores), confidence
+
+    def top_k_stats(self, tokens, k, idf=None, avgdl=None):
+        # 用外部给定的 idf / avgdl 检索 top-k, 返回 (命中列表, 最高分, softmax 分母), 供分片合并
+        positions, scores, max_score, denominator = self.index.top_k_stats(tokens, k=k, idf=idf, avgdl=avgdl)
+        return self._hits(positions, scores), max_score, denominator
+
+    def term_stats(self):
+        # 计算全局 idf / avgdl 所需的统计: (文档数, 总长度, {词: 文档频率})
+        df = self.index.df
+        return (self.index.corpus_size, self.index.total_len,
+                {token: int(df[term_id]) for token, term_id in self.index.vocab.items() if df[term_id]})
@@ -1,12 +1,14 @@
 # retrieval/bm25_search.py
 # 导入 BM25 算法
+import asyncio
+import atexit
 import os.path
 import sys
+import threading
+import time
+from itertools import islice
 
-from rank_bm25 import BM25Okapi
-
-# 导入数值计算库
-import numpy as np
+import pymysql
 
 # 将路径添加到环境变量里面
 dir_cache = os.path.dirname(__file__)  # 当前文件所在的文件夹
@@ -15,101 +17,420 @@ sys_dir = os.path.dirname(qa_dir)
 # 路径添加到系统环境里面
 sys.path.insert(0, qa_dir)
 sys.path.insert(0, sys_dir)
-# 导入日志
-from base import logger
+# 导入配置和日志
+from base import Config, logger
 # 导入文本预处理
-from utils.preprocess import preprocess_text
+from utils.preprocess import get_tokenizer, normalize_text, preprocess_pool, preprocess_text
+# 导入稀疏矩阵 BM25 引擎
+from retrieval.bm25_index import BM25Index
+# 导入 BM25 磁盘快照
+from retrieval.bm25_snapshot import list_partitions, new_version, remove_old_snapshots, snapshot_path
+# 导入 BM25 分区
+from retrieval.bm25_partition import GLOBAL_PARTITION, BM25Partition
+# 导入 BM25 水平分片
+from retrieval.bm25_shards import BM25ShardPool, ShardedBM25Partition, shard_paths, write_shards
+# 导入答案缓存
+from cache.AnswerCache import AnswerCache
+
+# 从 MySQL 重建索引时每批读取和分词的行数
+LOAD_BATCH = 5000
+
 
 class BM25Search:
-    def __init__(self, redis_client, mysql_client):
+    def __init__(self, redis_client, mysql_client, top_k=5, answer_cache=None):
         # 初始化日志
 
         # 初始化 Redis 客户端
         self.redis_client = redis_client
         # 初始化 MySQL 客户端
         self.mysql_client = mysql_client
-        # 初始化 BM25 模型
-        self.bm25 = None
+        # 初始化 BM25 分区: 全库分区 + 每个学科一个分区, 分区内问题、答案与索引位置对齐
+        self.partitions = {GLOBAL_PARTITION: BM25Partition(BM25Index(), [], [])}
         # 初始化问题列表
         self.questions = None
-        # 初始化原始问题
-        self.original_questions = None
+        # 增量更新与检索互斥, 避免检索读到写了一半的索引
+        self._lock = threading.Lock()
+        # 学科配置: 合法的学科类别, 以及 jpkb.subject_name 到学科类别的映射
+        config = Config()
+        # 答案缓存: 带过期时间, 键按知识库版本号隔离
+        self.answer_cache = answer_cache or AnswerCache(redis_client, config)
+        self.valid_sources = config.VALID_SOURCES
+        self.subject_sources = config.SUBJECT_SOURCES
+        # 磁盘快照目录, 以及 Redis 中保存快照版本号的键
+        self.snapshot_dir = config.BM25_SNAPSHOT_DIR
+        self.snapshot_key = "qa_bm25_snapshot_version"
+        # 版本发布频道, 以及保证同一时间只有一个 worker 重建/发布快照的 Redis 锁
+        self.snapshot_channel = "qa_bm25_snapshot_channel"
+        self.rebuild_lock_key = "qa_bm25_rebuild_lock"
+        self.rebuild_lock_timeout = config.BM25_REBUILD_LOCK_TIMEOUT
+        self.reload_interval = config.BM25_RELOAD_INTERVAL
+        # 增量修改立即对本进程的检索生效, 延迟 publish_delay 秒后合并成一次快照发布;
+        # 尚未发布的修改 [(操作, 参数), ...], 在切换到其他 worker 发布的版本时重放
+        self.publish_delay = config.BM25_PUBLISH_DELAY
+        self._pending_edits = []
+        self._publish_timer = None
+        # 增量修改、版本切换和发布快照互斥(可重入: 发布时追版本会切换索引)
+        self._edit_lock = threading.RLock()
+        # 当前加载的快照版本
+        self.version = None
+        # 分片数大于 1 时, 索引放在分片 worker 进程里, 本进程只做协调
+        self.num_shards = config.BM25_NUM_SHARDS
+        self.shard_pool = None
+        # 倒排检索时保留的候选数量
+        self.top_k = top_k
+        # 启动时加载分词词典, 第一次查询不再等待 jieba 初始化
+        get_tokenizer()
         # 加载数据
         self._load_data() # 并不是私有方法,只是为了让其他开发者,后续不要对此方法做修改
+        # 后台监听版本通知, 其他 worker 发布新快照后热切换
+        threading.Thread(target=self._watch_versions, daemon=True).start()
+        # 进程退出前发布尚未发布的修改
+        atexit.register(self._publish_edits)
+
+    def _subject_source(self, subject_name):
+        # jpkb.subject_name -> 学科类别, 先查配置映射, 再看名字里是否包含类别名(如 "JAVA学科" -> java)
+        if not subject_name:
+            return None
+        source = self.subject_sources.get(subject_name)
+        if source is None:
+            lowered = subject_name.lower()
+            source = next((item for item in self.valid_sources if item in lowered), None)
+        return source
 
     def _load_data(self):
         logger.info('BM25检索开始.....')
-        # 加载数据
-        original_key = "qa_original_questions"
-        tokenized_key = "qa_tokenized_questions"
-        # 从 Redis 获取原始问题
-        self.original_questions = self.redis_client.get_data(original_key)
-        # 从 Redis 获取分词问题
-        self.tokenized_questions = self.redis_client.get_data(tokenized_key)
-
-        # 如果 Redis 中没有数据，从 MySQL 加载
-        if not self.original_questions or not self.tokenized_questions: #表示查询为None
-            logger.info('redis查询,无结果')
-            # Reids没有查询到数据,所以需要从 MySQL 获取问题
-            self.original_questions = self.mysql_client.fetch_questions() # 原始问题存到self.original_questions
-            # 记录无问题 -> 警告
-            if not self.original_questions:
-                logger.info('MySQL查询无数据')
+        # Redis 中只保存当前快照的版本号, 索引本体在磁盘快照里
+        if self._load_published():
+            return
+        # 没有可用快照: 只有拿到重建锁的 worker 从 MySQL 重建并发布, 其他 worker 等锁释放后直接加载发布的版本
+        with self.redis_client.lock(self.rebuild_lock_key, timeout=self.rebuild_lock_timeout,
+                                    blocking_timeout=self.rebuild_lock_timeout) as acquired:
+            if acquired and self._load_published():
                 return
-            # 对每一行问题分词,# 对原始问题分词存到self.tokenized_questions
-            self.tokenized_questions = [preprocess_text(doc[0]) for doc in self.original_questions]
-            # 存储原始问题到 Redis
-            self.redis_client.set_data(original_key,[doc[0] for doc in self.original_questions])
-            # 存储分词问题到 Redis
-            self.redis_client.set_data(tokenized_key,self.tokenized_questions)
-
-        # 初始化 BM25 模型:BM25Okapi
-        self.bm25 = BM25Okapi(self.tokenized_questions)
+            if not acquired:
+                logger.warning('未拿到bm25重建锁, 本进程自行重建')
+            self._rebuild()
+
+    def _load_published(self):
+        # 加载 Redis 中发布的快照版本, 成功返回 True
+        version = self.redis_client.get_data(self.snapshot_key)
+        return bool(version) and self._swap(version)
+
+    def rebuild(self):
+        """从 MySQL 全量重建索引并发布快照, 返回是否重建成功; 批量导入或修改知识库之后调用,
+        其他 worker 随后切换到新快照, 答案缓存随版本号递增整体失效"""
+        with self.redis_client.lock(self.rebuild_lock_key, timeout=self.rebuild_lock_timeout,
+                                    blocking_timeout=self.rebuild_lock_timeout) as acquired:
+            if not acquired:
+                logger.warning('未拿到bm25重建锁, 本进程自行重建')
+            # 持有修改锁: 重建期间的增量修改等重建完成后再执行
+            with self._edit_lock:
+                if not self._rebuild():
+                    return False
+                # 新索引直接从 MySQL 读取, 已包含本进程尚未发布的修改
+                self._pending_edits = []
+        return True
+
+    def _rebuild(self):
+        # 没有可用快照或知识库批量变化时，从 MySQL 加载并重建; 重建成功返回 True
+        logger.info('从MySQL重建bm25索引')
+        # 从 MySQL 流式读取问答对, 每批 LOAD_BATCH 行: 导入时已分词的问题直接使用, 其余问题按批分词
+        # (各批共用一组分词 worker 进程, worker 独立启动而不是 fork, 在版本监听线程中重建也安全);
+        # 行直接进入分区列表, 全库分区和学科分区共用同一行, 内存中只保留一份数据
+        grouped = {GLOBAL_PARTITION: []}
+        rows = self.mysql_client.iter_qa_pairs(LOAD_BATCH)
+        total = retokenized = 0
+        try:
+            with preprocess_pool() as preprocess_batch:
+                while batch := list(islice(rows, LOAD_BATCH)):
+                    tokenized = iter(preprocess_batch([row[1] for row in batch if row[4] is None]))
+                    for question_id, question, answer, subject_name, tokens in batch:
+                        if tokens is None:
+                            tokens = next(tokenized)
+                            retokenized += 1
+                        row = (question_id, question, answer, tokens)
+                        grouped[GLOBAL_PARTITION].append(row)
+                        source = self._subject_source(subject_name)
+                        if source:
+                            grouped.setdefault(source, []).append(row)
+                    total += len(batch)
+        except pymysql.MySQLError:
+            # iter_qa_pairs 已记录错误日志; 数据不完整, 不建索引
+            return
+        # 记录无问题 -> 警告
+        if not total:
+            logger.info('MySQL查询无数据')
+            return
+        logger.info(f'bm25建库: {total - retokenized} 条问题使用导入时的分词结果, {retokenized} 条重新分词')
+        if self.num_shards > 1:
+            # 分片模式: 按问题 id 切分写出分片快照, 再由分片 worker 打开
+            version = new_version()
+            try:
+                self._install(version, *self._start_shards(
+                    write_shards(grouped, self.snapshot_dir, version, self.num_shards)))
+                self._publish_version(version)
+                logger.info(f'bm25分片初始化成功! 分片数: {self.num_shards}, 分区: {list(self.partitions)}')
+                return True
+            except (OSError, RuntimeError) as e:
+                logger.error(f'bm25分片初始化失败, 退回单进程索引: {e}')
+        # 初始化 BM25 模型:基于 CSR 词频矩阵的 BM25Index, 分数与 BM25Okapi 一致, 文档以问题 id 为键
+        self._install(None, {name: BM25Partition.build(items) for name, items in grouped.items()}, None)
+        # 写出快照并发布版本号, 其他 worker 启动时直接 mmap
+        self._publish_snapshot()
         # 记录 BM25 初始化成功
-        logger.info('bm25初始化成功!')
+        logger.info(f'bm25初始化成功! 分区: {list(self.partitions)}')
+        return True
 
-    def _softmax(self, scores):
-        # 计算 Softmax 分数
-        exp_scores = np.exp(scores - np.max(scores))
-        # 返回归一化分数,把数值映射到0-1之间,然后判断是否大于0.85
-        return exp_scores / exp_scores.sum()
+    def _open_version(self, version):
+        # 按快照版本打开各分区, 返回 (分区, 分片进程池); 快照与当前分片配置不一致时返回 None
+        names = list_partitions(self.snapshot_dir, version)
+        if self.num_shards > 1:
+            paths = shard_paths(self.snapshot_dir, version, names, self.num_shards)
+            if paths is None or any(GLOBAL_PARTITION not in item for item in paths):
+                return None
+            return self._start_shards(paths)
+        if GLOBAL_PARTITION not in names or any('@' in name for name in names):
+            return None
+        # mmap 打开各分区快照: 启动只是缺页换入, 各 worker 共享同一份物理内存
+        return {name: BM25Partition.open(snapshot_path(self.snapshot_dir, version, name)) for name in names}, None
 
-    def search(self, query, threshold=0.85):
-        logger.info('BM25检索开始....')
-        # 搜索查询 ->判断 ,需要做非空判断
-        if not query or not isinstance(query,str): # 字符类型判断
-            # 记录无效查询
-            logger.info('无效查询....')
-            # 返回 None
-            return None, False
+    def _start_shards(self, paths):
+        # 启动分片 worker, 每个分区对应一个分发查询的协调者分区
+        pool = BM25ShardPool(paths)
+        return {name: ShardedBM25Partition(pool, name) for name in paths[0]}, pool
 
-        # 检查 Redis 缓存:
-        cache_answer = self.redis_client.get_data(f'answer:{query}')
-        # 返回缓存答案
-        if cache_answer:
-            logger.info('答案已查询,并返回...')
-            return cache_answer, False
+    def _install(self, version, partitions, shard_pool):
+        # 原子切换到新索引: 持锁替换, 正在进行的检索在旧索引上完成后才会切换
+        with self._lock:
+            old_pool = self.shard_pool
+            self.partitions, self.shard_pool, self.version = partitions, shard_pool, version
+        # 旧分片进程在切换后才退出, 此时已没有检索在使用它们
+        if old_pool is not None and old_pool is not shard_pool:
+            old_pool.close()
+
+    def _swap(self, version):
+        # 打开指定版本的快照并切换过去; 打开快照在锁外进行, 不阻塞检索
+        current = self.version
+        try:
+            opened = self._open_version(version)
+        except (OSError, ValueError, RuntimeError) as e:
+            logger.error(f'bm25快照加载失败: {e}')
+            return False
+        if opened is None:
+            logger.info(f'bm25快照 {version} 与当前分片配置不一致, 跳过')
+            return False
+        partitions, shard_pool = opened
+        with self._edit_lock:
+            if self.version != current:
+                # 打开期间本进程已切换或发布了其他版本, 放弃这次切换, 避免退回旧版本
+                if shard_pool is not None:
+                    shard_pool.close()
+                return False
+            # 本进程尚未发布的修改在新版本上重放, 不因切换而丢失
+            for edit in self._pending_edits:
+                self._apply(partitions, shard_pool, edit)
+            self._install(version, partitions, shard_pool)
+        logger.info(f'bm25已切换到快照: {version}, 分区: {list(self.partitions)}')
+        return True
+
+    def _watch_versions(self):
+        # 后台线程: 订阅版本频道, 收到新版本时切换索引; 每隔 reload_interval 秒再核对一次版本号, 兜底错过的通知
+        pubsub = None
+        while True:
+            try:
+                if pubsub is None:
+                    pubsub = self.redis_client.subscribe(self.snapshot_channel)
+                if pubsub is not None:
+                    pubsub.get_message(timeout=self.reload_interval)
+                else:
+                    time.sleep(self.reload_interval)
+                # 通知只用来唤醒, 版本号以 Redis 中的为准: 积压的旧通知不会让索引退回旧版本
+                version = self.redis_client.get_data(self.snapshot_key)
+                if version and version != self.version:
+                    self._swap(version)
+            except Exception as e:
+                # 连接断开等异常: 记录后重新订阅, 后台线程不能退出
+                logger.error(f'bm25版本监听异常: {e}')
+                pubsub = None
+                time.sleep(self.reload_interval)
+
+    def _sync_version(self):
+        # 发布前先追上最新发布的版本(并重放本进程的修改), 避免覆盖其他 worker 发布的修改
+        version = self.redis_client.get_data(self.snapshot_key)
+        if version and version != self.version:
+            self._swap(version)
+
+    def _publish_snapshot(self):
+        # 写出所有分区的快照, 再把 Redis 中的版本号指向它, 成功返回 True; 调用方保证期间没有增量修改
+        version = new_version()
+        try:
+            # 合并增量段和写文件在检索锁外进行, 只有把合并结果换进索引时短暂持有检索锁
+            for name, partition in list(self.partitions.items()):
+                partition.write(self.snapshot_dir, version, name, lock=self._lock)
+        except (OSError, RuntimeError) as e:
+            logger.error(f'bm25快照写入失败: {e}')
+            return False
+        self.version = version
+        self._publish_version(version)
+        return True
+
+    def _publish_version(self, version):
+        # 把 Redis 中的版本号指向已写好的快照, 并通知其他 worker 切换
+        self.redis_client.set_data(self.snapshot_key, version)
+        self.redis_client.publish(self.snapshot_channel, version)
+        # 旧版本以 JSON 列表缓存在 Redis 中的问题不再使用
+        self.redis_client.delete_data("qa_original_questions", "qa_tokenized_questions", "qa_question_ids")
+        remove_old_snapshots(self.snapshot_dir)
+        # 知识库内容已变化, 递增版本号让旧答案缓存整体失效
+        self.answer_cache.bump_version()
+        logger.info(f'bm25快照已发布: {version}')
+
+    def _fetch_answer(self, question, subject_name=None):
+        # 增量更新未给出答案时, 从 MySQL 补查一次(不在检索热路径上); 给出学科时按唯一哈希查找
+        row = self.mysql_client.fetch_answer(question, subject_name)
+        return row[0] if row else ''
+
+    def _current_source(self, question_id):
+        # 问题当前所在的学科分区; 分片模式下会访问分片 worker, 与检索互斥
+        with self._lock:
+            return next((name for name, partition in self.partitions.items()
+                         if name != GLOBAL_PARTITION and question_id in partition), None)
+
+    def _edit(self, edit):
+        # 在当前索引上执行一次增量修改(与检索互斥), 并排队等待发布; 返回修改结果
+        with self._edit_lock:
+            with self._lock:
+                result = self._apply(self.partitions, self.shard_pool, edit)
+            if result:
+                self._pending_edits.append(edit)
+                self._schedule_publish()
+        return result
+
+    def _schedule_publish(self):
+        # publish_delay 秒后发布快照, 期间的修改合并成一次发布
+        with self._edit_lock:
+            if self._publish_timer is None:
+                self._publish_timer = threading.Timer(self.publish_delay, self._publish_edits)
+                self._publish_timer.daemon = True
+                self._publish_timer.start()
+
+    def _publish_edits(self):
+        # 发布积累的增量修改: 持有重建锁, 先追上其他 worker 发布的版本(切换时重放本进程的修改), 再写出快照
+        with self._edit_lock:
+            self._publish_timer = None
+            if not self._pending_edits:
+                return
+        # 先拿重建锁再拿修改锁, 等待重建锁时不阻塞本进程的增量修改
+        with self.redis_client.lock(self.rebuild_lock_key, timeout=self.rebuild_lock_timeout,
+                                    blocking_timeout=self.rebuild_lock_timeout) as acquired:
+            with self._edit_lock:
+                if not self._pending_edits:
+                    return
+                if acquired:
+                    self._sync_version()
+                    if self._publish_snapshot():
+                        self._pending_edits = []
+                        return
+                else:
+                    logger.warning('未拿到bm25重建锁, 稍后重试发布快照')
+                # 发布失败: 修改保留在本进程, 稍后重试
+                self._schedule_publish()
+
+    def add(self, question_id, text, answer=None, subject_name=None):
+        """把 MySQL 中新插入的问题加入全库分区和所属学科分区, 立即对检索可见, 无需重建; 快照稍后合并发布"""
+        tokens = preprocess_text(text)
+        if answer is None:
+            answer = self._fetch_answer(text, subject_name)
+        source = self._subject_source(subject_name)
+        self._edit(('add', (question_id, tokens, text, answer, source)))
+        logger.info(f'BM25索引新增问题: {question_id} (学科: {source})')
+
+    @staticmethod
+    def _new_partition(name, shard_pool):
+        # 增量添加时出现的新学科分区
+        if shard_pool is not None:
+            return ShardedBM25Partition(shard_pool, name)
+        return BM25Partition(BM25Index(), [], [])
+
+    @classmethod
+    def _apply(cls, partitions, shard_pool, edit):
+        # 在给定的分区上执行一次修改: ('add', (问题id, 分词, 问题, 答案, 学科)) 或 ('delete', (问题id,))
+        # 调用方持有检索锁或分区尚未安装
+        op, args = edit
+        if op == 'delete':
+            return any([partition.delete(args[0]) for partition in partitions.values()])
+        question_id, tokens, text, answer, source = args
+        targets = [name for name in (GLOBAL_PARTITION, source) if name is not None]
+        # 先准备好目标分区(新学科先建空分区), 再修改任何分区, 避免中途出错留下改了一半的索引
+        for name in targets:
+            if name not in partitions:
+                partitions[name] = cls._new_partition(name, shard_pool)
+        for name in list(partitions):
+            # 学科发生变化时, 从原学科分区中移除
+            if name not in targets:
+                partitions[name].delete(question_id)
+        for name in targets:
+            partitions[name].add(question_id, tokens, text, answer)
+        return True
+
+    def update(self, question_id, text, answer=None, subject_name=None):
+        """更新索引中已有问题的内容和答案, 未指定学科时保留原学科"""
+        with self._lock:
+            exists = question_id in self.partitions[GLOBAL_PARTITION]
+        if not exists:
+            raise KeyError(question_id)
+        if subject_name is None:
+            subject_name = self._current_source(question_id)
+        self.add(question_id, text, answer=answer, subject_name=subject_name)
+
+    def delete(self, question_id):
+        """从所有分区中删除问题, 返回是否删除成功"""
+        deleted = self._edit(('delete', (question_id,)))
+        if deleted:
+            logger.info(f'BM25索引删除问题: {question_id}')
+        return deleted
+
+    def _select_partition(self, source_filter):
+        # 合法的学科过滤只检索该学科分区(该学科无数据时返回 None), 否则检索全库分区
+        if source_filter and source_filter in self.valid_sources:
+            return self.partitions.get(source_filter)
+        return self.partitions[GLOBAL_PARTITION]
+
+    def _cache_key(self, query, source_filter):
+        # 归一化查询: 只差标点、全半角、空白或大小写的问题共用缓存和精确匹配
+        normalized = normalize_text(query) or query
+        # 缓存键区分学科过滤, 避免不同学科的答案互相串用
+        cache_key = f'{source_filter}:{normalized}' if source_filter and source_filter in self.valid_sources \
+            else normalized
+        return normalized, cache_key
+
+    def _lookup(self, query, normalized, threshold, source_filter):
+        # 索引检索(精确匹配层 + BM25), 只访问内存索引和分片 worker, 不访问 Redis
+        # 返回 (答案, 是否需要 RAG)
+        # 精确匹配层: 归一化后与知识库问题完全相同时直接返回答案, 不做分词和 BM25 打分
+        with self._lock:
+            partition = self._select_partition(source_filter)
+            exact = partition.find_exact(normalized) if partition is not None else None
+        if exact is not None and exact[2]:
+            logger.info(f'精确匹配命中问题: {exact[0]}')
+            return exact[2], False
         # 查询-> 分词
         tokenized_query_doc = preprocess_text(query)
-        # 计算 BM25 分数
-        scores = self.bm25.get_scores(tokenized_query_doc)
-        # 计算 Softmax 分数, 归一化
-        softmax_score = self._softmax(scores)
-        # 获取最高分索引,目的是获取最大概率
-        argmax_id = softmax_score.argmax()
-        # 获取最高分
-        max_score = softmax_score[argmax_id]
+        # 倒排检索 top-k: 只读取该分区查询词的倒排列表, 同时用 top-k + 尾部上界估计 softmax 置信度
+        # (分片模式下由协调者分发到各分片并合并); 选分区和检索在同一把锁内, 不会跨越索引切换
+        with self._lock:
+            partition = self._select_partition(source_filter)
+            if partition is None:
+                logger.info(f'学科 {source_filter} 暂无问答数据...')
+                return None, True
+            hits, max_score = partition.top_k(tokenized_query_doc, k=self.top_k)
         # 检查是否超过阈值
-        if max_score > threshold:
-            # 获取原始问题
-            original_question = self.original_questions[argmax_id]
-            # 获取答案:mysql
-            answer = self.mysql_client.fetch_answer(original_question)
+        if hits and max_score > threshold:
+            # 获取答案: 命中结果直接带出与索引位置对齐的答案, 不访问 MySQL
+            answer = hits[0][2]
             if answer: # 有值才能进入if语句
-                # 缓存答案 key: answer:{query}
-                self.redis_client.set_data(f'answer:{query}',answer)
                 # 记录搜索成功
-                logger.info('搜索成功,并缓存写入Redis...')
+                logger.info('搜索成功...')
                 # 返回答案
                 return answer, False
 
@@ -117,6 +438,53 @@ class BM25Search:
         logger.info('本次查询,无合适的答案...')
         # 返回 None
         return None, True
+
+    def cache_key(self, query, source_filter=None):
+        """查询在 answer 命名空间中的缓存键, 供调用方与其他缓存键一起批量探测"""
+        return self._cache_key(query, source_filter)[1]
+
+    def search(self, query, threshold=0.85, source_filter=None, use_cache=True):
+        # use_cache=False: 调用方已批量探测过 answer 缓存且未命中, 不再单独读取缓存(命中索引后仍写缓存)
+        logger.info('BM25检索开始....')
+        # 搜索查询 ->判断 ,需要做非空判断
+        if not query or not isinstance(query,str): # 字符类型判断
+            # 记录无效查询
+            logger.info('无效查询....')
+            # 返回 None
+            return None, False
+
+        normalized, cache_key = self._cache_key(query, source_filter)
+        # 检查 Redis 缓存: answer 命名空间, 键为 answer:v{知识库版本}:[学科:]{归一化查询}
+        cache_answer = self.answer_cache.get('answer', cache_key) if use_cache else None
+        # 返回缓存答案
+        if cache_answer:
+            logger.info('答案已查询,并返回...')
+            return cache_answer, False
+        answer, need_rag = self._lookup(query, normalized, threshold, source_filter)
+        if answer:
+            # 缓存答案 key: answer:v{知识库版本}:[学科:]{归一化查询}, 带过期时间
+            self.answer_cache.set('answer', cache_key, answer)
+        return answer, need_rag
+
+    async def asearch(self, query, threshold=0.85, source_filter=None, use_cache=True):
+        """search() 的异步版本, 供 FastAPI 等异步服务使用
+
+        缓存读写走异步 Redis 客户端, 不阻塞事件循环; 分词和 BM25 打分是 CPU 计算, 放到线程池中执行
+        """
+        logger.info('BM25检索开始....')
+        if not query or not isinstance(query,str):
+            logger.info('无效查询....')
+            return None, False
+
+        normalized, cache_key = self._cache_key(query, source_filter)
+        cache_answer = await self.answer_cache.aget('answer', cache_key) if use_cache else None
+        if cache_answer:
+            logger.info('答案已查询,并返回...')
+            return cache_answer, False
+        answer, need_rag = await asyncio.to_thread(self._lookup, query, normalized, threshold, source_filter)
+        if answer:
+            await self.answer_cache.aset('answer', cache_key, answer)
+        return answer, need_rag
 if __name__ == '__main__':
 
     search = BM25Search()
@@ -0,0 +1,269 @@
+# retrieval/bm25_shards.py
+# 水平分片的 BM25: 问题按 id 哈希切分到多个 worker 进程, 协调者分发查询、统一计算全局 idf 并合并 top-k
+import math
+import os
+import subprocess
+import sys
+import threading
+import zlib
+from collections import Counter
+from multiprocessing.connection import Client, Listener
+
+# 将路径添加到环境变量里面(worker 以独立脚本方式启动)
+dir_cache = os.path.dirname(os.path.abspath(__file__))  # 当前文件所在的文件夹
+qa_dir = os.path.dirname(dir_cache)  # 上一级路径
+sys.path.insert(0, qa_dir)
+
+# 导入数值计算库
+import numpy as np
+
+from retrieval.bm25_index import BM25Index
+from retrieval.bm25_partition import BM25Partition
+from retrieval.bm25_snapshot import snapshot_path
+
+# worker 连接协调者时使用的认证密钥, 通过环境变量传递, 不出现在命令行里
+AUTHKEY_ENV = 'BM25_SHARD_AUTHKEY'
+# 合并各分片 top-k 时比较分数的小数位数, 只差浮点舍入误差的分数视为同分
+SCORE_DIGITS = 9
+
+
+def shard_of(question_id, num_shards):
+    """问题 id -> 分片编号; 用 crc32 而不是 hash(), 保证不同进程、不同次启动结果一致"""
+    return zlib.crc32(str(question_id).encode('utf-8')) % num_shards
+
+
+def shard_name(partition, shard):
+    # 分片快照的分区名: 分区名@分片编号, 如 all@0
+    return f'{partition}@{shard}'
+
+
+def split_shard_name(name):
+    # 分片快照的分区名 -> (分区名, 分片编号), 不是分片快照时分片编号为 None
+    partition, _, shard = name.rpartition('@')
+    if partition and shard.isdigit():
+        return partition, int(shard)
+    return name, None
+
+
+def shard_paths(snapshot_dir, version, names, num_shards):
+    """某版本快照中各分片的 {分区名: 快照路径}; 快照的分片数与 num_shards 不一致时返回 None"""
+    paths = [{} for _ in range(num_shards)]
+    for name in names:
+        partition, shard = split_shard_name(name)
+        if shard is None or shard >= num_shards:
+            return None
+        paths[shard][partition] = snapshot_path(snapshot_dir, version, name)
+    if not all(paths):
+        return None
+    return paths
+
+
+def write_shards(grouped, snapshot_dir, version, num_shards):
+    """把 {分区名: [(id, question, answer, tokens), ...]} 按问题 id 切分并写成分片快照, 返回各分片的快照路径
+
+    每次只在内存中构建一个分片, 写出后即释放; 没有问题落入的分片也写出空快照, 保证分片齐全
+    """
+    paths = [{} for _ in range(num_shards)]
+    for shard in range(num_shards):
+        for name, rows in grouped.items():
+            partition = BM25Partition.build([row for row in rows if shard_of(row[0], num_shards) == shard])
+            partition.write(snapshot_dir, version, shard_name(name, shard))
+            paths[shard][name] = snapshot_path(snapshot_dir, version, shard_name(name, shard))
+    return paths
+
+
+def serve(address, authkey):
+    """worker 进程主循环: 连接协调者, 打开分配到的分片快照, 逐条处理请求, 连接断开或收到 None 时退出"""
+    conn = Client(address, authkey=authkey)
+    shard, paths = conn.recv()
+    partitions = {name: BM25Partition.open(path) for name, path in paths.items()}
+    conn.send(('ok', shard))
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        method, name, args = request
+        try:
+            if name not in partitions:
+                # 本分片中没有该分区的问题, 按空分区处理(add 之后即可检索)
+                partitions[name] = BM25Partition(BM25Index(), [], [])
+            partition = partitions[name]
+            if method == 'write':
+                snapshot_dir, version = args
+                result = partition.write(snapshot_dir, version, shard_name(name, shard))
+            elif method == 'contains':
+                result = args[0] in partition
+            elif method == 'len':
+                result = len(partition)
+            else:
+                result = getattr(partition, method)(*args)
+            conn.send(('ok', result))
+        except Exception as e:
+            conn.send(('error', f'{type(e).__name__}: {e}'))
+    conn.close()
+
+
+class BM25ShardPool:
+    """一组分片 worker 进程, 每个 worker 持有所有分区中落到本分片的问题
+
+    worker 是独立的 Python 进程(不经过 multiprocessing 的 spawn, 不会重新导入启动脚本),
+    启动后反向连接协调者监听的地址; 在其他节点上用同样的命令启动并指向该地址即可跨机器部署,
+    前提是快照目录在该节点上可以访问.
+    """
+
+    def __init__(self, shard_paths, host='127.0.0.1'):
+        authkey = os.urandom(16)
+        env = dict(os.environ, **{AUTHKEY_ENV: authkey.hex()})
+        self._conns = []
+        # 每个请求的发送和接收必须成对完成, 多个线程共用管道时不能交错, 否则会读到其他请求的结果
+        self._lock = threading.Lock()
+        with Listener((host, 0), authkey=authkey) as listener:
+            address = '%s:%d' % listener.address
+            self._processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__), address], env=env)
+                               for _ in shard_paths]
+            # 按连接到达的顺序分配分片, 各 worker 并行打开快照
+            for shard, paths in enumerate(shard_paths):
+                conn = listener.accept()
+                conn.send((shard, paths))
+                self._conns.append(conn)
+        for shard in range(len(self._conns)):
+            self._recv(shard)
+
+    @property
+    def num_shards(self):
+        return len(self._conns)
+
+    def _recv(self, shard):
+        status, result = self._conns[shard].recv()
+        if status != 'ok':
+            raise RuntimeError(f'BM25分片 {shard} 处理失败: {result}')
+        return result
+
+    def call(self, shard, method, name, *args):
+        """在单个分片上执行分区方法"""
+        with self._lock:
+            self._conns[shard].send((method, name, args))
+            return self._recv(shard)
+
+    def broadcast(self, method, name, *args):
+        """先把请求发给所有分片再统一收结果, 各分片并行执行"""
+        with self._lock:
+            for conn in self._conns:
+                conn.send((method, name, args))
+            results = []
+            for shard in range(len(self._conns)):
+                try:
+                    results.append(self._recv(shard))
+                except RuntimeError as e:
+                    # 先收完其余分片的结果, 管道中不留下未读的响应
+                    results.append(e)
+        for result in results:
+            if isinstance(result, RuntimeError):
+                raise result
+        return results
+
+    def close(self):
+        """通知所有 worker 退出"""
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                conn.send(None)
+                conn.close()
+            except OSError:
+                pass
+        for process in self._processes:
+            process.wait()
+
+
+class ShardedBM25Partition:
+    """分片后的 BM25 分区, 接口与 BM25Partition 一致
+
+    查询时协调者汇总各分片的文档数、总长度和文档频率, 按全库统计算出 idf 与 avgdl 再下发给各分片,
+    因此各分片的分数与单机索引完全一致; top-k 按分数合并, softmax 分母按各分片最高分换算后相加.
+    """
+
+    def __init__(self, pool, name, epsilon=0.25):
+        self.pool = pool
+        self.name = name
+        self.epsilon = epsilon
+        # 全局统计缓存: (文档数, 总长度, {词: 文档频率}, 平均 idf), 增删问题后置空
+        self._stats = None
+
+    def _global_stats(self):
+        if self._stats is None:
+            corpus_size, total_len, df = 0, 0.0, Counter()
+            for size, length, shard_df in self.pool.broadcast('term_stats', self.name):
+                corpus_size += size
+                total_len += length
+                df.update(shard_df)
+            # 平均 idf 与 BM25Okapi 一致: 对全库词表中出现过的所有词取平均
+            values = np.fromiter(df.values(), dtype=np.float64, count=len(df))
+            idf = np.log(corpus_size - values + 0.5) - np.log(values + 0.5)
+            average_idf = float(idf.mean()) if len(idf) else 0.0
+            self._stats = (corpus_size, total_len, df, average_idf)
+        return self._stats
+
+    def _query_idf(self, tokens):
+        # 查询词 -> 全局 idf, 负值替换为 epsilon * 平均 idf; 全库没有的词不下发
+        corpus_size, total_len, df, average_idf = self._global_stats()
+        idf = {}
+        for token in set(tokens):
+            freq = df.get(token)
+            if freq:
+                value = math.log(corpus_size - freq + 0.5) - math.log(freq + 0.5)
+                idf[token] = value if value >= 0 else self.epsilon * average_idf
+        return idf, (total_len / corpus_size if corpus_size else 0.0)
+
+    def __contains__(self, question_id):
+        return self.pool.call(shard_of(question_id, self.pool.num_shards), 'contains', self.name, question_id)
+
+    def __len__(self):
+        return sum(self.pool.broadcast('len', self.name))
+
+    def write(self, snapshot_dir, version, name, lock=None):
+        """各分片把自己的部分写成 name@分片编号 的快照; 分片 worker 单线程处理请求, 不需要 lock"""
+        self.pool.broadcast('write', name, snapshot_dir, version)
+
+    def add(self, question_id, tokens, question, answer):
+        self.pool.call(shard_of(question_id, self.pool.num_shards), 'add', self.name,
+                       question_id, tokens, question, answer)
+        self._stats = None
+
+    def delete(self, question_id):
+        deleted = self.pool.call(shard_of(question_id, self.pool.num_shards), 'delete', self.name, question_id)
+        if deleted:
+            self._stats = None
+        return deleted
+
+    def find_exact(self, normalized):
+        """各分片并行精确匹配, 多个分片命中时取问题 id 最小的一条"""
+        hits = [hit for hit in self.pool.broadcast('find_exact', self.name, normalized) if hit is not None]
+        return min(hits, key=lambda hit: hit[0]) if hits else None
+
+    def top_k(self, tokens, k):
+        """分发查询到所有分片并合并, 返回 ([(问题 id, 问题, 答案, 分数), ...], softmax 置信度)"""
+        idf, avgdl = self._query_idf(tokens)
+        if not idf:
+            return [], 0.0
+        results = self.pool.broadcast('top_k_stats', self.name, tokens, k, idf, avgdl)
+        # 分数降序, 同分按问题 id 升序: 建库按 id 顺序读入, id 顺序即单机索引中的位置顺序, 与 BM25Index.top_k 的同分顺序一致.
+        # 各分片按各自的分数上界决定累加查询词的顺序, 相同文档在不同分片上的分数可能差最后一位, 比较前先舍入
+        hits = sorted((hit for shard_hits, _, _ in results for hit in shard_hits),
+                      key=lambda hit: (-round(hit[3], SCORE_DIGITS), hit[0]))[:k]
+        if not hits:
+            return [], 0.0
+        # 各分片的分母以各自最高分为基准, 换算到全局最高分后相加即为全库 softmax 分母
+        max_score = max(shard_max for _, shard_max, denominator in results if denominator)
+        denominator = sum(denominator * math.exp(shard_max - max_score)
+                          for _, shard_max, denominator in results if denominator)
+        return hits, math.exp(hits[0][3] - max_score) / denominator
+
+
+if __name__ == '__main__':
+    # 分片 worker 入口: python bm25_shards.py host:port, 认证密钥从环境变量读取
+    host, _, port = sys.argv[1].rpartition(':')
+    serve((host, int(port)), bytes.fromhex(os.environ[AUTHKEY_ENV]))
@@ -0,0 +1,296 @@
+# retrieval/bm25_snapshot.py
+# BM25 索引的二进制快照: 词表、倒排、问题偏移全部放在一个连续文件里, 各 worker 通过 mmap 共享
+import mmap
+import os
+import struct
+import time
+import uuid
+
+# 导入数值计算库
+import numpy as np
+# 导入稀疏矩阵
+from scipy import sparse
+
+from retrieval.bm25_index import BM25Index
+
+# 文件魔数和格式版本, 格式不兼容时递增 FORMAT_VERSION
+MAGIC = b'EDUBM25\0'
+FORMAT_VERSION = 1
+# 文件头: 魔数、格式版本、段数量、k1、b、epsilon、文档数、词数
+_HEADER = struct.Struct('<8sIIdddqq')
+# 段目录: 段名、偏移、字节数
+_SECTION = struct.Struct('<16sqq')
+# 各段按 8 字节对齐, 保证 np.frombuffer 得到的数组地址对齐
+_ALIGN = 8
+
+
+def new_version():
+    """生成快照版本号: 时间戳 + 随机后缀, 按字典序即按时间排序"""
+    return f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def snapshot_path(snapshot_dir, version, partition='all'):
+    # (版本号, 分区) -> 快照文件路径; 同一版本的各分区文件一起发布
+    return os.path.join(snapshot_dir, f'bm25_{version}.{partition}.snap')
+
+
+def _parse_name(name):
+    # 快照文件名 -> (版本号, 分区), 不是快照文件时返回 None
+    if not (name.startswith('bm25_') and name.endswith('.snap')):
+        return None
+    version, _, partition = name[len('bm25_'):-len('.snap')].partition('.')
+    return version, partition
+
+
+def list_partitions(snapshot_dir, version):
+    """列出某个版本快照包含的所有分区"""
+    if not os.path.isdir(snapshot_dir):
+        return []
+    parsed = (_parse_name(name) for name in os.listdir(snapshot_dir))
+    return sorted(item[1] for item in parsed if item and item[0] == version)
+
+
+def remove_old_snapshots(snapshot_dir, keep=2):
+    """只保留最新的 keep 个版本的快照文件; 仍被其他进程映射的旧文件删除后依然可读, 直到对方关闭"""
+    names = [name for name in os.listdir(snapshot_dir) if _parse_name(name)]
+    versions = sorted({_parse_name(name)[0] for name in names})
+    stale = set(versions[:-keep])
+    for name in names:
+        if _parse_name(name)[0] in stale:
+            try:
+                os.remove(os.path.join(snapshot_dir, name))
+            except OSError:
+                pass
+
+
+def _encode_strings(strings):
+    # 字符串列表 -> (偏移数组, utf-8 拼接字节)
+    encoded = [text.encode('utf-8') for text in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.array([len(item) for item in encoded], dtype=np.int64), out=offsets[1:])
+    return offsets, b''.join(encoded)
+
+
+def write_snapshot(path, index, questions, answers=None, extra_sections=(), tf=None):
+    """把 BM25Index 和按位置对齐的原始问题(及答案)写成快照文件, 只保留存活文档并重新编号
+
+    只读取 index, 不修改它; tf 为 index.compacted_tf(), 不传时现算.
+    extra_sections 为附加的 (段名, 数组), 其中的文档位置需已按存活文档重新编号;
+    先写临时文件再原子替换, 正在读取旧文件的进程不受影响
+    """
+    positions = np.flatnonzero(index.alive[:len(index.doc_keys)])
+    if tf is None:
+        tf = index.compacted_tf()
+    # 词表按字典序排列, 读取时二分查找即可, 不需要反序列化成 dict
+    terms = sorted(index.vocab.items())
+    order = np.array([term_id for _, term_id in terms], dtype=np.int64)
+    tf = tf[order][:, positions].tocsr()
+    tf.sort_indices()
+    vocab_offsets, vocab_blob = _encode_strings([term for term, _ in terms])
+    question_offsets, question_blob = _encode_strings([questions[pos] for pos in positions])
+    doc_len = index.doc_len[positions]
+    # 词统计随文档重新编号后重算
+    df = np.diff(tf.indptr).astype(np.int64)
+    max_tf = np.zeros(len(terms))
+    min_dl = np.full(len(terms), np.inf)
+    rows = np.repeat(np.arange(len(terms)), df)
+    np.maximum.at(max_tf, rows, tf.data)
+    np.minimum.at(min_dl, rows, doc_len[tf.indices])
+
+    sections = [
+        ('vocab_offsets', vocab_offsets),
+        ('vocab_blob', np.frombuffer(vocab_blob, dtype=np.uint8)),
+        ('indptr', tf.indptr.astype(np.int32)),
+        ('indices', tf.indices.astype(np.int32)),
+        ('tf', tf.data.astype(np.int32)),
+        ('doc_len', doc_len.astype(np.float64)),
+        ('doc_keys', np.array([index.doc_keys[pos] for pos in positions], dtype=np.int64)),
+        ('df', df),
+        ('max_tf', max_tf),
+        ('min_dl', min_dl),
+        ('question_offsets', question_offsets),
+        ('question_blob', np.frombuffer(question_blob, dtype=np.uint8)),
+    ]
+    if answers is not None:
+        # 答案与问题按同样的位置对齐, 命中后直接从快照取答案
+        answer_offsets, answer_blob = _encode_strings([answers[pos] for pos in positions])
+        sections += [('answer_offsets', answer_offsets),
+                     ('answer_blob', np.frombuffer(answer_blob, dtype=np.uint8))]
+    sections += list(extra_sections)
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(sections), index.k1, index.b, index.epsilon,
+                          len(positions), len(terms))
+    offset = _HEADER.size + _SECTION.size * len(sections)
+    directory = []
+    for name, array in sections:
+        offset += -offset % _ALIGN
+        directory.append(_SECTION.pack(name.encode('ascii'), offset, array.nbytes))
+        offset += array.nbytes
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(b''.join(directory))
+        for name, array in sections:
+            f.write(b'\0' * (-f.tell() % _ALIGN))
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp_path, path)
+
+
+class _AppendOnlySequence:
+    # 只读基础段 + 内存追加段组成的序列, 基础段直接读 mmap
+    def __init__(self, size):
+        self._size = size
+        self._extra = []
+
+    def _base_item(self, i):
+        raise NotImplementedError
+
+    def __len__(self):
+        return self._size + len(self._extra)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < self._size:
+            return self._base_item(i)
+        return self._extra[i - self._size]
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield self._base_item(i)
+        yield from self._extra
+
+    def append(self, value):
+        self._extra.append(value)
+
+
+class SnapshotStrings(_AppendOnlySequence):
+    """快照中按位置排列的字符串(如原始问题), 访问时才解码"""
+
+    def __init__(self, buffer, blob_offset, offsets):
+        super().__init__(len(offsets) - 1)
+        self._buffer = buffer
+        self._blob_offset = blob_offset
+        self._offsets = offsets
+
+    def _base_item(self, i):
+        start = self._blob_offset + int(self._offsets[i])
+        end = self._blob_offset + int(self._offsets[i + 1])
+        return self._buffer[start:end].decode('utf-8')
+
+
+class SnapshotArray(_AppendOnlySequence):
+    """快照中的整数数组(如文档 id), 支持在内存中追加"""
+
+    def __init__(self, array):
+        super().__init__(len(array))
+        self._array = array
+
+    def _base_item(self, i):
+        return int(self._array[i])
+
+    def __iter__(self):
+        yield from self._array.tolist()
+        yield from self._extra
+
+
+class SnapshotVocab:
+    """快照中的有序词表: 在 mmap 上二分查找词 id, 新词放在内存中, id 接在快照词表之后"""
+
+    def __init__(self, buffer, blob_offset, offsets):
+        self._buffer = buffer
+        self._blob_offset = blob_offset
+        self._offsets = offsets
+        self._size = len(offsets) - 1
+        self._extra = {}
+
+    def _term(self, i):
+        start = self._blob_offset + int(self._offsets[i])
+        end = self._blob_offset + int(self._offsets[i + 1])
+        return self._buffer[start:end]
+
+    def _find(self, token):
+        # utf-8 字节序与 unicode 码点序一致, 可以直接按字节二分
+        target = token.encode('utf-8')
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._size and self._term(lo) == target:
+            return lo
+        return self._extra.get(token)
+
+    def __len__(self):
+        return self._size + len(self._extra)
+
+    def __contains__(self, token):
+        return self._find(token) is not None
+
+    def __getitem__(self, token):
+        term_id = self._find(token)
+        if term_id is None:
+            raise KeyError(token)
+        return term_id
+
+    def get(self, token, default=None):
+        term_id = self._find(token)
+        return default if term_id is None else term_id
+
+    def setdefault(self, token, default):
+        term_id = self._find(token)
+        if term_id is None:
+            term_id = self._extra[token] = default
+        return term_id
+
+    def items(self):
+        for i in range(self._size):
+            yield self._term(i).decode('utf-8'), i
+        yield from self._extra.items()
+
+
+class BM25Snapshot:
+    """以只读 mmap 打开快照文件, 启动只是缺页换入, 多个 worker 共享同一份物理内存"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_sections, self.k1, self.b, self.epsilon, self.n_docs, self.n_terms = \
+            _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'不支持的 BM25 快照格式: {path} (magic={magic!r}, version={version})')
+        self._sections = {}
+        for i in range(n_sections):
+            name, offset, nbytes = _SECTION.unpack_from(self._mmap, _HEADER.size + i * _SECTION.size)
+            self._sections[name.rstrip(b'\0').decode('ascii')] = (offset, nbytes)
+
+    def __contains__(self, name):
+        return name in self._sections
+
+    def array(self, name, dtype):
+        """把一个段映射成只读 numpy 数组(零拷贝)"""
+        offset, nbytes = self._sections[name]
+        dtype = np.dtype(dtype)
+        return np.frombuffer(self._mmap, dtype=dtype, count=nbytes // dtype.itemsize, offset=offset)
+
+    def strings(self, name):
+        """按位置访问的字符串段, 由 <name>_offsets 和 <name>_blob 两段组成; 快照中没有该段时返回 None"""
+        if f'{name}_blob' not in self._sections:
+            return None
+        return SnapshotStrings(self._mmap, self._sections[f'{name}_blob'][0], self.array(f'{name}_offsets', np.int64))
+
+    def index(self, **kwargs):
+        """用快照中的数组装配 BM25Index; 只有词统计这类按词数计的小数组会被拷贝"""
+        tf = sparse.csr_matrix((self.array('tf', np.int32), self.array('indices', np.int32),
+                                self.array('indptr', np.int32)), shape=(self.n_terms, self.n_docs))
+        vocab = SnapshotVocab(self._mmap, self._sections['vocab_blob'][0], self.array('vocab_offsets', np.int64))
+        index = BM25Index(k1=self.k1, b=self.b, epsilon=self.epsilon, **kwargs)
+        return index.load_arrays(vocab, tf, self.array('doc_len', np.float64),
+                                 SnapshotArray(self.array('doc_keys', np.int64)),
+                                 self.array('df', np.int64).copy(),
+                                 self.array('max_tf', np.float64).copy(),
+                                 self.array('min_dl', np.float64).copy())
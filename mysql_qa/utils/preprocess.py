@@ -2,27 +2,250 @@
 # 导入分词库
 import jieba
 # 导入日志
+import hashlib
+import marshal
 import os
+import subprocess
 import sys
+import tempfile
+import threading
+import unicodedata
+from contextlib import contextmanager
+from functools import lru_cache
+from multiprocessing.connection import Client, Listener, wait
+
 cur_dir = os.path.dirname(os.path.abspath(__file__))
 mysql_dir =os.path.dirname(cur_dir)
 project_dir =os.path.dirname(mysql_dir)
 sys.path.insert(0,project_dir)
-from base import logger
+from base import Config, logger
+
+# 分词 worker 连接父进程时使用的认证密钥, 通过环境变量传递, 不出现在命令行里
+AUTHKEY_ENV = 'TOKENIZER_POOL_AUTHKEY'
+
+
+class Tokenizer:
+    """jieba 分词服务: 启动时加载词典, 重复查询走 LRU 缓存, 建库时多进程批量分词"""
+
+    def __init__(self, user_dict=None, cache_dir=None, cache_size=10000, processes=0):
+        # 领域词典和词典缓存目录
+        self.user_dict = user_dict
+        self.cache_dir = cache_dir or tempfile.gettempdir()
+        # 批量分词的进程数, 0 表示使用全部 CPU
+        self.processes = processes or os.cpu_count() or 1
+        # 独立的 jieba 分词器, 不影响全局 jieba 的状态
+        self.jieba = jieba.Tokenizer()
+        self._load_dictionary()
+        # 每个实例单独一份 LRU 缓存, 缓存元组避免调用方修改缓存中的结果
+        self._cached_cut = lru_cache(maxsize=cache_size)(self._cut)
+
+    def _load_dictionary(self):
+        # 立即加载词典, 避免第一次查询时才花一秒左右构建前缀词典;
+        # 主词典 + 领域词典合并后的前缀词典按领域词典内容的哈希缓存, 词典不变时启动直接读缓存
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.jieba.tmp_dir = self.cache_dir
+        if not self.user_dict or not os.path.exists(self.user_dict):
+            self.jieba.initialize()
+            return
+        with open(self.user_dict, 'rb') as f:
+            digest = hashlib.md5(f.read()).hexdigest()
+        cache_path = os.path.join(self.cache_dir, f'jieba.user.{digest}.cache')
+        try:
+            with open(cache_path, 'rb') as f:
+                self.jieba.FREQ, self.jieba.total = marshal.load(f)
+            self.jieba.initialized = True
+            logger.info(f'从缓存加载领域词典: {cache_path}')
+            return
+        except (OSError, ValueError, EOFError, TypeError):
+            pass
+        self.jieba.initialize()
+        self.jieba.load_userdict(self.user_dict)
+        # 先写临时文件再原子替换, 多个进程同时构建时不会读到写了一半的缓存
+        tmp_path = f'{cache_path}.tmp-{os.getpid()}'
+        try:
+            with open(tmp_path, 'wb') as f:
+                marshal.dump((self.jieba.FREQ, self.jieba.total), f)
+            os.replace(tmp_path, cache_path)
+            logger.info(f'领域词典已加载并缓存: {self.user_dict}')
+        except OSError as e:
+            logger.error(f'领域词典缓存写入失败: {e}')
+
+    def _cut(self, text):
+        # 分词并转换为小写
+        return tuple(self.jieba.lcut(text.lower()))
+
+    def cut(self, text):
+        """分词, 不经过缓存(用于建库等不会重复的文本)"""
+        try:
+            return list(self._cut(text))
+        except AttributeError as e:
+            # 记录预处理失败
+            logger.error(f"文本预处理失败: {e}")
+            # 返回空列表
+            return []
+
+    def tokenize(self, text):
+        """查询分词, 相同文本直接返回缓存结果"""
+        logger.debug("开始预处理文本")
+        try:
+            return list(self._cached_cut(text))
+        except AttributeError as e:
+            # 记录预处理失败
+            logger.error(f"文本预处理失败: {e}")
+            # 返回空列表
+            return []
+
+    def tokenize_many(self, texts, chunksize=256):
+        """批量分词, 文本较多时用多进程并行, 结果与输入顺序一致"""
+        with self.pool(chunksize) as tokenize_many:
+            return tokenize_many(texts)
+
+    @contextmanager
+    def pool(self, chunksize=256):
+        """多批分词共用一个进程池: with tokenizer.pool() as tokenize_many: tokenize_many(texts) ...
+
+        进程池在第一批足够多的文本到来时才创建, 退出上下文时关闭; 流式建库、导入时各批共用, 不再每批启动一次.
+        worker 是独立启动的 Python 进程, 不 fork 当前进程: 服务进程里有缓存失效监听、会话写入、BM25 版本监听等线程,
+        fork 会把其他线程持有的锁原样复制到子进程里
+        """
+        pool = None
+
+        def tokenize_many(texts):
+            nonlocal pool
+            texts = list(texts)
+            if pool is None:
+                processes = min(self.processes, len(texts) // chunksize + 1)
+                if processes <= 1:
+                    return [self.cut(text) for text in texts]
+                pool = _TokenizerPool(self, processes)
+            return pool.map(texts, chunksize)
+
+        try:
+            yield tokenize_many
+        finally:
+            if pool is not None:
+                pool.close()
+
+
+class _TokenizerPool:
+    """一组批量分词的 worker 进程
+
+    worker 以独立脚本方式启动(不经过 fork, 也不经过 multiprocessing 的 spawn, 不会重新导入启动脚本),
+    启动后反向连接父进程监听的地址, 从词典缓存加载分词器; 文本按块分发, 哪个 worker 空闲就把下一块发给它.
+    """
+
+    def __init__(self, tokenizer, processes):
+        authkey = os.urandom(16)
+        env = dict(os.environ, **{AUTHKEY_ENV: authkey.hex()})
+        self._conns = []
+        with Listener(('127.0.0.1', 0), authkey=authkey) as listener:
+            address = '%s:%d' % listener.address
+            self._processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__), address], env=env)
+                               for _ in range(processes)]
+            for _ in range(processes):
+                conn = listener.accept()
+                conn.send((tokenizer.user_dict, tokenizer.cache_dir))
+                self._conns.append(conn)
+        # 等所有 worker 加载完词典
+        for conn in self._conns:
+            conn.recv()
+
+    def map(self, texts, chunksize):
+        """并行分词, 结果与输入顺序一致"""
+        chunks = iter(enumerate(range(0, len(texts), chunksize)))
+        results = {}
+        # 连接 -> 正在处理的块编号
+        busy = {}
+
+        def dispatch(conn):
+            item = next(chunks, None)
+            if item is not None:
+                index, start = item
+                conn.send(texts[start:start + chunksize])
+                busy[conn] = index
+
+        for conn in self._conns:
+            dispatch(conn)
+        while busy:
+            for conn in wait(list(busy)):
+                results[busy.pop(conn)] = conn.recv()
+                dispatch(conn)
+        return [tokens for index in range(len(results)) for tokens in results[index]]
+
+    def close(self):
+        """通知所有 worker 退出"""
+        for conn in self._conns:
+            try:
+                conn.send(None)
+                conn.close()
+            except OSError:
+                pass
+        for process in self._processes:
+            process.wait()
+
+
+def serve(address, authkey):
+    """分词 worker 主循环: 连接父进程, 从词典缓存加载分词器, 逐块分词, 连接断开或收到 None 时退出"""
+    conn = Client(address, authkey=authkey)
+    user_dict, cache_dir = conn.recv()
+    tokenizer = Tokenizer(user_dict=user_dict, cache_dir=cache_dir, cache_size=0, processes=1)
+    conn.send('ok')
+    while True:
+        try:
+            texts = conn.recv()
+        except EOFError:
+            break
+        if texts is None:
+            break
+        conn.send([tokenizer.cut(text) for text in texts])
+    conn.close()
+
+
+# 进程内共享的分词器, 第一次使用时按配置创建
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer():
+    """获取进程内共享的分词器; 服务启动时调用一次即可把词典加载提前到启动阶段"""
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                config = Config()
+                _tokenizer = Tokenizer(user_dict=config.TOKENIZER_USER_DICT, cache_dir=config.TOKENIZER_CACHE_DIR,
+                                       cache_size=config.TOKENIZER_CACHE_SIZE, processes=config.TOKENIZER_PROCESSES)
+    return _tokenizer
+
 
 def preprocess_text(text):
     # 预处理文本
-    logger.info("开始预处理文本")
-    try:
-        # 分词并转换为小写
-        return jieba.lcut(text.lower())
-    except AttributeError as e:
-        # 记录预处理失败
-        logger.error(f"文本预处理失败: {e}")
-        # 返回空列表
-        return []
+    return get_tokenizer().tokenize(text)
+
+
+def preprocess_many(texts):
+    # 批量预处理文本(建库用)
+    return get_tokenizer().tokenize_many(texts)
+
+
+def preprocess_pool():
+    # 流式建库、导入时多批预处理共用一个分词进程池: with preprocess_pool() as preprocess_batch: ...
+    return get_tokenizer().pool()
+
+
+def normalize_text(text):
+    """归一化问题文本: NFKC(全角转半角)、转小写、去掉标点和空白, 用于精确匹配和缓存键"""
+    if not isinstance(text, str):
+        return ''
+    text = unicodedata.normalize('NFKC', text).lower()
+    return ''.join(ch for ch in text if not ch.isspace() and not unicodedata.category(ch).startswith('P'))
 
 
-if __name__ == '__main__':
+if __name__ == '__main__' and len(sys.argv) > 1:
+    # 分词 worker 入口: python preprocess.py host:port, 认证密钥从环境变量读取
+    host, _, port = sys.argv[1].rpartition(':')
+    serve((host, int(port)), bytes.fromhex(os.environ[AUTHKEY_ENV]))
+elif __name__ == '__main__':
     text = preprocess_text('黑马程序员')
-    print(text)
\ No newline at end of file
+    print(text)
+    print(normalize_text('Python 列表推导式？'))
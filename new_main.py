@@ -1,14 +1,16 @@
 # -*- coidng:utf-8 -*-
 # 导入 MySQL 和 Redis 客户端，管理数据库和缓存
-from mysql_qa import MySQLClient, RedisClient, BM25Search
+from mysql_qa import MySQLClient, AsyncMySQLClient, RedisClient, AsyncRedisClient, AnswerCache, SingleFlight, SessionHistory, BM25Search, migrate
 # 导入 RAG 系统组件，用于知识库检索和答案生成
-from rag_qa import VectorStore, RAGSystem
+from rag_qa import VectorStore, RAGSystem, SemanticCache
 # 导入配置和日志工具，用于系统配置和日志记录
 from base import logger, Config
 # 导入 OpenAI 客户端，用于调用 DashScope API
 from openai import OpenAI
 # 导入时间库，用于记录处理时间
 import time
+# 导入 asyncio，异步接口中把阻塞调用放到线程池执行
+import asyncio
 # 导入 UUID 库，生成唯一会话 ID
 import uuid
 # 导入 pymysql 错误处理，用于数据库操作的异常捕获
@@ -20,11 +22,19 @@ class IntegratedQASystem:
         # 初始化配置对象，加载系统参数
         self.config = Config()
         # 初始化 MySQL 客户端，用于数据库操作
-        self.mysql_client = MySQLClient()
-        # 初始化 Redis 客户端，用于缓存管理
-        self.redis_client = RedisClient()
+        self.mysql_client = MySQLClient(self.config)
+        # 初始化异步 MySQL 客户端，供 FastAPI 的异步请求路径使用，不阻塞事件循环
+        self.async_mysql_client = AsyncMySQLClient(self.config)
+        # 初始化 Redis 客户端，用于缓存管理(进程内共享连接池, 复用已加载的配置)
+        self.redis_client = RedisClient(self.config)
+        # 初始化异步 Redis 客户端，供 FastAPI 的异步请求路径使用，不阻塞事件循环
+        self.async_redis_client = AsyncRedisClient(self.config)
+        # 初始化答案缓存，同步和异步路径共用同一份键空间和进程内一级缓存
+        self.answer_cache = AnswerCache(self.redis_client, self.config, async_redis_client=self.async_redis_client)
         # 初始化 BM25 搜索模块，结合 MySQL 和 Redis
-        self.bm25_search = BM25Search(self.redis_client, self.mysql_client)
+        self.bm25_search = BM25Search(self.redis_client, self.mysql_client, answer_cache=self.answer_cache)
+        # 相同问题并发去重: 同一时刻的相同请求只做一次 RAG 生成, 其余请求回放生成结果
+        self.single_flight = SingleFlight(self.redis_client, self.config, async_redis_client=self.async_redis_client)
         try:
             # 初始化 OpenAI 客户端，连接 DashScope API
             self.client = OpenAI(api_key=self.config.DASHSCOPE_API_KEY,
@@ -38,26 +48,19 @@ class IntegratedQASystem:
         self.vector_store = VectorStore()
         # 初始化 RAG 系统，传入向量存储和 DashScope API 调用函数
         self.rag_system = RAGSystem(self.vector_store, self.call_dashscope)
+        # 初始化语义缓存，换一种说法的相同问题直接返回已生成的答案
+        self.semantic_cache = SemanticCache(self.vector_store.dense_dim)
         # 初始化对话历史表，用于存储会话记录
         self.init_conversation_table()
+        # 初始化会话历史: 最近几轮放在 Redis 定长列表中, 完整记录由后台线程批量写入 MySQL
+        self.session_history = SessionHistory(self.redis_client, self.mysql_client, self.config,
+                                              async_redis_client=self.async_redis_client,
+                                              async_mysql_client=self.async_mysql_client)
 
     def init_conversation_table(self):
-        """初始化MySQL中的conversations表,用于存储对话历史"""
+        """执行数据库迁移: 创建或升级 conversations 等表的结构、索引和分区"""
         try:
-            # 创建 conversations 表,包含会话 ID、问题、答案和时间戳
-            # 使用 utf8mb4 字符集支持emoji和特殊字符
-            self.mysql_client.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS conversations(
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    session_id VARCHAR(36) NOT NULL,
-                    question TEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL,
-                    answer TEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL,
-                    timestamp DATETIME NOT NULL,
-                    INDEX idx_session_id (session_id)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            # 提交数据库事务
-            self.mysql_client.connect.commit()
+            migrate(self.mysql_client, self.config)
             # 记录表初始化成功的日志
             self.logger.info("对话历史表初始化成功")
         except pymysql.MySQLError as e:
@@ -66,6 +69,14 @@ class IntegratedQASystem:
             # 抛出异常，终止初始化
             raise
 
+    def import_knowledge(self, csv_path, local_infile=False):
+        """批量导入知识库 CSV 并让修改生效: 导入(按哈希 upsert)后从 MySQL 重建 BM25 索引并发布快照,
+        其他 worker 随后切换, 答案缓存随知识库版本号递增整体失效; 返回导入条数"""
+        total = self.mysql_client.insert_data(csv_path, local_infile=local_infile)
+        if total:
+            self.bm25_search.rebuild()
+        return total
+
     def call_dashscope(self, prompt):
         """调用DashScope API生成答案（流式输出）"""
         try:
@@ -90,101 +101,111 @@ class IntegratedQASystem:
         except Exception as e:
             # 记录 API 调用失败的错误日志
             self.logger.error(f"LLM调用失败: {e}")
-            # 返回错误信息
-            return f"错误：LLM调用失败 - {e}"
-
-    def _fetch_recent_history(self, session_id):
-        """获取最近5轮对话历史"""
-        try:
-            # 执行 SQL 查询，获取最近 5 轮对话
-            self.mysql_client.cursor.execute("""
-                      SELECT question, answer
-                      FROM conversations
-                      WHERE session_id = %s
-                      ORDER BY timestamp DESC
-                      LIMIT %s
-                  """, (session_id, 5))
-            # print(f'self.mysql_client.cursor.fetchall()---》{self.mysql_client.cursor.fetchall()}')
-            # 将查询结果转换为字典列表
-            history = [{"question": row[0], "answer": row[1]} for row in self.mysql_client.cursor.fetchall()]
-            # 反转结果，按时间正序返回
-            return history[::-1]
-
-        except pymysql.MySQLError as e:
-            # 记录查询失败的错误日志
-            self.logger.error(f"获取对话历史失败: {e}")
-            # 返回空列表
-            return []
+            # 继续抛出, 由调用方区分完整生成和中途失败(失败的输出不能缓存)
+            raise
 
     def get_session_history(self, session_id ):
-        """从MySQL获取会话历史"""
-        # 调用 _fetch_recent_history 获取对话历史
-        return self._fetch_recent_history(session_id)
+        """获取最近几轮对话历史(优先读 Redis, 未命中时回退到 MySQL)"""
+        return self.session_history.get(session_id)
 
     def update_session_history(self, session_id: str, question: str, answer: str) -> list:
-        """更新会话历史到MySQL，保留最近5轮对话"""
-        try:
-            # 插入新的对话记录
-            self.mysql_client.cursor.execute("""
-                INSERT INTO conversations (session_id, question, answer, timestamp)
-                VALUES (%s, %s, %s, NOW())
-            """, (session_id, question, answer))
-            # 获取更新后的对话历史
-            history = self._fetch_recent_history(session_id)
-            # 删除超出 5 轮的旧记录
-            self.mysql_client.cursor.execute("""
-                DELETE FROM conversations
-                WHERE session_id = %s AND id NOT IN (
-                    SELECT id FROM (
-                        SELECT id
-                        FROM conversations
-                        WHERE session_id = %s
-                        ORDER BY timestamp DESC
-                        LIMIT %s
-                    ) AS sub
-                )
-            """, (session_id, session_id, 5))
-            # 提交事务
-            self.mysql_client.connect.commit()
-            # 记录更新成功的日志
-            self.logger.info(f"会话 {session_id} 历史更新成功")
-            # 返回更新后的历史
-            return history
-        except pymysql.MySQLError as e:
-            # 记录数据库操作失败的错误日志
-            self.logger.error(f"更新会话历史失败: {e}")
-            # 回滚事务
-            self.mysql_client.connect.rollback()
-            # 抛出异常
-            raise
-        except Exception as e:
-            # 记录意外错误的日志
-            self.logger.error(f"更新会话历史意外错误: {e}")
-            # 回滚事务
-            self.mysql_client.connect.rollback()
-            # 抛出异常
-            raise
+        """记录一轮对话, 返回最近几轮历史; Redis 同步写入, MySQL 由后台线程批量写入"""
+        history = self.session_history.append(session_id, question, answer)
+        # 记录更新成功的日志
+        self.logger.info(f"会话 {session_id} 历史更新成功")
+        # 返回更新后的历史
+        return history
+
     def clear_session_history(self, session_id: str) -> bool:
         """清除指定会话历史"""
-        try:
-            # 删除指定 session_id 的所有对话记录
-            self.mysql_client.cursor.execute("""
-                DELETE FROM conversations
-                WHERE session_id = %s
-            """, (session_id,))
-            # 提交事务
-            self.mysql_client.connect.commit()
-            # 记录清除成功的日志
-            self.logger.info(f"会话 {session_id} 历史已清除")
-            # 返回 True 表示成功
-            return True
-        except pymysql.MySQLError as e:
-            # 记录清除失败的错误日志
-            self.logger.error(f"清除会话历史失败: {e}")
-            # 回滚事务
-            self.mysql_client.connect.rollback()
-            # 返回 False 表示失败
-            return False
+        return self.session_history.clear(session_id)
+
+    async def aget_session_history(self, session_id):
+        """get_session_history() 的异步版本"""
+        return await self.session_history.aget(session_id)
+
+    async def aupdate_session_history(self, session_id: str, question: str, answer: str) -> list:
+        """update_session_history() 的异步版本"""
+        history = await self.session_history.aappend(session_id, question, answer)
+        self.logger.info(f"会话 {session_id} 历史更新成功")
+        return history
+
+    async def aclear_session_history(self, session_id: str) -> bool:
+        """clear_session_history() 的异步版本"""
+        return await self.session_history.aclear(session_id)
+
+    def _probe_caches(self, query, source_filter, history):
+        """一次往返同时探测 BM25 的答案缓存和 RAG 的答案缓存, 返回 (RAG 缓存键, 缓存的答案, 缓存的 RAG token 列表)"""
+        # RAG 缓存键: 归一化问题 + 学科过滤 + 对话历史的哈希, AnswerCache 再加上知识库版本号
+        key = SingleFlight.key(query, source_filter, history)
+        answer, tokens = self.answer_cache.get_many([('answer', self.bm25_search.cache_key(query, source_filter)),
+                                                     ('rag', key)])
+        return key, answer, tokens
+
+    async def _aprobe_caches(self, query, source_filter, history):
+        """_probe_caches() 的异步版本"""
+        key = SingleFlight.key(query, source_filter, history)
+        answer, tokens = await self.answer_cache.aget_many(
+            [('answer', self.bm25_search.cache_key(query, source_filter)), ('rag', key)])
+        return key, answer, tokens
+
+    def _generate_rag(self, query, source_filter, history, key, cached_tokens=None):
+        """RAG 流式生成: 答案缓存(调用方已探测)命中时按原 token 回放; 未命中时经过 single-flight 生成, 由生成者写缓存"""
+        if cached_tokens:
+            self.logger.info(f"RAG答案缓存命中: {key}")
+            return iter(cached_tokens)
+        # 语义缓存只用于没有对话历史的问题: 有历史时答案依赖上下文, 相似的问题不一定能共用答案
+        vector = None
+        if not history:
+            vector, cached_tokens = self._semantic_lookup(query, source_filter, self.answer_cache.version())
+            if cached_tokens:
+                return iter(cached_tokens)
+        return self.single_flight.run(key, lambda: self._generate_and_cache(key, query, source_filter, history, vector))
+
+    async def _agenerate_rag(self, query, source_filter, history, key, cached_tokens=None):
+        """_generate_rag() 的异步版本(异步 token 生成器): 向量化和语义缓存查找在线程池中执行;
+        生成在 single-flight 的后台线程中进行, 本请求用异步 Redis 客户端读取生成结果, 等待期间不占用线程"""
+        if cached_tokens:
+            self.logger.info(f"RAG答案缓存命中: {key}")
+        vector = None
+        if not cached_tokens and not history:
+            # BGE-M3 向量化和语义缓存的矩阵运算是 CPU 密集的阻塞调用, 放到线程池执行
+            version = await self.answer_cache.aversion()
+            vector, cached_tokens = await asyncio.to_thread(self._semantic_lookup, query, source_filter, version)
+        if cached_tokens:
+            for token in cached_tokens:
+                yield token
+            return
+        async for token in self.single_flight.arun(
+                key, lambda: self._generate_and_cache(key, query, source_filter, history, vector)):
+            yield token
+
+    def _semantic_lookup(self, query, source_filter, version):
+        """语义缓存查找, 返回 (查询向量, 缓存的 token 列表或 None)"""
+        vector = self.vector_store.embed_query(query)[0]
+        return vector, self.semantic_cache.get(vector, source_filter, version)
+
+    def _generate_and_cache(self, key, query, source_filter, history, vector=None):
+        """调用 RAG 系统生成答案, 完整生成后把 token 列表写入答案缓存(和语义缓存)
+
+        生成器的返回值表示是否完整生成: LLM 调用中途失败时输出的是截断的答案或致歉提示, 不写缓存,
+        single-flight 也不会把它当作完整结果发布给其他请求
+        """
+        tokens = []
+        stream = self.rag_system.generate_answer(query, source_filter=source_filter, history=history)
+        while True:
+            try:
+                token = next(stream)
+            except StopIteration as stop:
+                completed = bool(stop.value)
+                break
+            tokens.append(token)
+            yield token
+        if completed and any(tokens):
+            self.answer_cache.set('rag', key, tokens)
+            if vector is not None:
+                self.semantic_cache.put(vector, source_filter, self.answer_cache.version(), tokens)
+        return completed
 
     def query(self, query, source_filter=None, session_id=None):
         # print(f'你好')
@@ -195,8 +216,14 @@ class IntegratedQASystem:
         # 获取对话历史，若无 session_id 则返回空列表
         history = self.get_session_history(session_id) if session_id else []
         # print(f'history--->{history}')
-        # 执行 BM25 搜索，获取答案和是否需要 RAG 的标志
-        answer, need_rag = self.bm25_search.search(query, threshold=0.85)
+        # 一次往返探测 BM25 答案缓存和 RAG 答案缓存; 未命中时执行 BM25 搜索，获取答案和是否需要 RAG 的标志
+        rag_key, answer, cached_tokens = self._probe_caches(query, source_filter, history)
+        if answer:
+            self.logger.info('答案已查询,并返回...')
+            need_rag = False
+        else:
+            answer, need_rag = self.bm25_search.search(query, threshold=0.85, source_filter=source_filter,
+                                                       use_cache=False)
         # print(f'answer-——》{answer}')
         # print(f'need_rag-——》{need_rag}')
         if answer:
@@ -216,7 +243,7 @@ class IntegratedQASystem:
             # 初始化收集完整答案的字符串
             collected_answer = ""
             # 从 RAG 系统获取流式输出
-            for token in self.rag_system.generate_answer(query, source_filter=source_filter, history=history):
+            for token in self._generate_rag(query, source_filter, history, rag_key, cached_tokens):
                 # 累积答案
                 collected_answer += token
                 # 逐 token 返回，标记为部分答案
@@ -240,6 +267,42 @@ class IntegratedQASystem:
             # 一次性返回默认答案，标记为完整
             yield "未找到答案", True
 
+    async def aquery(self, query, source_filter=None, session_id=None):
+        """query() 的异步版本: 缓存和对话历史走异步 Redis / MySQL 客户端, LLM 等阻塞调用放到线程池, 不阻塞事件循环"""
+        start_time = time.time()  # 记录查询开始时间
+        self.logger.info(f"处理查询: '{query}' (会话ID: {session_id})")
+        # 获取对话历史，若无 session_id 则返回空列表
+        history = await self.aget_session_history(session_id) if session_id else []
+        # 一次往返探测两个答案缓存; 未命中时执行 BM25 搜索，获取答案和是否需要 RAG 的标志
+        rag_key, answer, cached_tokens = await self._aprobe_caches(query, source_filter, history)
+        if answer:
+            self.logger.info('答案已查询,并返回...')
+            need_rag = False
+        else:
+            answer, need_rag = await self.bm25_search.asearch(query, threshold=0.85, source_filter=source_filter,
+                                                              use_cache=False)
+        if answer:
+            self.logger.info(f"MySQL答案: {answer}")
+            if session_id:
+                await self.aupdate_session_history(session_id, query, answer)
+            self.logger.info(f"查询处理耗时 {time.time() - start_time:.2f}秒")
+            yield answer, True
+        elif need_rag:
+            self.logger.info("无可靠MySQL答案，回退到RAG")
+            collected_answer = ""
+            # RAG 生成在后台线程中进行, 这里从 Redis 流中异步读取 token, 不占用线程池
+            async for token in self._agenerate_rag(query, source_filter, history, rag_key, cached_tokens):
+                collected_answer += token
+                yield token, False
+            if session_id:
+                await self.aupdate_session_history(session_id, query, collected_answer)
+            self.logger.info(f"查询处理耗时 {time.time() - start_time:.2f}秒")
+            yield "", True
+        else:
+            self.logger.info("未找到答案")
+            self.logger.info(f"查询处理耗时 {time.time() - start_time:.2f}秒")
+            yield "未找到答案", True
+
 
 def main():
     # 定义主函数，提供命令行交互界面
@@ -309,6 +372,6 @@ if __name__ == "__main__":
     # answer = new_qa_system.query(query='什么是AI')
     # for value in answer:
     #     print(value)
-    # # results = new_qa_system._fetch_recent_history(session_id="603db0cf-cfa0-4433-9078-f37f3b29fd7c")
+    # # results = new_qa_system.get_session_history(session_id="603db0cf-cfa0-4433-9078-f37f3b29fd7c")
     # # print(results)
     main()
\ No newline at end of file
@@ -44,6 +44,11 @@ class RAGSystem:
         #   初始化策略选择器
         self.strategy_selector = StrategySelector()
 
+    #   非流式调用大模型: self.llm 是流式的 token 生成器, 拼接全部 token 得到完整输出;
+    #   调用失败时 self.llm 会抛出异常(而不是返回错误提示), 由各检索策略捕获后按检索失败处理
+    def _complete(self, prompt):
+        return ''.join(self.llm(prompt)).strip()
+
     #   定义类似私有方法，使用回溯问题进行检索 （注意讲义中没有加source_filter参数，这里补齐了）
     def _retrieve_with_backtracking(self, query, source_filter):
         logger.info(f"使用回溯问题策略进行检索 (查询: '{query}')")
@@ -51,7 +56,7 @@ class RAGSystem:
         backtrack_prompt_template = RAGPrompts.backtracking_prompt()  # 使用 template 后缀区分
         try:
             #   调用大语言模型生成回溯问题
-            simplified_query = self.llm(backtrack_prompt_template.format(query=query)).strip()
+            simplified_query = self._complete(backtrack_prompt_template.format(query=query))
             logger.info(f"生成的回溯问题: '{simplified_query}'")
             #   使用回溯问题进行检索，并返回检索结果
             return self.vector_store.hybrid_search_with_rerank(
@@ -68,7 +73,7 @@ class RAGSystem:
         subquery_prompt_template = RAGPrompts.subquery_prompt()  # 使用 template 后缀区分
         try:
             #   调用大语言模型生成子查询列表
-            subqueries_text = self.llm(subquery_prompt_template.format(query=query)).strip()
+            subqueries_text = self._complete(subquery_prompt_template.format(query=query))
             # print(f'subqueries_text--》{subqueries_text}')
             subqueries = [q.strip() for q in subqueries_text.split("\n") if q.strip()]
             logger.info(f"生成的子查询: {subqueries}")
@@ -107,7 +112,7 @@ class RAGSystem:
         hyde_prompt_template = RAGPrompts.hyde_prompt()  # 使用 template 后缀区分
         #   调用大语言模型生成假设答案
         try:
-            hypo_answer = self.llm(hyde_prompt_template.format(query=query)).strip()
+            hypo_answer = self._complete(hyde_prompt_template.format(query=query))
             logger.info(f"HyDE 生成的假设答案: '{hypo_answer}'")
             #   使用假设答案进行检索，并返回检索结果
             return self.vector_store.hybrid_search_with_rerank(
@@ -192,6 +197,9 @@ class RAGSystem:
         except Exception as e:
             logger.error(f'调用LLM失败:{e}')
             yield f'抱歉，处理问题时出错，请你联系人工客服：{conf.CUSTOMER_SERVICE_PHONE}'
+            # 生成器的返回值表示是否完整生成: 出错时已输出的内容(截断的答案或致歉提示)不能缓存
+            return False
+        return True
 
 
 if __name__ == '__main__':
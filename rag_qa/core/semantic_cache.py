@@ -0,0 +1,83 @@
+# -*- coding:utf-8 -*-
+# core/semantic_cache.py
+# 语义答案缓存: 用 BGE-M3 稠密向量匹配换一种说法的相同问题, 命中时直接返回已生成的答案
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import sys, os
+# 获取当前文件所在目录的绝对路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+# 获取core文件所在的目录的绝对路径
+rag_qa_path = os.path.dirname(current_dir)
+# 获取根目录文件所在的绝对位置
+project_root = os.path.dirname(rag_qa_path)
+sys.path.insert(0, project_root)
+
+from base import logger, Config
+
+conf = Config()
+
+
+class SemanticCache:
+    """进程内的语义缓存
+
+    向量按行存放在预先分配的矩阵中, 查询时与同一学科的全部向量做一次矩阵乘法(内积即余弦相似度),
+    缓存规模为几千条, 精确的暴力检索比近似索引更快也更简单. 满了按 LRU 淘汰, 淘汰的行直接复用.
+    条目带知识库版本号, 版本变化时整体清空.
+    """
+
+    def __init__(self, dim, max_entries=conf.SEMANTIC_CACHE_SIZE, threshold=conf.SEMANTIC_CACHE_THRESHOLD):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        # 每行对应的学科, 不过滤学科的问题记为 ''; 空行为 None, 不会与任何查询匹配
+        self.sources = np.full(max_entries, None, dtype=object)
+        # 行号 -> 答案, 按访问顺序排列, 最久未访问的在最前
+        self.answers = OrderedDict()
+        self.version = None
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        # 知识库版本变化: 清空所有条目
+        if version != self.version:
+            self.sources[:] = None
+            self.answers.clear()
+            self.version = version
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, vector, source, version):
+        """查找与 vector 相似度不低于阈值、学科相同的已缓存答案, 未命中返回 None"""
+        vector = self._normalize(vector)
+        with self._lock:
+            self._check_version(version)
+            rows = np.flatnonzero(self.sources == (source or ''))
+            if not len(rows):
+                return None
+            scores = self.vectors[rows] @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            row = int(rows[best])
+            self.answers.move_to_end(row)
+            logger.info(f'语义缓存命中, 相似度: {scores[best]:.4f}')
+            return self.answers[row]
+
+    def put(self, vector, source, version, answer):
+        """缓存答案; 已满时淘汰最久未访问的条目"""
+        vector = self._normalize(vector)
+        with self._lock:
+            self._check_version(version)
+            if len(self.answers) < self.max_entries:
+                row = len(self.answers)
+            else:
+                row, _ = self.answers.popitem(last=False)
+            self.vectors[row] = vector
+            self.sources[row] = source or ''
+            self.answers[row] = answer
@@ -11,6 +11,8 @@ from langchain_core.documents import Document
 from sentence_transformers import CrossEncoder
 # 导入 hashlib 模块，用于生成唯一 ID 的哈希值
 import hashlib # 实现MD5编码
+# 导入 lru_cache，缓存最近查询的嵌入
+from functools import lru_cache
 
 # from .document_processor import *
 # from document_processor import *
@@ -66,6 +68,8 @@ class VectorStore:
         self.embedding_function = BGEM3EmbeddingFunction(model_name_or_path=m3_path, use_fp16=(self.device == 'cuda'), device=self.device)
         # 获取稠密向量的维度# 1024
         self.dense_dim = self.embedding_function.dim["dense"]
+        # 最近查询的嵌入缓存: 语义缓存查找和随后的混合检索共用同一次 BGE-M3 计算
+        self.embed_query = lru_cache(maxsize=256)(self._embed_query)
         # 初始化 Milvus 客户端，连接到指定主机和数据库
         self.client = MilvusClient(uri=f"http://{self.host}:{self.port}", db_name=self.database)
         # 调用方法创建或加载 Milvus 集合
@@ -182,12 +186,12 @@ class VectorStore:
             logger.info(f"已插入或更新 {len(data)} 个文档")
 
     # 定义方法，执行混合检索并重排序
-    def hybrid_search_with_rerank(self, query, k=conf.RETRIEVAL_K, source_filter=None):
+    def _embed_query(self, query):
+        """生成查询的 (稠密向量, 稀疏向量字典), 通过 embed_query 调用以复用缓存"""
         # 使用 BGE-M3 嵌入函数生成查询的嵌入
         query_embeddings = self.embedding_function([query])
         # 获取查询的稠密向量
         dense_query_vector = query_embeddings["dense"][0]
-        # print(f'dense_query_vector--》{dense_query_vector.shape}')
         # 初始化查询的稀疏向量字典
         sparse_query_vector = {}
         # 获取查询稀疏向量的第 0 行数据
@@ -199,7 +203,11 @@ class VectorStore:
         # 将索引和值配对，填充稀疏向量字典
         for idx, value in zip(indices, values):
             sparse_query_vector[idx] = value
-        # print(f'sparse_query_vector-->{sparse_query_vector}')
+        return dense_query_vector, sparse_query_vector
+
+    def hybrid_search_with_rerank(self, query, k=conf.RETRIEVAL_K, source_filter=None):
+        # 使用 BGE-M3 嵌入函数生成查询的嵌入(同一查询的嵌入只计算一次)
+        dense_query_vector, sparse_query_vector = self.embed_query(query)
         # 初始化过滤表达式，默认不过滤
         filter_expr = f"source == '{source_filter}'" if source_filter else ""
         # print(f'filter_expr--》{filter_expr}')
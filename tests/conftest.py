@@ -0,0 +1,10 @@
+# tests/conftest.py
+# 测试用的路径设置: 与各模块开头的 sys.path 处理一致, 让测试可以直接导入 base 和 mysql_qa 下的包
+import os
+import sys
+
+tests_dir = os.path.dirname(__file__)
+sys_dir = os.path.dirname(tests_dir)
+qa_dir = os.path.join(sys_dir, 'mysql_qa')
+sys.path.insert(0, qa_dir)
+sys.path.insert(0, sys_dir)
@@ -0,0 +1,130 @@
+# tests/test_bm25_index.py
+# BM25Index / BM25Partition 与 rank_bm25.BM25Okapi 的分数一致性: 建库、增删改、合并增量段、快照读写之后都在新语料上对比
+import random
+
+import numpy as np
+import pytest
+
+BM25Okapi = pytest.importorskip('rank_bm25').BM25Okapi
+
+from retrieval.bm25_index import BM25Index
+from retrieval.bm25_partition import BM25Partition
+from retrieval.bm25_shards import BM25ShardPool, ShardedBM25Partition, write_shards
+from retrieval.bm25_snapshot import new_version, snapshot_path
+
+VOCAB = ['python', '列表', '推导式', '装饰器', 'java', '是', '什么', '如何', '安装', '虚拟环境', '函数', '类',
+         '继承', '多线程', '锁', '数据库', '索引', '事务', 'redis', '缓存', '过期', '分词', 'jieba', '词典']
+QUERIES = [['python', '是', '什么'], ['装饰器'], ['redis', '缓存', '缓存'], ['java', '多线程', '锁'],
+           ['不存在的词'], ['数据库', '索引', '事务', 'python']]
+
+
+def _corpus(seed, size):
+    # 固定随机种子的语料, 末尾追加几条重复文档制造同分
+    rng = random.Random(seed)
+    docs = [[rng.choice(VOCAB) for _ in range(rng.randint(1, 12))] for _ in range(size)]
+    return docs + docs[:5]
+
+
+def _expected(docs, query):
+    # 在当前存活文档上重建 BM25Okapi 的分数: {文档键: 分数}
+    keys = list(docs)
+    scores = BM25Okapi([docs[key] for key in keys]).get_scores(query)
+    return dict(zip(keys, scores))
+
+
+def _assert_parity(index, docs):
+    # 按文档键对比全量分数, 并检查 top-k 取的是分数最高的文档(同分按位置顺序)
+    alive = np.flatnonzero(index.alive[:len(index.doc_keys)])
+    assert [index.doc_keys[pos] for pos in alive] == list(docs)
+    for query in QUERIES:
+        expected = _expected(docs, query)
+        scores = index.get_scores(query)
+        actual = {index.doc_keys[pos]: scores[pos] for pos in alive}
+        assert actual == pytest.approx(expected)
+        positions, top_scores, _ = index.top_k(query, k=5)
+        ranked = sorted(range(len(alive)), key=lambda i: -expected[index.doc_keys[alive[i]]])
+        assert list(top_scores) == pytest.approx([expected[index.doc_keys[alive[i]]] for i in ranked[:len(positions)]])
+
+
+def test_build_matches_bm25okapi():
+    docs = dict(enumerate(_corpus(1, 200)))
+    index = BM25Index(list(docs.values()), doc_keys=list(docs))
+    _assert_parity(index, docs)
+
+
+@pytest.mark.parametrize('compact_ratio', [0.1, 0.001])
+def test_incremental_edits_match_bm25okapi(compact_ratio):
+    # compact_ratio 很小时几乎每次修改都合并增量段, 两种路径都要与重建一致
+    rng = random.Random(2)
+    docs = dict(enumerate(_corpus(2, 120)))
+    index = BM25Index(list(docs.values()), doc_keys=list(docs), compact_ratio=compact_ratio)
+    next_key = len(docs)
+    for step in range(60):
+        action = rng.choice(['add', 'update', 'delete'])
+        if action == 'add':
+            tokens = [rng.choice(VOCAB + [f'新词{step}']) for _ in range(rng.randint(1, 8))]
+            index.add(next_key, tokens)
+            docs[next_key] = tokens
+            next_key += 1
+        elif action == 'update':
+            key = rng.choice(list(docs))
+            tokens = [rng.choice(VOCAB) for _ in range(rng.randint(1, 8))]
+            index.update(key, tokens)
+            # 更新后的文档移到末尾, 与索引中的新位置一致
+            del docs[key]
+            docs[key] = tokens
+        else:
+            key = rng.choice(list(docs))
+            assert index.delete(key)
+            del docs[key]
+        if step % 10 == 9:
+            _assert_parity(index, docs)
+    index.compact()
+    _assert_parity(index, docs)
+
+
+def test_snapshot_round_trip(tmp_path):
+    corpus = _corpus(3, 150)
+    rows = [(key, ' '.join(tokens), f'答案{key}', tokens) for key, tokens in enumerate(corpus)]
+    partition = BM25Partition.build(rows)
+    docs = {key: tokens for key, _, _, tokens in rows}
+    partition.add(1000, ['python', '装饰器', '新问题'], 'python 装饰器 新问题', '答案1000')
+    docs[1000] = ['python', '装饰器', '新问题']
+    assert partition.delete(3)
+    del docs[3]
+    version = new_version()
+    partition.write(str(tmp_path), version, 'all')
+    opened = BM25Partition.open(snapshot_path(str(tmp_path), version, 'all'))
+    _assert_parity(opened.index, docs)
+    for query in QUERIES:
+        assert opened.top_k(query, 5) == pytest.approx(partition.top_k(query, 5))
+    assert opened.find_exact('python装饰器新问题')[0] == 1000
+    assert 3 not in opened and len(opened) == len(docs)
+    # 打开的快照上继续增删, 分数仍与重建一致
+    opened.add(1001, ['redis', '过期'], 'redis 过期', '答案1001')
+    docs[1001] = ['redis', '过期']
+    assert opened.delete(0)
+    del docs[0]
+    _assert_parity(opened.index, docs)
+
+
+def test_sharded_top_k_matches_single_index(tmp_path):
+    corpus = _corpus(4, 200)
+    rows = [(key + 1, ' '.join(tokens), f'答案{key + 1}', tokens) for key, tokens in enumerate(corpus)]
+    single = BM25Partition.build(rows)
+    pool = BM25ShardPool(write_shards({'all': rows}, str(tmp_path), new_version(), 3))
+    try:
+        sharded = ShardedBM25Partition(pool, 'all')
+        for query in QUERIES + [row[3] for row in rows[-5:]]:
+            expected, _ = single.top_k(query, 5)
+            hits, confidence = sharded.top_k(query, 5)
+            # 同分文档(重复问题)落在不同分片时, 顺序也与单机索引一致
+            assert [hit[0] for hit in hits] == [hit[0] for hit in expected]
+            assert [hit[3] for hit in hits] == pytest.approx([hit[3] for hit in expected])
+            # 置信度是全库 softmax 最大值的保守下界(发生剪枝时分母按分数上界估计)
+            if hits:
+                scores = BM25Okapi([row[3] for row in rows]).get_scores(query)
+                exact = 1.0 / np.exp(scores - scores.max()).sum()
+                assert 0 < confidence <= exact + 1e-12
+    finally:
+        pool.close()
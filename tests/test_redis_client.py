@@ -0,0 +1,80 @@
+# tests/test_redis_client.py
+# Redis 批量读写(get_many / set_many / push_capped)和 AnswerCache.get_many 的测试, 使用 fakeredis
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+
+from base import Config
+import cache.RedisClient as redis_client_module
+from cache.AnswerCache import AnswerCache
+from cache.AsyncRedisClient import AsyncRedisClient
+from cache.RedisClient import RedisClient
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def config():
+    config = Config()
+    # 测试不修改 Redis 的内存配置, 也不启动一级缓存的失效监听线程
+    config.CACHE_MAX_MEMORY = ''
+    config.CACHE_L1_SIZE = 0
+    return config
+
+
+@pytest.fixture
+def client(monkeypatch, server, config):
+    monkeypatch.setattr(redis_client_module, '_redis_client',
+                        lambda config, blocking=False: fakeredis.FakeStrictRedis(server=server))
+    return RedisClient(config)
+
+
+@pytest.fixture
+def async_client(monkeypatch, server, config):
+    monkeypatch.setattr(AsyncRedisClient, '_connect',
+                        staticmethod(lambda config, blocking=False: fakeredis.aioredis.FakeRedis(server=server)))
+    return AsyncRedisClient(config)
+
+
+def test_get_many_set_many(client):
+    client.set_many({'a': {'x': 1}, 'b': ['中文', 2], 'c': 'y' * 5000})
+    assert client.get_many(['a', 'missing', 'b', 'c']) == [{'x': 1}, None, ['中文', 2], 'y' * 5000]
+    assert client.get_many([]) == []
+
+
+def test_push_capped_batch(client):
+    client.push_capped('list', [1, 2, 3], 5, ex=60)
+    client.push_capped('list', [4, 5, 6], 5, ex=60)
+    # 最后写入的在表头, 只保留最新的 5 条
+    assert client.get_list('list') == [6, 5, 4, 3, 2]
+    assert 0 < client.client.ttl('list') <= 60
+
+
+def test_async_batch(client, async_client):
+    async def run():
+        await async_client.set_many({'a': 1, 'b': {'k': 'v'}})
+        await async_client.push_capped('list', [1, 2, 3], 2)
+        return await async_client.get_many(['a', 'b', 'c']), await async_client.get_list('list')
+
+    values, items = asyncio.run(run())
+    assert values == [1, {'k': 'v'}, None]
+    assert items == [3, 2]
+    # 同步客户端读到的值与异步客户端一致
+    assert client.get_many(['a', 'b']) == [1, {'k': 'v'}]
+
+
+def test_answer_cache_get_many(client, async_client, config):
+    cache = AnswerCache(client, config, async_redis_client=async_client)
+    cache.set('answer', 'q1', '答案一')
+    cache.set('rag', 'q2', ['token', '列表'])
+    items = [('answer', 'q1'), ('rag', 'q2'), ('answer', 'q3')]
+    assert cache.get_many(items) == ['答案一', ['token', '列表'], None]
+    assert asyncio.run(cache.aget_many(items)) == ['答案一', ['token', '列表'], None]
+    # 递增版本号后旧缓存全部失效
+    cache.bump_version()
+    assert cache.get_many(items) == [None, None, None]
@@ -0,0 +1,55 @@
+# tests/test_redis_codec.py
+# RedisCodec 各序列化 / 压缩组合的编解码往返, 以及旧 JSON 值的兼容读取
+import json
+
+import pytest
+
+from cache.RedisCodec import COMPRESSIONS, SERIALIZERS, RedisCodec
+
+VALUES = [
+    '短答案',
+    '长答案' * 2000,
+    ['token', '列表', '', '😀'],
+    {'question': 'python 是什么', 'answer': 'x' * 5000, 'score': 0.85, 'ids': [1, 2, 3], 'empty': None},
+    12345,
+    True,
+]
+
+
+@pytest.mark.parametrize('serializer', list(SERIALIZERS))
+@pytest.mark.parametrize('compression', list(COMPRESSIONS))
+@pytest.mark.parametrize('value', VALUES, ids=range(len(VALUES)))
+def test_round_trip(serializer, compression, value):
+    codec = RedisCodec(serializer, compression, compress_threshold=1024)
+    data = codec.encode(value)
+    assert codec.decode(data) == value
+    # 解码只看值自带的标记, 与解码方的配置无关
+    assert RedisCodec('json', 'none').decode(data) == value
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'zstd', 'lz4'])
+def test_compresses_only_above_threshold(compression):
+    codec = RedisCodec('msgpack', compression, compress_threshold=1024)
+    assert codec.encode('短')[2:3] == COMPRESSIONS['none']
+    long_value = '重复内容' * 1000
+    data = codec.encode(long_value)
+    assert data[2:3] == COMPRESSIONS[compression]
+    assert len(data) < len(long_value.encode('utf-8'))
+
+
+def test_decodes_legacy_json():
+    codec = RedisCodec()
+    value = {'answer': '旧的 JSON 值', 'tokens': ['a', 'b']}
+    assert codec.decode(json.dumps(value, ensure_ascii=False).encode('utf-8')) == value
+    assert codec.decode(json.dumps(value)) == value
+    assert codec.decode(None) is None
+    assert codec.decode(b'') is None
+
+
+def test_undecodable_value_returns_none():
+    assert RedisCodec().decode(b'\x00mz not zlib') is None
+
+
+def test_rejects_unknown_codec():
+    with pytest.raises(ValueError):
+        RedisCodec('pickle', 'none')